@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+    compat_benchmark
+    ~~~~~~~~~~~~~~~~
+
+    Compares throughput of :class:`pyxs.xs` and ``xen.lowlevel.xs``
+    (if available) on common calls. Each call is repeated by a number
+    of threads sharing a single handle.
+
+    Usage: compat_benchmark.py [N_CALLS [N_THREADS]]
+
+    :copyright: (c) 2016 by pyxs authors and contributors, see AUTHORS
+                for more details.
+"""
+
+from __future__ import print_function
+
+import sys
+import threading
+import time
+
+import pyxs
+
+ROOT = b"/tool/pyxs-benchmark"
+
+
+def run(handle, name, f, n_calls, n_threads):
+    def worker(i):
+        path = ROOT + b"/" + str(i).encode()
+        for _ in range(n_calls // n_threads):
+            f(handle, path)
+
+    threads = [threading.Thread(target=worker, args=(i, ))
+               for i in range(n_threads)]
+    started = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    elapsed = time.time() - started
+    print("{0:<10} {1:>10.0f} calls/s".format(name, n_calls / elapsed))
+
+
+def transaction(handle, path):
+    tx_id = handle.transaction_start()
+    handle.write(tx_id, path, b"value")
+    handle.transaction_end(tx_id)
+
+
+CALLS = [
+    ("write", lambda h, path: h.write(b"", path, b"value")),
+    ("read", lambda h, path: h.read(b"", path)),
+    ("ls", lambda h, path: h.ls(b"", ROOT)),
+    ("get_perms", lambda h, path: h.get_permissions(b"", path)),
+    ("transaction", transaction),
+]
+
+
+def main(n_calls, n_threads):
+    handles = [("pyxs", pyxs.xs)]
+    try:
+        from xen.lowlevel.xs import xs as cxs
+    except ImportError:
+        print("xen.lowlevel.xs is not available, skipping.")
+    else:
+        handles.append(("xen.lowlevel.xs", cxs))
+
+    for name, cls in handles:
+        print("{0}, {1} calls, {2} threads".format(name, n_calls, n_threads))
+        handle = cls()
+        try:
+            for call, f in CALLS:
+                run(handle, call, f, n_calls, n_threads)
+        finally:
+            handle.rm(b"", ROOT)
+            handle.close()
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    main(*(args + [10000, 8][len(args):]))
@@ -10,15 +10,14 @@
 """
 
 import pyxs
+from pyxs.domains import DomainRegistry
 
-with pyxs.monitor() as m:
-    m.watch(b"@introduceDomain", b"unused")
-    m.watch(b"@releaseDomain", b"unused")
-
-    for wpath, _token in m.wait():
-        # Funny thing is -- XenStored doesn't send us domid of the
-        # event target, so we have to get it manually, via ``xc``.
-        if wpath == b"@introduceDomain":
-            print("Hey, we got a new domain here!")
-        else:
-            print("Ooops, we lost him ...")
+with pyxs.Client() as c:
+    # Funny thing is -- XenStored doesn't send us domid of the event
+    # target, so the registry re-lists ``/local/domain`` to find out.
+    with DomainRegistry(c) as domains:
+        for kind, domid, path in domains.wait():
+            if kind == "introduced":
+                print("Hey, we got a new domain here: {0}!".format(domid))
+            else:
+                print("Ooops, we lost {0} ...".format(domid))
@@ -29,5 +29,5 @@ def monitor(*args, **kwargs):
     constructor.
     """
     with Client(*args, **kwargs) as c:
-        with c.monitor() as m:
+        with c.monitor(dedicated=True) as m:
             yield m
@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+"""
+    pyxs.__main__
+    ~~~~~~~~~~~~~
+
+    A command-line XenStore client, which answers queries over many
+    paths in a single process using pipelined requests::
+
+        $ python -m pyxs dump /local/domain/0
+        $ python -m pyxs ls /local/domain | python -m pyxs -f json read -
+
+    :copyright: (c) 2016 by pyxs authors and contributors, see AUTHORS
+                for more details.
+    :license: LGPL, see LICENSE for more details.
+"""
+
+from __future__ import absolute_import, print_function
+
+import argparse
+import errno
+import json
+import posixpath
+import sys
+import time
+
+from ._internal import NUL, Op
+from .client import Client
+from .exceptions import PyXSError
+from .helpers import check_path, error
+
+
+def escape(value):
+    """Escapes a value the way ``xenstore-ls`` does: backslashes are
+    doubled and non-printable characters are replaced by octal
+    escapes.
+    """
+    chunks = []
+    for char in bytearray(value):
+        if char == 0x5c:
+            chunks.append(b"\\\\")
+        elif char < 0x20 or char > 0x7e:
+            chunks.append("\\{0:03o}".format(char).encode())
+        else:
+            chunks.append(bytes(bytearray([char])))
+    return b"".join(chunks)
+
+
+def _text(value):
+    # Latin-1 maps every byte to a code point, so no data is lost.
+    return value.decode("latin-1")
+
+
+class Output(object):
+    """Renders records in one of the supported formats.
+
+    * ``text`` -- human readable, similar to ``xenstore-*`` tools;
+    * ``json`` -- one JSON object per line;
+    * ``nul`` -- fields and records separated by ``NUL`` bytes.
+    """
+    formats = ["text", "json", "nul"]
+
+    def __init__(self, fmt, stream):
+        self.fmt = fmt
+        self.stream = stream
+        self.records = 0
+
+    def emit(self, text, fields, nul):
+        """Writes a single record.
+
+        :param bytes text: ``text`` representation of the record.
+        :param dict fields: ``json`` representation of the record.
+        :param list nul: ``nul`` representation of the record.
+        """
+        if self.fmt == "text":
+            self.stream.write(text + b"\n")
+        elif self.fmt == "json":
+            self.stream.write(json.dumps(fields, sort_keys=True)
+                              .encode() + b"\n")
+        else:
+            self.stream.write(b"".join(field + NUL for field in nul))
+
+        self.records += 1
+
+
+def _check_paths(paths, stdin):
+    for path in paths:
+        if path == "-":
+            for line in stdin:
+                line = line.strip()
+                if line:
+                    yield check_path(line)
+        else:
+            yield check_path(posixpath.normpath(path).encode())
+
+
+def _error(path, e):
+    print("{0}: {1}".format(_text(path), e.args[-1]), file=sys.stderr)
+
+
+def _children(client, path, reply):
+    try:
+        payload = reply.get()
+    except PyXSError as e:
+        if e.args[0] == errno.E2BIG:
+            return list(client.iter_list(path))
+
+        raise
+
+    return [] if not payload else payload.split(NUL)
+
+
+def cmd_ls(client, args, out):
+    paths = list(args.paths)
+    replies = client.pipeline((Op.DIRECTORY, path + NUL) for path in paths)
+    status = 0
+    for path, reply in zip(paths, replies):
+        try:
+            children = _children(client, path, reply)
+        except PyXSError as e:
+            _error(path, e)
+            status = 1
+            continue
+
+        for child in children:
+            child = posixpath.join(path, child)
+            out.emit(child, {"path": _text(child)}, [child])
+    return status
+
+
+def cmd_read(client, args, out):
+    paths = list(args.paths)
+    replies = client.pipeline((Op.READ, path + NUL) for path in paths)
+    status = 0
+    for path, reply in zip(paths, replies):
+        try:
+            value = reply.get()
+        except PyXSError as e:
+            _error(path, e)
+            status = 1
+            continue
+
+        out.emit(escape(value), {"path": _text(path), "value": _text(value)},
+                 [path, value])
+    return status
+
+
+def cmd_write(client, args, out):
+    if len(args.pairs) % 2:
+        raise SystemExit("usage: write PATH VALUE [PATH VALUE ...]")
+
+    pairs = list(zip(args.pairs[::2], args.pairs[1::2]))
+    commands = [(Op.WRITE, check_path(path.encode()) + NUL, value.encode())
+                for path, value in pairs]
+    for reply in client.pipeline(commands):
+        reply.get()
+    return 0
+
+
+def cmd_rm(client, args, out):
+    paths = list(args.paths)
+    replies = client.pipeline((Op.RM, path + NUL) for path in paths)
+    status = 0
+    for path, reply in zip(paths, replies):
+        try:
+            reply.get()
+        except PyXSError as e:
+            _error(path, e)
+            status = 1
+    return status
+
+
+def cmd_dump(client, args, out):
+    status = 0
+    for top in args.paths:
+        try:
+            for path, value, _children in client.walk(top):
+                out.emit(path + b' = "' + escape(value) + b'"',
+                         {"path": _text(path), "value": _text(value)},
+                         [path, value])
+        except PyXSError as e:
+            _error(top, e)
+            status = 1
+    return status
+
+
+def cmd_stat(client, args, out):
+    paths = list(args.paths)
+    try:
+        stats = client.stat_many(paths)
+    except PyXSError:
+        # The error fails the whole pipeline, so stat one path at a
+        # time to tell which path it is about.
+        stats = []
+        for path in paths:
+            try:
+                stats.extend(client.stat_many([path]))
+            except PyXSError as e:
+                stats.append(e)
+
+    status = 0
+    for path, stat in zip(paths, stats):
+        if stat is None:
+            stat = error(errno.ENOENT)
+        if isinstance(stat, PyXSError):
+            _error(path, stat)
+            status = 1
+            continue
+
+        perms, children, size = stat
+        out.emit(b" ".join([path, b",".join(perms),
+                            "children={0}".format(children).encode(),
+                            "size={0}".format(size).encode()]),
+                 {"path": _text(path), "perms": [_text(p) for p in perms],
+                  "children": children, "size": size},
+                 [path, b" ".join(perms), str(children).encode(),
+                  str(size).encode()])
+    return status
+
+
+def cmd_watch(client, args, out):
+    with client.monitor() as m:
+        for path in args.paths:
+            m.watch(path, path)
+
+        for count, (path, token) in enumerate(m.wait(), 1):
+            out.emit(path + b" " + token,
+                     {"path": _text(path), "token": _text(token)},
+                     [path, token])
+            out.stream.flush()
+            if count == args.count:
+                break
+    return 0
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m pyxs",
+        description="Pure Python XenStore client.")
+    parser.add_argument("--socket", metavar="PATH",
+                        help="path to XenStore Unix domain socket")
+    parser.add_argument("--xenbus", metavar="PATH",
+                        help="path to XenBus device")
+    parser.add_argument("-f", "--format", choices=Output.formats,
+                        default="text", help="output format")
+    parser.add_argument("-t", "--time", action="store_true",
+                        help="report elapsed time to stderr")
+
+    commands = parser.add_subparsers(dest="command")
+    paths_help = "paths to operate on, '-' reads paths from stdin"
+
+    def add_command(name, handler, help, nargs="+"):
+        command = commands.add_parser(name, help=help)
+        command.add_argument("paths", metavar="PATH", nargs=nargs,
+                             help=paths_help)
+        command.set_defaults(handler=handler)
+        return command
+
+    add_command("ls", cmd_ls, "list children of paths")
+    add_command("read", cmd_read, "read values")
+    add_command("rm", cmd_rm, "remove paths recursively")
+    add_command("dump", cmd_dump, "dump subtrees", nargs="*")
+    add_command("stat", cmd_stat, "show permissions and sizes")
+    add_command("watch", cmd_watch, "print watch events").add_argument(
+        "-n", "--count", type=int, default=0,
+        help="exit after receiving COUNT events")
+
+    write = commands.add_parser("write", help="write values")
+    write.add_argument("pairs", metavar="PATH VALUE", nargs="+")
+    write.set_defaults(handler=cmd_write)
+    return parser
+
+
+def main(argv=None, stdout=None, stdin=None):
+    args = make_parser().parse_args(argv)
+    if not hasattr(args, "handler"):
+        raise SystemExit("a command is required, see --help")
+
+    stdout = stdout or getattr(sys.stdout, "buffer", sys.stdout)
+    stdin = stdin or getattr(sys.stdin, "buffer", sys.stdin)
+    if hasattr(args, "paths"):
+        args.paths = _check_paths(args.paths or ["/"], stdin)
+
+    out = Output(args.format, stdout)
+    started = time.time()
+    try:
+        with Client(unix_socket_path=args.socket,
+                    xen_bus_path=args.xenbus) as client:
+            status = args.handler(client, args, out)
+    except PyXSError as e:
+        raise SystemExit("error: {0}".format(e))
+    finally:
+        stdout.flush()
+        if args.time:
+            print("{0} records in {1:.3f}s".format(
+                out.records, time.time() - started), file=sys.stderr)
+
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
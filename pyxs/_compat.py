@@ -16,6 +16,7 @@ from __future__ import absolute_import
 
 __all__ = ["xs", "Error"]
 
+import copy
 import errno
 
 from .client import Client
@@ -25,6 +26,12 @@ from .exceptions import PyXSError as Error
 class xs(object):
     """XenStore client with a backward compatible interface, useful for
     switching from ``xen.lowlevel.xs``.
+
+    .. versionchanged:: 0.4.2
+
+       The handle is safe to share between threads. Each call is made
+       on behalf of the transaction passed to it, so concurrent calls
+       are multiplexed over a single connection.
     """
     def __init__(self):
         self.client = Client()
@@ -35,18 +42,20 @@ class xs(object):
     def close(self):
         self.client.close()
 
+    def _client(self, tx_id):
+        client = copy.copy(self.client)
+        client.tx_id = int(tx_id or 0)
+        return client
+
     def get_permissions(self, tx_id, path):
-        self.client.tx_id = int(tx_id or 0)
-        self.client.get_perms(path)
+        return self._client(tx_id).get_perms(path)
 
     def set_permissions(self, tx_id, path, perms):
-        self.client.tx_id = int(tx_id or 0)
-        self.client.set_perms(path, perms)
+        self._client(tx_id).set_perms(path, perms)
 
     def ls(self, tx_id, path):
-        self.client.tx_id = int(tx_id or 0)
         try:
-            return self.client.list(path)
+            return self._client(tx_id).list(path)
         except Error as e:
             if e.args[0] == errno.ENOENT:
                 return
@@ -54,20 +63,16 @@ class xs(object):
             raise
 
     def mkdir(self, tx_id, path):
-        self.client.tx_id = int(tx_id or 0)
-        self.client.mkdir(path)
+        self._client(tx_id).mkdir(path)
 
     def rm(self, tx_id, path):
-        self.client.tx_id = int(tx_id or 0)
-        self.client.delete(path)
+        self._client(tx_id).delete(path)
 
     def read(self, tx_id, path):
-        self.client.tx_id = int(tx_id or 0)
-        return self.client.read(path)
+        return self._client(tx_id).read(path)
 
     def write(self, tx_id, path, value):
-        self.client.tx_id = int(tx_id or 0)
-        return self.client.write(path, value)
+        return self._client(tx_id).write(path, value)
 
     def get_domain_path(self, domid):
         return self.client.get_domain_path(domid)
@@ -85,22 +90,15 @@ class xs(object):
         self.client.set_target(domid, target)
 
     def transaction_start(self):
-        return str(self.client.transaction()).encode()
+        return str(self._client(0).transaction()).encode()
 
     def transaction_end(self, tx_id, abort=0):
-        self.client.tx_id = int(tx_id or 0)
+        client = self._client(tx_id)
         if abort:
-            self.client.rollback()
+            client.rollback()
+            return True
         else:
-            try:
-                self.client.commit()
-            except Error as e:
-                if e.args[0] == errno.EAGAIN:
-                    return False
-
-                raise
-
-        return True
+            return client.commit()
 
     def watch(self, path, token):
         # Even though ``xs.watch`` docstring states that token should be
@@ -118,5 +116,5 @@ class xs(object):
         del self.token_aliases[stub]
 
     def read_watch(self):
-        event = next(self.monitor.wait())
+        event = self.monitor.next_event()
         return event._replace(token=self.token_aliases[event.token])
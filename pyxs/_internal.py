@@ -13,7 +13,7 @@
 
 from __future__ import absolute_import
 
-__all__ = ["NUL", "Event", "Op", "Packet", "next_rq_id"]
+__all__ = ["NUL", "Event", "Delta", "Stat", "Op", "Packet", "next_rq_id"]
 
 import struct
 import sys
@@ -46,12 +46,20 @@ Operations = Op = namedtuple("Operations", [
     "IS_DOMAIN_INTRODUCED",  # 17
     "RESUME",                # 18
     "SET_TARGET",            # 19
+    "RESET_WATCHES",         # 21
+    "DIRECTORY_PART",        # 22
     "RESTRICT"               # 128
-])(*(list(range(20)) + [128]))
+])(*(list(range(20)) + [21, 22, 128]))
 
 
 Event = namedtuple("Event", "path token")
 
+#: A difference between two trees, see :meth:`pyxs.client.Client.diff`.
+Delta = namedtuple("Delta", "kind path value perms")
+
+#: Metadata of a node, see :meth:`pyxs.client.Client.stat`.
+Stat = namedtuple("Stat", "perms children size")
+
 
 class Packet(namedtuple("_Packet", "op rq_id tx_id size payload")):
     """A message to or from XenStore.
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+    pyxs.buffer
+    ~~~~~~~~~~~
+
+    This module implements group commit: writes and deletes made by
+    many threads are collected and committed in a single transaction.
+
+    :copyright: (c) 2016 by pyxs authors and contributors, see AUTHORS
+                for more details.
+    :license: LGPL, see LICENSE for more details.
+"""
+
+from __future__ import absolute_import
+
+__all__ = ["Pending", "WriteBuffer"]
+
+import copy
+import errno
+import threading
+import time
+from itertools import count
+
+from ._internal import NUL, Op
+from .exceptions import PyXSError
+from .helpers import check_path, error
+
+
+class Pending(object):
+    """A reference to a buffered write, which is resolved once the
+    write is committed.
+
+    .. versionadded:: 0.4.2
+    """
+    __slots__ = ["event", "exception"]
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.exception = None
+
+    def __repr__(self):
+        return "Pending({0})".format(
+            "done" if self.event.is_set() else "...")
+
+    def done(self):
+        """Returns ``True`` if the write was committed or failed."""
+        return self.event.is_set()
+
+    def get(self, timeout=None):
+        """Blocks until the write is committed.
+
+        :param float timeout: maximum number of seconds to wait for.
+        :raises pyxs.exceptions.PyXSError: if XenStore replied to the
+            write with an error, and with :data:`errno.ETIMEDOUT` if
+            the write wasn't committed within `timeout` seconds.
+        """
+        if not self.event.wait(timeout) and not self.event.is_set():
+            raise error(errno.ETIMEDOUT)
+
+        if self.exception is not None:
+            raise self.exception
+
+    def resolve(self, exception=None):
+        self.exception = exception
+        self.event.set()
+
+
+class WriteBuffer(object):
+    """Collects writes and deletes from many threads and commits them
+    in a single transaction once the oldest of them waited for `delay`
+    seconds or `max_size` paths are buffered::
+
+        with WriteBuffer(c) as buf:
+            buf.write(b"/local/domain/0/data/foo", b"bar").get()
+
+    Only the last write or delete to each path is sent, the writes it
+    superseded are resolved along with it. Writes to different paths
+    are sent in the order of their last update. A transaction, which
+    failed to commit with :data:`errno.EAGAIN`, is retried.
+
+    An error of a single write doesn't prevent the rest of the
+    transaction from being committed, it is reported by
+    :meth:`Pending.get` of that write.
+
+    .. versionadded:: 0.4.2
+
+    :param pyxs.client.Client client: client to use. The buffer runs
+                                      transactions on a copy of it.
+    :param float delay: maximum number of seconds a write is buffered.
+    :param int max_size: maximum number of paths buffered.
+    """
+    def __init__(self, client, delay=0.01, max_size=256):
+        self.client = copy.copy(client)
+        self.delay = delay
+        self.max_size = max_size
+        self.condition = threading.Condition()
+        self.flush_lock = threading.Lock()
+        self.seq = count()
+
+        #: A mapping of paths to ``(seq, op, args, pending)`` tuples,
+        #: where ``pending`` is a list of :class:`Pending` writes.
+        self.buffered = {}
+        self.oldest = None
+        self.thread = None
+        self.closed = False
+
+        #: Number of transactions committed and retried on conflict.
+        self.commits = self.conflicts = 0
+
+    def __repr__(self):
+        return "WriteBuffer({0!r})".format(self.client)
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return len(self.buffered)
+
+    def open(self):
+        """Starts a thread, which flushes the buffer."""
+        self.closed = False
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def close(self):
+        """Flushes the buffer and stops the flushing thread."""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+        self.flush()
+
+    def write(self, path, value):
+        """Buffers a write of `value` to `path`.
+
+        :returns Pending: resolved once the write is committed.
+        """
+        return self.add(path, Op.WRITE, (path + NUL, value))
+
+    def delete(self, path):
+        """Buffers a delete of `path`, see
+        :meth:`~pyxs.client.Client.delete`.
+
+        :returns Pending: resolved once the delete is committed.
+        """
+        return self.add(path, Op.RM, (path + NUL, ))
+
+    def add(self, path, op, args):
+        check_path(path)
+        pending = Pending()
+        with self.condition:
+            if self.closed and self.thread is None:
+                raise error(errno.EPIPE)
+
+            entry = self.buffered.get(path)
+            superseded = entry[3] if entry is not None else []
+            superseded.append(pending)
+            self.buffered[path] = next(self.seq), op, args, superseded
+            if self.oldest is None:
+                self.oldest = time.time()
+                self.condition.notify_all()
+            elif len(self.buffered) >= self.max_size:
+                self.condition.notify_all()
+        return pending
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.closed:
+                    # The buffer could be flushed by ``flush`` while
+                    # we wait, so check it after each wakeup.
+                    if not self.buffered:
+                        self.condition.wait()
+                        continue
+                    elif len(self.buffered) >= self.max_size:
+                        break
+
+                    remaining = self.oldest + self.delay - time.time()
+                    if remaining <= 0:
+                        break
+
+                    self.condition.wait(remaining)
+
+                if self.closed:
+                    return
+
+            self.flush()
+
+    def flush(self):
+        """Commits the buffered writes and blocks until they are
+        resolved.
+        """
+        with self.flush_lock:
+            with self.condition:
+                entries = sorted(self.buffered.values())
+                self.buffered = {}
+                self.oldest = None
+
+            if entries:
+                self.commit(entries)
+
+    def commit(self, entries):
+        try:
+            while True:
+                self.client.transaction()
+                replies = self.client.pipeline(
+                    (op, ) + args for _seq, op, args, _pending in entries)
+                errors = []
+                for reply in replies:
+                    try:
+                        payload = reply.get()
+                        if payload != b"OK":
+                            raise PyXSError(payload)
+                    except PyXSError as e:
+                        errors.append(e)
+                    else:
+                        errors.append(None)
+
+                if self.client.commit():
+                    self.commits += 1
+                    break
+
+                self.conflicts += 1
+        except Exception as e:
+            if self.client.tx_id:
+                try:
+                    self.client.rollback()
+                except Exception:
+                    pass  # Report the original error.
+
+            errors = [e] * len(entries)
+
+        for (_seq, _op, _args, pending), e in zip(entries, errors):
+            for p in pending:
+                p.resolve(e)
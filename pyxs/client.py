@@ -15,18 +15,28 @@
 
 from __future__ import absolute_import
 
-__all__ = ["Router", "Client", "Monitor"]
+__all__ = ["Router", "Scheduler", "Client", "Monitor"]
 
+import atexit
+import base64
 import copy
 import errno
+import fcntl
+import fnmatch
+import hashlib
+import operator
+import os
 import posixpath
 import re
 import socket
 import select
 import sys
 import threading
-from collections import defaultdict
+import time
+import zlib
+from collections import deque
 from functools import partial
+from itertools import islice
 
 try:
     import Queue as queue
@@ -39,12 +49,38 @@ if sys.version_info[:2] < (3, 2):
 else:
     _condition_wait = threading.Condition.wait
 
-from ._internal import NUL, Event, Packet, Op, next_rq_id
+from ._internal import NUL, Event, Delta, Stat, Packet, Op, next_rq_id
 from .connection import UnixSocketConnection, XenBusConnection
 from .exceptions import UnexpectedPacket, ConnectionError, PyXSError
-from .helpers import check_path, check_watch_path, check_perms, error
+from .helpers import check_path, check_watch_path, check_pattern, \
+    check_perms, error
+from .tree import Node
 
 _re_7bit_ascii = re.compile(b"^[\x00\x20-\x7f]*$")
+_re_glob_magic = re.compile(b"[*?[]")
+
+#: Default number of requests :meth:`Client.pipeline` keeps in flight.
+PIPELINE_WINDOW = 32
+
+#: Default number of requests :class:`Router` keeps in flight.
+MAX_IN_FLIGHT = 32
+
+#: Serializes :meth:`Router.after_fork` calls.
+_fork_lock = threading.Lock()
+
+
+def _nonblocking_pipe():
+    fds = os.pipe()
+    for fd in fds:
+        flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+        fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+    return fds
+
+
+def _check_disjoint(src, dst):
+    for a, b in [(src, dst), (dst, src)]:
+        if a == b or a.startswith(b.rstrip(b"/") + b"/"):
+            raise ValueError("{0!r} and {1!r} overlap".format(src, dst))
 
 
 class Router(object):
@@ -78,13 +114,79 @@ class Router(object):
           Python 3.2 and later no timeout is used.
 
         .. _issue8844: https://bugs.python.org/issue8844
+
+    .. versionchanged:: 0.4.2
+
+       The router can be used after :func:`os.fork`. The first request
+       made in the child process transparently opens a new connection
+       and starts a new router thread. Watches and transactions are
+       not inherited by the child.
+
+    .. versionchanged:: 0.4.2
+
+       Requests are sent through a :class:`Scheduler`, which keeps at
+       most `max_in_flight` of them unanswered and admits the rest by
+       priority. See :meth:`Client.with_priority` for details.
+
+    :param dict weights: see :class:`Scheduler`.
+    :param int max_in_flight: see :class:`Scheduler`.
+    :param int reserved: see :class:`Scheduler`.
+    :param bool adaptive: see :class:`Scheduler`.
     """
-    def __init__(self, connection):
-        self.r_terminator, self.w_terminator = socket.socketpair()
+    #: Priority classes, see :meth:`Client.with_priority`.
+    INTERACTIVE, BULK = "interactive", "bulk"
+
+    #: Operations, which are always sent as :data:`INTERACTIVE`.
+    URGENT = frozenset([Op.TRANSACTION_START, Op.TRANSACTION_END,
+                        Op.WATCH, Op.UNWATCH, Op.RESET_WATCHES])
+
+    def __init__(self, connection, weights=None,
+                 max_in_flight=MAX_IN_FLIGHT, reserved=4, adaptive=False):
         self.connection = connection
+
+        #: A mapping of tokens of the watches registered with
+        #: ``xenstored`` to ``(monitor, token)`` pairs subscribed to them.
+        self.monitors = {}
+        self.weights = weights or {self.INTERACTIVE: 8, self.BULK: 1}
+        self.max_in_flight = max_in_flight
+        self.reserved = reserved
+        self.adaptive = adaptive
+
+        #: Operations ``xenstored`` on the other end of the connection
+        #: replied to with :data:`errno.EINVAL`.
+        self.unsupported = set()
+
+        self.setup()
+
+    def teardown(self):
+        """Releases process-local resources acquired by :meth:`setup`."""
+        self.r_terminator.close()
+        self.w_terminator.close()
+
+    def setup(self):
+        """Initializes process-local state of the router."""
+        self.pid = os.getpid()
+        self.r_terminator, self.w_terminator = socket.socketpair()
         self.send_lock = threading.Lock()
+        self.watch_lock = threading.Lock()
         self.rvars = {}
-        self.monitors = defaultdict(list)
+
+        #: Handles of the transactions started through the router and
+        #: not yet ended.
+        self.transactions = set()
+
+        # ``(monitor, event)`` pairs to be delivered by the router
+        # thread, see ``post``.
+        self.posted = deque()
+
+        #: Time the packet being dispatched was received, see
+        #: :class:`~pyxs.probe.WatchProbe`.
+        self.received = None
+
+        # Watches, which are yet to receive the initial event.
+        self.fresh = set()
+        self.scheduler = Scheduler(self.weights, self.max_in_flight,
+                                   self.reserved, self.adaptive)
 
         # Router thread is daemonic to prevent blocking in case
         # the client wasn't finilzed properly, e.g. unhandled
@@ -105,54 +207,213 @@ class Router(object):
                 if not rlist:
                     continue
                 elif self.r_terminator in rlist:
-                    break
+                    data = self.r_terminator.recv(4096)
+                    if not data or NUL in data:
+                        break
+
+                    while self.posted:
+                        monitor, event = self.posted.popleft()
+                        monitor.deliver(event)
+                    continue
 
                 packet = self.connection.recv()
-                if packet.op == Op.WATCH_EVENT:
-                    event = Event(*packet.payload.split(NUL)[:-1])
-                    for monitor in self.monitors[event.token]:
-                        monitor.events.put(event)
-                else:
-                    rvar = self.rvars.pop(packet.rq_id, None)
-                    if rvar is None:
-                        raise UnexpectedPacket(packet)
-                    else:
-                        rvar.set(packet)
+                self.received = time.time()
+                self.dispatch(packet)
         finally:
             self.connection.close()
-            self.r_terminator.close()
-            self.w_terminator.close()
+            self.teardown()
+
+    def dispatch(self, packet):
+        """Delivers a packet received from XenStore to the monitors
+        or to the pending request it is a reply to."""
+        if packet.op == Op.WATCH_EVENT:
+            path, shared = packet.payload.split(NUL)[:-1]
+            self.fresh.discard(shared)
+            for monitor, token in self.monitors.get(shared, ()):
+                monitor.deliver(Event(path, token))
+        else:
+            rvar = self.rvars.pop(packet.rq_id, None)
+            if rvar is None:
+                raise UnexpectedPacket(packet)
+            else:
+                if self.scheduler is not None:
+                    self.scheduler.release(packet.rq_id)
+                rvar.set(packet)
 
     @property
     def is_connected(self):
         """Checks if the underlying connection is active."""
         return self.connection.is_connected
 
-    def subscribe(self, token, monitor):
-        """Subscribes a ``monitor`` from events with a given ``token``."""
-        self.monitors[token].append(monitor)
+    @property
+    def is_forked(self):
+        """Checks if the router was inherited from a parent process."""
+        return self.pid != os.getpid()
+
+    def after_fork(self, restart=True):
+        """Detaches the router from the state shared with the parent
+        process: the connection and the router thread.
 
-    def unsubscribe(self, token, monitor):
-        """Unsubscribes a ``monitor`` to events with a given ``token``."""
-        self.monitors[token].remove(monitor)
+        :param bool restart: if ``True`` and the router was connected
+                             in the parent process, a new connection
+                             is opened and a new router thread started.
+        """
+        with _fork_lock:
+            if not self.is_forked:
+                return  # Another thread got here first.
+
+            # Shutting down sockets here would break them for the
+            # parent as well.
+            restart = restart and self.is_connected
+            self.connection.release()
+            self.teardown()
+            self.setup()
+
+            # Watches belong to the parent's connection.
+            for monitor in set(monitor
+                               for subscribers in self.monitors.values()
+                               for monitor, _token in subscribers):
+                monitor.after_fork()
+            self.monitors.clear()
+
+        if restart:
+            self.start()
+
+    def subscribe(self, wpath, token, monitor):
+        """Subscribes a ``monitor`` to events for ``wpath``, which are
+        delivered with a given ``token``.
+
+        Monitors watching the same path share a single watch registered
+        with ``xenstored``. The caller should hold :attr:`watch_lock`
+        until the watch is registered. If the path is already watched,
+        the router delivers the initial event to the ``monitor``, see
+        :meth:`post`.
+
+        .. versionchanged:: 0.4.2
+
+           Added ``wpath`` argument.
+
+        :returns bytes: a token to register the watch with, if
+                        ``wpath`` is not watched yet, and ``None``
+                        otherwise.
+        :raises pyxs.exceptions.PyXSError:
+            with :data:`errno.EEXIST` if the monitor is already
+            subscribed.
+        """
+        shared = b"pyxs:" + wpath
+        subscribers = self.monitors.get(shared, [])
+        if (monitor, token) in subscribers:
+            raise error(errno.EEXIST)
+
+        # Lists are replaced rather than updated, so that ``dispatch``
+        # can iterate over them without locking.
+        self.monitors[shared] = subscribers + [(monitor, token)]
+        if not subscribers:
+            self.fresh.add(shared)
+            return shared
+
+        # Unless ``xenstored`` is yet to send it to all subscribers.
+        if shared not in self.fresh:
+            self.post(monitor, Event(wpath, token))
+
+    def post(self, monitor, event):
+        """Delivers an event to the ``monitor`` from the router thread,
+        which is the only thread queueing events for the monitors.
+
+        .. versionadded:: 0.4.2
+        """
+        self.posted.append((monitor, event))
+        self.w_terminator.sendall(b"\x01")
+
+    def unsubscribe(self, wpath, token, monitor):
+        """Unsubscribes a ``monitor`` from events for ``wpath``.
+
+        .. versionchanged:: 0.4.2
+
+           Added ``wpath`` argument.
+
+        :returns bytes: a token to unregister the watch with, if this
+                        was the last subscriber, and ``None`` otherwise.
+        """
+        shared = b"pyxs:" + wpath
+        subscribers = [subscriber
+                       for subscriber in self.monitors.get(shared, [])
+                       if subscriber != (monitor, token)]
+        if subscribers:
+            self.monitors[shared] = subscribers
+            return None
+
+        self.monitors.pop(shared, None)
+        self.fresh.discard(shared)
+        return shared
+
+    def wait_events(self, monitor, timeout=None):
+        """Blocks until ``monitor`` has some events queued.
+
+        :param float timeout: if given, the maximum number of seconds
+                              to wait for.
+        :returns bool: ``False`` if the wait timed out.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with monitor.events.not_empty:
+            while not monitor.events._qsize():
+                if deadline is None:
+                    _condition_wait(monitor.events.not_empty)
+                    continue
 
-    def send(self, packet):
-        """Sends a packet to XenStore.
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
 
+                monitor.events.not_empty.wait(remaining)
+        return True
+
+    @property
+    def latency(self):
+        """Per priority class latency of the requests, see
+        :class:`Latency`. Empty for routers without a scheduler, e.g.
+        :class:`~pyxs.cooperative.CooperativeRouter`.
+        """
+        if self.scheduler is None:
+            return {}
+
+        return self.scheduler.latency
+
+    def send(self, packet, priority=INTERACTIVE):
+        """Sends a packet to XenStore, blocking until the scheduler
+        admits it.
+
+        :param str priority: priority class of the packet.
         :returns RVar: a reference to the XenStore response.
         """
-        with self.send_lock:
-            # The order here matters. XenStore might reply to the packet
-            # *before* the ``rvar`` is registered.
-            self.rvars[packet.rq_id] = rvar = RVar()
-            self.connection.send(packet)
-            return rvar
+        if self.is_forked:
+            self.after_fork()
+
+        if packet.op in self.URGENT:
+            priority = self.INTERACTIVE
+
+        scheduler = self.scheduler
+        scheduler.admit(packet.rq_id, priority)
+        try:
+            with self.send_lock:
+                # The order here matters. XenStore might reply to the
+                # packet *before* the ``rvar`` is registered.
+                self.rvars[packet.rq_id] = rvar = RVar()
+                self.connection.send(packet)
+                return rvar
+        except Exception:
+            self.rvars.pop(packet.rq_id, None)
+            scheduler.release(packet.rq_id)
+            raise
 
     def start(self):
         """Starts the router thread.
 
         Does nothing if the router is already started.
         """
+        if self.is_forked:
+            self.after_fork(restart=False)
+
         # Connection is deliberately done in the calling thread so that
         # ``ConnectionError`` could be handled. See issue #8 on GitHub
         # for details.
@@ -171,6 +432,10 @@ class Router(object):
         After termination the router can no longer send or receive packets.
         Does nothing if the router was already terminated.
         """
+        if self.is_forked:
+            self.after_fork(restart=False)
+            return
+
         if self.is_connected:
             self.w_terminator.sendall(NUL)
 
@@ -178,6 +443,240 @@ class Router(object):
             self.thread.join()
 
 
+class Latency(object):
+    """Latency statistics of a priority class. Latency of a request is
+    the time from :meth:`Router.send` call to the reply, including the
+    time it spent waiting for admission.
+
+    .. versionadded:: 0.4.2
+    """
+    __slots__ = ["count", "total", "max"]
+
+    def __init__(self):
+        self.count = 0
+        self.total = self.max = 0.0
+
+    def __repr__(self):
+        return "Latency(count={0}, mean={1:.6f}, max={2:.6f})".format(
+            self.count, self.mean, self.max)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def add(self, elapsed):
+        self.count += 1
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+
+
+class _Ticket(object):
+    __slots__ = ["rq_id", "priority", "started", "admitted", "condition"]
+
+    def __init__(self, rq_id, priority, condition=None):
+        self.rq_id = rq_id
+        self.priority = priority
+        self.started = time.time()
+        self.admitted = None  # Time of admission.
+
+        # Notified on admission, see ``Scheduler.grant``.
+        self.condition = condition
+
+
+class Scheduler(object):
+    """Admits requests to the connection.
+
+    XenStore processes requests from a single connection in order, so
+    a request sent after a long :meth:`Client.pipeline` has to wait for
+    the whole pipeline. The scheduler bounds the number of requests in
+    flight and, once the bound is reached, queues the callers
+    separately for each priority class. A freed slot goes to the
+    classes in weighted round-robin: with the default weights eight
+    :data:`Router.INTERACTIVE` requests are admitted for each
+    :data:`Router.BULK` request, if both are waiting.
+
+    .. versionadded:: 0.4.2
+
+    :param dict weights: a mapping of priority classes to their
+                         weights. Must include
+                         :data:`Router.INTERACTIVE`.
+    :param int max_in_flight: maximum number of requests without a
+                              reply.
+    :param int reserved: number of slots only granted to
+                         :data:`Router.INTERACTIVE` requests.
+    :param bool adaptive: if ``True`` the number of requests in flight
+                          is adjusted between `min_in_flight` and
+                          `max_in_flight`, see :meth:`adapt`.
+    :param int min_in_flight: minimum number of requests in flight.
+    :param float tolerance: relative increase of the round-trip time,
+                            which makes :meth:`adapt` shrink the window.
+    """
+    def __init__(self, weights, max_in_flight=MAX_IN_FLIGHT, reserved=0,
+                 adaptive=False, min_in_flight=1, tolerance=1.0):
+        if Router.INTERACTIVE not in weights:
+            raise ValueError(weights)
+
+        self.weights = weights
+        self.max_in_flight = max_in_flight
+        self.min_in_flight = min(min_in_flight, max_in_flight)
+        self.reserved = reserved
+        self.adaptive = adaptive
+        self.tolerance = tolerance
+        self.lock = threading.Lock()
+        self.queues = dict((priority, deque()) for priority in weights)
+        self.credits = dict(weights)
+        self.in_flight = {}
+
+        #: Current limit on the number of requests in flight.
+        self.window = self.min_in_flight if adaptive else max_in_flight
+
+        # Round-trip time statistics, see ``adapt``.
+        self.slow_start = True
+        self.base_rtt = None
+        self.epoch = []
+
+        #: A mapping of priority classes to :class:`Latency`.
+        self.latency = dict((priority, Latency()) for priority in weights)
+
+    def admit(self, rq_id, priority):
+        """Blocks until a request may be sent."""
+        if priority not in self.queues:
+            raise ValueError(priority)
+
+        # Each caller waits on a condition of its own, so that only
+        # the admitted ones are woken up.
+        ticket = _Ticket(rq_id, priority, threading.Condition(self.lock))
+        with self.lock:
+            self.queues[priority].append(ticket)
+            self.grant()
+            while ticket.admitted is None:
+                _condition_wait(ticket.condition)
+
+    def release(self, rq_id):
+        """Frees the slot taken by a request, once it is answered."""
+        with self.lock:
+            ticket = self.in_flight.pop(rq_id, None)
+            if ticket is not None:
+                now = time.time()
+                self.latency[ticket.priority].add(now - ticket.started)
+                if self.adaptive:
+                    self.adapt(now - ticket.admitted)
+                self.grant()
+
+    def adapt(self, rtt):
+        """Adjusts the window after a request took `rtt` seconds
+        from admission to reply.
+
+        XenStore handles requests one at a time, so once there are
+        enough of them in flight to keep it busy, the round-trip time
+        grows with the window, while the throughput doesn't. Every
+        ``window`` replies the mean round-trip time is compared with
+        the lowest seen recently. The window grows by one, or doubles
+        until the first shrink, if the mean is within `tolerance`, and
+        is halved otherwise.
+        """
+        self.epoch.append(rtt)
+        if len(self.epoch) < self.window:
+            return
+
+        lowest, mean = min(self.epoch), sum(self.epoch) / len(self.epoch)
+        self.epoch = []
+        if self.base_rtt is None:
+            self.base_rtt = lowest
+        else:
+            # Slowly forget the old minimum, so that the window can
+            # recover if XenStore gets slower.
+            self.base_rtt = min(lowest, self.base_rtt * 1.05)
+
+        if mean <= self.base_rtt * (1 + self.tolerance):
+            step = self.window if self.slow_start else 1
+            self.window = min(self.window + step, self.max_in_flight)
+        else:
+            self.slow_start = False
+            self.window = max(self.window // 2, self.min_in_flight)
+
+    def grant(self):
+        while len(self.in_flight) < self.window:
+            ticket = self.next_ticket()
+            if ticket is None:
+                break
+
+            ticket.admitted = time.time()
+            self.in_flight[ticket.rq_id] = ticket
+            if ticket.condition is not None:
+                ticket.condition.notify()
+
+    def next_ticket(self):
+        free = self.window - len(self.in_flight)
+        reserved = min(self.reserved, self.window - 1)
+        eligible = [priority for priority, tickets in self.queues.items()
+                    if tickets and (free > reserved or
+                                    priority == Router.INTERACTIVE)]
+        if not eligible:
+            return None
+
+        if not any(self.credits[priority] > 0 for priority in eligible):
+            self.credits = dict(self.weights)
+
+        priority = max(eligible, key=lambda priority: (
+            self.credits[priority], self.weights[priority]))
+        self.credits[priority] -= 1
+        return self.queues[priority].popleft()
+
+
+class NegativeCache(object):
+    """Remembers paths, which were found missing, for `ttl` seconds.
+
+    Paths written or created by the client are forgotten right away,
+    but writes by the other clients are only noticed after the entry
+    expires.
+
+    .. versionadded:: 0.4.2
+
+    :param float ttl: seconds a missing path is remembered for.
+    :param int maxsize: maximum number of remembered paths.
+    """
+    def __init__(self, ttl=1.0, maxsize=4096):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.expires = {}
+
+        #: Number of requests the cache saved.
+        self.hits = 0
+
+    def __repr__(self):
+        return "NegativeCache(ttl={0})".format(self.ttl)
+
+    def __contains__(self, path):
+        expires = self.expires.get(path)
+        if expires is None:
+            return False
+        elif expires < time.time():
+            self.expires.pop(path, None)
+            return False
+
+        self.hits += 1
+        return True
+
+    def add(self, path):
+        if len(self.expires) >= self.maxsize:
+            self.clear()
+
+        self.expires[path] = time.time() + self.ttl
+
+    def invalidate(self, path):
+        """Forgets `path` and its parents, which exist once `path`
+        is written.
+        """
+        while path:
+            self.expires.pop(path, None)
+            parent = posixpath.dirname(path)
+            path = parent if parent != path else None
+
+    def clear(self):
+        self.expires.clear()
+
+
 class RVar(object):
     """A thread-safe shared mutable reference.
 
@@ -210,6 +709,42 @@ class RVar(object):
             self.condition.notify_all()
 
 
+class Reply(object):
+    """A reference to a pending XenStore reply.
+
+    .. versionadded:: 0.4.2
+    """
+    __slots__ = ["op", "tx_id", "rvar"]
+
+    def __init__(self, op, tx_id, rvar):
+        self.op = op
+        self.tx_id = tx_id
+        self.rvar = rvar
+
+    def __repr__(self):
+        return "Reply({0}, {1})".format(self.op, self.rvar)
+
+    def get(self, raw=False):
+        """Blocks until the reply is received and returns its payload.
+
+        :param bool raw: if ``True`` trailing ``NUL`` bytes are kept in
+                         the payload.
+        :raises pyxs.exceptions.PyXSError: if XenStore replied with an
+            error.
+        :raises pyxs.exceptions.UnexpectedPacket: if the reply doesn't
+            match the request.
+        """
+        packet = self.rvar.get()
+        if packet.op == Op.ERROR:
+            # Erroneous responses are POSIX error code ending with a
+            # ``NUL`` byte.
+            raise error(packet.payload[:-1])
+        elif packet.op != self.op or packet.tx_id != self.tx_id:
+            raise UnexpectedPacket(packet)
+
+        return packet.payload if raw else packet.payload.rstrip(NUL)
+
+
 class Client(object):
     """XenStore client.
 
@@ -269,12 +804,59 @@ class Client(object):
 
         self.router = router
         self.tx_id = 0
+        self.priority = Router.INTERACTIVE
+        self.negative_cache = None
+
+    #: Clients created by :meth:`for_worker`.
+    _workers = {}
+    _workers_lock = threading.Lock()
 
     def __repr__(self):
         return "Client({0})".format(self.router.connection)
 
     def __copy__(self):
-        return self.__class__(router=self.router)
+        client = self.__class__(router=self.router)
+        client.priority = self.priority
+        client.negative_cache = self.negative_cache
+        return client
+
+    @classmethod
+    def for_worker(cls, *args, **kwargs):
+        """Returns a connected client private to the current process,
+        creating it on first call. All arguments are forwarded to
+        :class:`~pyxs.client.Client` constructor.
+
+        This is the recommended way of using :mod:`pyxs` from worker
+        processes, e.g. with :mod:`multiprocessing` or
+        :mod:`concurrent.futures`::
+
+            def domain_name(domid):
+                c = Client.for_worker()
+                return c[c.get_domain_path(domid) + b"/name"]
+
+            with ProcessPoolExecutor() as pool:
+                names = list(pool.map(domain_name, domids))
+
+        The client is shared by all threads of the process, so use
+        :func:`copy.copy` to get a client for running transactions.
+
+        .. versionadded:: 0.4.2
+        """
+        pid = os.getpid()
+        key = pid, args, tuple(sorted(kwargs.items()))
+        with cls._workers_lock:
+            client = cls._workers.get(key)
+            if client is None:
+                # Forget about the clients inherited from the parent.
+                for other in list(cls._workers):
+                    if other[0] != pid:
+                        del cls._workers[other]
+
+                client = cls._workers[key] = cls(*args, **kwargs)
+                client.connect()
+                atexit.register(client.close)
+
+        return client
 
     def __enter__(self):
         self.connect()
@@ -289,27 +871,64 @@ class Client(object):
     # Private API.
     # ............
 
-    def execute_command(self, op, *args, **kwargs):
+    def submit(self, op, *args, **kwargs):
         if not all(map(_re_7bit_ascii.match, args)):
             raise ValueError(args)
 
+        if self.negative_cache is not None and op in [Op.WRITE, Op.MKDIR]:
+            self.negative_cache.invalidate(args[0].rstrip(NUL))
+
         kwargs.update(tx_id=self.tx_id, rq_id=next_rq_id())
-        rvar = self.router.send(Packet(op, b"".join(args), **kwargs))
-        packet = rvar.get()
-        if packet.op == Op.ERROR:
-            # Erroneous responses are POSIX error code ending with a
-            # ``NUL`` byte.
-            raise error(packet.payload[:-1])
-        elif packet.op != op or packet.tx_id != self.tx_id:
-            raise UnexpectedPacket(packet)
+        packet = Packet(op, b"".join(args), **kwargs)
+        return Reply(op, packet.tx_id,
+                     self.router.send(packet, self.priority))
 
-        return packet.payload.rstrip(NUL)
+    def execute_command(self, op, *args, **kwargs):
+        return self.submit(op, *args, **kwargs).get()
 
     def ack(self, *args):
         payload = self.execute_command(*args)
         if payload != b"OK":
             raise PyXSError(payload)
 
+    def ack_many(self, commands, transaction_size=None):
+        """Pipelines `commands` and checks that each is acknowledged.
+
+        If `transaction_size` is given and the client isn't already in
+        a transaction, every `transaction_size` commands are executed
+        in a separate transaction, which is retried on conflict.
+        """
+        if not transaction_size or self.tx_id:
+            for reply in self.pipeline(commands):
+                payload = reply.get()
+                if payload != b"OK":
+                    raise PyXSError(payload)
+            return
+
+        commands = iter(commands)
+        chunk = list(islice(commands, transaction_size))
+        while chunk:
+            self._transactional(partial(self.ack_many, chunk))
+            chunk = list(islice(commands, transaction_size))
+
+    def _transactional(self, f):
+        """Calls `f` in a transaction, which is retried on conflict,
+        unless the client is already in one.
+        """
+        if self.tx_id:
+            return f()
+
+        while True:
+            self.transaction()
+            try:
+                result = f()
+            except Exception:
+                self.rollback()
+                raise
+
+            if self.commit():
+                return result
+
     # Public API.
     # ...........
 
@@ -335,6 +954,139 @@ class Client(object):
         """
         self.router.terminate()
 
+    def with_priority(self, priority):
+        """Returns a copy of the client, which shares the router, but
+        sends requests with a given `priority`.
+
+        Use :data:`Router.BULK` for background jobs, so that they don't
+        delay interactive requests::
+
+            bulk = client.with_priority(Router.BULK)
+            for path, value, children in bulk.walk(b"/local/domain"):
+                ...
+
+        Transaction and watch management requests are always sent as
+        :data:`Router.INTERACTIVE`.
+
+        :param str priority: one of the classes the router was created
+                             with, see :class:`Scheduler`.
+
+        .. versionadded:: 0.4.2
+        """
+        if priority not in self.router.weights:
+            raise ValueError(priority)
+
+        client = copy.copy(self)
+        client.priority = priority
+        return client
+
+    def with_negative_cache(self, ttl=1.0):
+        """Returns a copy of the client, which shares the router, but
+        remembers the paths :meth:`exists`, :meth:`is_leaf`,
+        :meth:`child_count` and :meth:`stat` found missing for `ttl`
+        seconds, so that probing for absent optional keys doesn't
+        take a round trip each time::
+
+            cached = client.with_negative_cache(ttl=0.5)
+            while True:
+                if cached.exists(backend + b"/feature-foo"):
+                    ...
+
+        Paths written through the copy, or the copies made from it,
+        are forgotten right away. Changes made by the other clients
+        are noticed within `ttl` seconds. The cache is not used in
+        transactions.
+
+        :param float ttl: see :class:`NegativeCache`.
+
+        .. versionadded:: 0.4.2
+        """
+        client = copy.copy(self)
+        client.negative_cache = NegativeCache(ttl)
+        return client
+
+    def pipeline(self, commands, window=PIPELINE_WINDOW):
+        """Sends ``(op, *args)`` commands without waiting for replies
+        in between, keeping at most `window` of them in flight, and
+        yields a :class:`Reply` for each command in order.
+
+        XenStore processes requests from a single connection in order,
+        so the result is the same as executing the commands one by one,
+        but takes a fraction of round trips.
+
+        Once `window` commands are in flight, the next one is only sent
+        after the reply to the oldest has arrived, whether or not the
+        caller got it.
+        """
+        pending = deque()
+        for command in commands:
+            if len(pending) >= window:
+                pending[0].rvar.get()
+                yield pending.popleft()
+
+            pending.append(self.submit(*command))
+
+        while pending:
+            yield pending.popleft()
+
+    def fetch(self, paths, values=True, perms=False):
+        """Pipelines ``DIRECTORY``, ``READ`` and, optionally,
+        ``GET_PERMS`` for `paths`.
+
+        :param bool values: if ``False`` values are not read and
+                            ``None`` is returned in their place.
+        :param bool perms: if ``True`` permissions are fetched as well
+                           and returned as the fourth element of each
+                           tuple.
+        :returns list: of ``(path, value, children)`` triples. Paths
+                       which do not exist are omitted.
+
+        .. versionchanged:: 0.4.2
+
+           Added ``values`` and ``perms`` arguments.
+        """
+        ops = [Op.DIRECTORY]
+        if values:
+            ops.append(Op.READ)
+        if perms:
+            ops.append(Op.GET_PERMS)
+
+        commands = []
+        for path in paths:
+            check_path(path)
+            commands.extend((op, path + NUL) for op in ops)
+
+        nodes = []
+        replies = self.pipeline(commands)
+        for path in paths:
+            list_reply = next(replies)
+            read_reply = next(replies) if values else None
+            perms_reply = next(replies) if perms else None
+            try:
+                payload = list_reply.get()
+            except PyXSError as e:
+                if e.args[0] == errno.ENOENT:
+                    continue  # Removed under our feet.
+                elif e.args[0] == errno.E2BIG:
+                    payload = NUL.join(self.iter_list(path))
+                else:
+                    raise
+
+            node = (path, None, [] if not payload else payload.split(NUL))
+            if values:
+                try:
+                    node = (path, read_reply.get(), node[2])
+                except PyXSError:
+                    node = (path, b"", node[2])  # '/' or no permissions?
+            if perms:
+                try:
+                    node += (perms_reply.get().split(NUL), )
+                except PyXSError:
+                    node += (None, )
+
+            nodes.append(node)
+        return nodes
+
     def read(self, path, default=None):
         """Reads data from a given path.
 
@@ -391,25 +1143,262 @@ class Client(object):
         """Returns a list of names of the immediate children of `path`.
 
         :param bytes path: path to list.
+
+        .. versionchanged:: 0.4.2
+
+           Directories which don't fit into a single XenStore reply are
+           listed with :meth:`iter_list`.
         """
         check_path(path)
-        payload = self.execute_command(Op.DIRECTORY, path + NUL)
+        try:
+            payload = self.execute_command(Op.DIRECTORY, path + NUL)
+        except PyXSError as e:
+            if e.args[0] == errno.E2BIG:
+                return list(self.iter_list(path))
+
+            raise
+
         return [] if not payload else payload.split(NUL)
 
+    def iter_list(self, path):
+        """Yields names of the immediate children of `path`, fetching
+        them in chunks with ``DIRECTORY_PART``. Unlike :meth:`list`
+        this works for directories of any size.
+
+        If the directory changes while being listed, listing restarts
+        from the beginning, skipping the names which were already
+        yielded. ``xenstored`` versions without ``DIRECTORY_PART``
+        support are sent a single ``DIRECTORY`` request instead.
+
+        :param bytes path: path to list.
+        """
+        check_path(path)
+        if Op.DIRECTORY_PART in self.router.unsupported:
+            payload = self.execute_command(Op.DIRECTORY, path + NUL)
+            for child in ([] if not payload else payload.split(NUL)):
+                yield child
+            return
+
+        seen = set()
+        generation = None
+        offset = 0
+        while True:
+            try:
+                payload = self.submit(Op.DIRECTORY_PART, path + NUL,
+                                      str(offset).encode() + NUL) \
+                    .get(raw=True)
+            except PyXSError as e:
+                if e.args[0] != errno.EINVAL or generation is not None:
+                    raise
+
+                self.router.unsupported.add(Op.DIRECTORY_PART)
+                for child in self.iter_list(path):
+                    yield child
+                return
+
+            # The payload is a generation count followed by children
+            # names. The last chunk is terminated by an empty name.
+            chunk_generation, _, chunk = payload.partition(NUL)
+            if generation is None:
+                generation = chunk_generation
+            elif chunk_generation != generation:
+                generation = None
+                offset = 0
+                continue
+
+            done = chunk == NUL or chunk.endswith(NUL * 2)
+            for child in chunk.split(NUL):
+                if child and child not in seen:
+                    seen.add(child)
+                    yield child
+
+            if done:
+                break
+
+            offset += len(chunk)
+
     def exists(self, path):
         """Checks if a given `path` exists.
 
         :param bytes path: path to check.
+
+        .. versionchanged:: 0.4.2
+
+           Sends ``GET_PERMS``, whose reply is small regardless of the
+           number of children `path` has. See also
+           :meth:`with_negative_cache`.
         """
-        try:
-            self.list(path)
-        except PyXSError as e:
-            if e.args[0] == errno.ENOENT:
-                return False
+        return self.exists_many([path])[0]
 
-            raise
-        else:
-            return True
+    def exists_many(self, paths):
+        """Checks which of `paths` exist in a single :meth:`pipeline`.
+
+        :returns list: of ``True`` or ``False`` for each path.
+
+        .. versionadded:: 0.4.2
+        """
+        found = []
+        for path, replies in self._query(paths, [Op.GET_PERMS]):
+            if replies is not None:
+                try:
+                    replies[0].get()
+                except PyXSError as e:
+                    if not self._missing(path, e):
+                        raise
+                else:
+                    found.append(True)
+                    continue
+
+            found.append(False)
+        return found
+
+    def is_leaf(self, path):
+        """Returns ``True`` if `path` has no children. Large directories
+        are not listed.
+
+        :raises pyxs.exceptions.PyXSError:
+            with :data:`errno.ENOENT` if `path` doesn't exist.
+
+        .. versionadded:: 0.4.2
+        """
+        return self._one(path, self.is_leaf_many)
+
+    def is_leaf_many(self, paths):
+        """Checks which of `paths` have no children in a single
+        :meth:`pipeline`.
+
+        :returns list: of ``True`` or ``False`` for each path, or
+                       ``None`` if the path doesn't exist.
+
+        .. versionadded:: 0.4.2
+        """
+        # Large directories are not listed, any non-zero count will do.
+        return [None if count is None else not count
+                for count in self._child_counts(paths, lambda path: 1)]
+
+    def child_count(self, path):
+        """Returns the number of immediate children of `path`, without
+        building a list of their names.
+
+        :raises pyxs.exceptions.PyXSError:
+            with :data:`errno.ENOENT` if `path` doesn't exist.
+
+        .. versionadded:: 0.4.2
+        """
+        return self._one(path, self.child_count_many)
+
+    def child_count_many(self, paths):
+        """Counts the immediate children of `paths` in a single
+        :meth:`pipeline`.
+
+        :returns list: of the numbers of children for each path, or
+                       ``None`` if the path doesn't exist.
+
+        .. versionadded:: 0.4.2
+        """
+        return self._child_counts(
+            paths, lambda path: sum(1 for _child in self.iter_list(path)))
+
+    def _child_counts(self, paths, count_large):
+        counts = []
+        for path, replies in self._query(paths, [Op.DIRECTORY]):
+            count = None
+            if replies is not None:
+                try:
+                    payload = replies[0].get()
+                except PyXSError as e:
+                    if e.args[0] == errno.E2BIG:
+                        count = count_large(path)
+                    elif not self._missing(path, e):
+                        raise
+                else:
+                    count = payload.count(NUL) + 1 if payload else 0
+
+            counts.append(count)
+        return counts
+
+    def _one(self, path, query_many):
+        # Runs a ``*_many`` query for a single path, which must exist.
+        result = query_many([path])[0]
+        if result is None:
+            raise error(errno.ENOENT)
+
+        return result
+
+    def stat(self, path):
+        """Returns :data:`~pyxs._internal.Stat` of `path`: its
+        permissions, the number of children and the size of its value.
+
+        :raises pyxs.exceptions.PyXSError:
+            with :data:`errno.ENOENT` if `path` doesn't exist.
+
+        .. versionadded:: 0.4.2
+        """
+        return self._one(path, self.stat_many)
+
+    def stat_many(self, paths):
+        """Pipelines ``GET_PERMS``, ``DIRECTORY`` and ``READ`` for
+        `paths`.
+
+        :returns list: of :data:`~pyxs._internal.Stat` or ``None`` for
+                       each path, which doesn't exist.
+
+        .. versionadded:: 0.4.2
+        """
+        stats = []
+        for path, replies in self._query(
+                paths, [Op.GET_PERMS, Op.DIRECTORY, Op.READ]):
+            if replies is None:
+                stats.append(None)
+                continue
+
+            try:
+                perms = replies[0].get().split(NUL)
+                try:
+                    payload = replies[1].get()
+                except PyXSError as e:
+                    if e.args[0] != errno.E2BIG:
+                        raise
+
+                    children = sum(1 for _child in self.iter_list(path))
+                else:
+                    children = payload.count(NUL) + 1 if payload else 0
+
+                try:
+                    size = len(replies[2].get())
+                except PyXSError:
+                    size = 0  # '/' or no permissions?
+            except PyXSError as e:
+                if not self._missing(path, e):
+                    raise
+
+                stats.append(None)
+            else:
+                stats.append(Stat(perms, children, size))
+        return stats
+
+    def _query(self, paths, ops):
+        # Yields ``(path, replies)`` for each path, where ``replies`` is
+        # ``None`` if the path is known to be missing.
+        cache = self.negative_cache if not self.tx_id else None
+        paths = list(paths)
+        for path in paths:
+            check_path(path)
+
+        missing = [cache is not None and path in cache for path in paths]
+        replies = self.pipeline((op, path + NUL)
+                                for path, known in zip(paths, missing)
+                                if not known for op in ops)
+        for path, known in zip(paths, missing):
+            yield path, None if known else [next(replies) for _op in ops]
+
+    def _missing(self, path, e):
+        if e.args[0] != errno.ENOENT:
+            return False
+
+        if self.negative_cache is not None and not self.tx_id:
+            self.negative_cache.add(path)
+        return True
 
     def get_perms(self, path):
         """Returns a list of permissions for a given `path`, see
@@ -434,29 +1423,531 @@ class Client(object):
         check_perms(perms)
         self.ack(Op.SET_PERMS, path + NUL, *(perm + NUL for perm in perms))
 
-    def walk(self, top, topdown=True):
+    def walk(self, top, topdown=True, max_depth=None, prune=None,
+             values=True, perms=False):
         """Walk XenStore, yielding 3-tuples ``(path, value, children)``
         for each node in the tree, rooted at node `top`.
 
         :param bytes top: node to start from.
-        :param bool topdown: see :func:`os.walk` for details.
+        :param bool topdown: see :func:`os.walk` for details. As with
+                             :func:`os.walk`, removing names from
+                             ``children`` of a yielded node prevents
+                             the walk from descending into them.
+        :param int max_depth: if given, nodes deeper than `max_depth`
+                              levels below `top` are not visited, e.g.
+                              ``max_depth=1`` only visits `top` and its
+                              children.
+        :param prune: a function, which gets a path of a node and
+                      returns ``True`` if the node and its subtree
+                      should be skipped. Skipped nodes are not fetched.
+        :param bool values: see :meth:`fetch`.
+        :param bool perms: see :meth:`fetch`.
+
+        The walk keeps a list of fetched siblings for each level of the
+        current path, so memory use is bounded by the width of the
+        tree, not its size.
+
+        .. versionchanged:: 0.4.2
+
+           Children of each node are fetched in a single
+           :meth:`pipeline`. Added ``max_depth``, ``prune``, ``values``
+           and ``perms`` arguments.
         """
-        children = self.list(top)
+        nodes = self.fetch([top], values, perms)
+        if not nodes:
+            raise error(errno.ENOENT)
+
+        # Each stack entry is a node along with an iterator over its
+        # fetched children.
+        stack = [(None, iter(nodes))]
+        while stack:
+            parent, siblings = stack[-1]
+            node = next(siblings, None)
+            if node is None:
+                stack.pop()
+                if parent is not None and not topdown:
+                    yield parent
+                continue
+
+            if topdown:
+                yield node
+
+            if max_depth is not None and len(stack) > max_depth:
+                children = []
+            else:
+                children = [posixpath.join(node[0], child)
+                            for child in node[2]]
+                if prune is not None:
+                    children = [path for path in children if not prune(path)]
+
+            stack.append((node, iter(self.fetch(children, values, perms))))
 
+    def glob(self, pattern):
+        """Returns a list of ``(path, value)`` pairs for the paths
+        matching `pattern`, see :meth:`iglob`.
+
+        .. versionadded:: 0.4.2
+        """
+        return list(self.iglob(pattern))
+
+    def iglob(self, pattern):
+        """Yields ``(path, value)`` pairs for the paths matching
+        `pattern`, which may contain :mod:`fnmatch` wildcards in any
+        of its components::
+
+            >>> list(c.iglob(b"/local/domain/*/device/vif/*/state"))
+            [(b'/local/domain/1/device/vif/0/state', b'4'), ...]
+
+        Only the directories, which the wildcards refer to are listed.
+        Each listing and the final reads are done in a single
+        :meth:`pipeline` per wildcard component.
+
+        :param bytes pattern: path pattern.
+
+        .. versionadded:: 0.4.2
+        """
+        check_pattern(pattern)
+        paths = [b"/" if pattern.startswith(b"/") else b""]
+        literal = []
+        for part in pattern.split(b"/"):
+            if not part:
+                continue
+            elif not _re_glob_magic.search(part):
+                literal.append(part)
+                continue
+
+            paths = [posixpath.join(path, *literal) for path in paths]
+            literal = []
+
+            replies = self.pipeline((Op.DIRECTORY, path + NUL)
+                                    for path in paths)
+            matches = []
+            for path, reply in zip(paths, replies):
+                try:
+                    payload = reply.get()
+                except PyXSError as e:
+                    if e.args[0] == errno.ENOENT:
+                        continue
+                    elif e.args[0] == errno.E2BIG:
+                        payload = NUL.join(self.iter_list(path))
+                    else:
+                        raise
+
+                matches.extend(
+                    posixpath.join(path, child)
+                    for child in fnmatch.filter(
+                        [] if not payload else payload.split(NUL), part))
+            paths = matches
+
+        paths = [posixpath.join(path, *literal) for path in paths]
+        replies = self.pipeline((Op.READ, path + NUL) for path in paths)
+        for path, reply in zip(paths, replies):
+            try:
+                yield path, reply.get()
+            except PyXSError as e:
+                if e.args[0] != errno.ENOENT:
+                    raise
+
+    def tree(self, root=b"/", prefetch=None):
+        """Returns a :class:`~pyxs.tree.Node` for `root`, which loads
+        itself and its children on first access::
+
+            >>> backend = c.tree(b"/local/domain/0/backend", prefetch=2)
+            >>> backend[b"vif"][b"1"][b"0"][b"state"].value
+            b'4'
+
+        If the client is in a transaction, the tree is pinned to it:
+        nodes are loaded in the transaction, so that the view is
+        consistent, and fail to load once it ends.
+
+        :param bytes root: path of the root node.
+        :param int prefetch: if given, the root and `prefetch` levels
+                             below it are loaded right away, see
+                             :meth:`~pyxs.tree.Node.prefetch`.
+
+        .. versionadded:: 0.4.2
+        """
+        check_path(root)
+        client = copy.copy(self)
+        client.tx_id = self.tx_id
+        node = Node(client, root)
+        if prefetch is not None:
+            node.prefetch(prefetch)
+        return node
+
+    def copy_tree(self, src, dst, transaction_size=None):
+        """Copies the tree rooted at `src` to `dst` along with the
+        permissions. Values are written while the source is still being
+        listed, with many requests in flight.
+
+        :param bytes src: node to copy.
+        :param bytes dst: destination node, created if missing.
+        :param int transaction_size: if given, writes are committed in
+                                     transactions of at most that many
+                                     writes. Otherwise, the copy is only
+                                     atomic if the client is already in
+                                     a transaction.
+        :raises ValueError: if one of `src` and `dst` is inside the
+                            other.
+        """
+        check_path(dst)
+        _check_disjoint(src, dst)
+
+        def commands():
+            for path, value, _children, perms in self.walk(src, perms=True):
+                path = dst + path[len(src):] + NUL
+                yield Op.WRITE, path, value
+                if perms is not None:
+                    yield (Op.SET_PERMS, path) + tuple(perm + NUL
+                                                       for perm in perms)
+
+        self.ack_many(commands(), transaction_size)
+
+    def move_tree(self, src, dst, transaction_size=None):
+        """Moves the tree rooted at `src` to `dst`, by copying it with
+        :meth:`copy_tree` and then deleting `src`.
+
+        Unless `transaction_size` is given, the copy and the delete
+        are done in a single transaction, which is retried on conflict.
+        With `transaction_size` the move is *not* atomic: the copy is
+        committed in parts before `src` is deleted, so a failure may
+        leave a partial copy at `dst`.
+
+        :param bytes src: node to move.
+        :param bytes dst: destination node, created if missing.
+        :param int transaction_size: see :meth:`copy_tree`.
+        :raises ValueError: if one of `src` and `dst` is inside the
+                            other.
+        """
+        check_path(src)
+        check_path(dst)
+        _check_disjoint(src, dst)
+        if transaction_size and not self.tx_id:
+            self.copy_tree(src, dst, transaction_size)
+            self.delete(src)
+            return
+
+        def move():
+            self.copy_tree(src, dst)
+            self.delete(src)
+
+        self._transactional(move)
+
+    def set_perms_recursive(self, top, perms, transaction_size=None):
+        """Sets access permissions for `top` and all of its
+        descendants, see :meth:`set_perms`.
+
+        :param bytes top: node to start from.
+        :param list perms: a list of permissions to set.
+        :param int transaction_size: see :meth:`copy_tree`.
+        """
+        check_perms(perms)
+        args = [perm + NUL for perm in perms]
+        self.ack_many(((Op.SET_PERMS, path + NUL) + tuple(args)
+                       for path, _value, _children
+                       in self.walk(top, values=False)),
+                      transaction_size)
+
+    def snapshot(self, top, perms=True):
+        """Captures the tree rooted at `top`.
+
+        :param bytes top: node to start from.
+        :param bool perms: if ``False`` permissions are not fetched.
+        :returns dict: mapping each path to a ``(value, perms)`` pair,
+                       where ``perms`` is ``None`` unless requested.
+
+        .. versionadded:: 0.4.2
+        """
+        nodes = {}
+        for node in self.walk(top, perms=perms):
+            nodes[node[0]] = node[1], node[3] if perms else None
+        return nodes
+
+    def diff(self, top, snapshot):
+        """Compares the tree rooted at `top` with `snapshot` and yields
+        the changes, which would turn the former into the latter, in
+        the order they should be applied.
+
+        Each change is a ``Delta(kind, path, value, perms)``, where
+        ``kind`` is one of:
+
+        * ``"added"`` -- `path` is only in the `snapshot`;
+        * ``"changed"`` -- `path` has a different ``value`` in the
+          `snapshot`;
+        * ``"perms"`` -- `path` has different ``perms`` in the
+          `snapshot`;
+        * ``"removed"`` -- `path` and all of its descendants are only in
+          the live tree.
+
+        :param bytes top: node to start from.
+        :param dict snapshot: mapping of paths to ``(value, perms)``
+                              pairs, as returned by :meth:`snapshot`.
+                              Permissions are only compared for paths
+                              with ``perms`` other than ``None``.
+                              Ancestors of the paths in the `snapshot`
+                              are never removed.
+
+        .. versionadded:: 0.4.2
+        """
+        check_path(top)
+        with_perms = any(perms is not None
+                         for _value, perms in snapshot.values())
         try:
-            value = self.read(top)
-        except PyXSError:
-            value = b""  # '/' or no read permissions?
+            live = self.snapshot(top, with_perms)
+        except PyXSError as e:
+            if e.args[0] != errno.ENOENT:
+                raise
+
+            live = {}
 
-        if topdown:
-            yield top, value, children
+        # Ancestors of the snapshot paths are created implicitly.
+        implied = set()
+        for path in snapshot:
+            while path not in [top, b"/"]:
+                path = posixpath.dirname(path)
+                if path in implied:
+                    break
+
+                implied.add(path)
+
+        # Parents sort before their descendants.
+        for path in sorted(set(live) | set(snapshot)):
+            if path not in snapshot:
+                parent = posixpath.dirname(path)
+                if path not in implied and (path == top or
+                                            parent in implied or
+                                            parent in snapshot):
+                    yield Delta("removed", path, *live[path])
+                continue
+
+            value, perms = snapshot[path]
+            if path not in live:
+                yield Delta("added", path, value, perms)
+                continue
+
+            live_value, live_perms = live[path]
+            if value != live_value:
+                yield Delta("changed", path, value, None)
+            if perms is not None and perms != live_perms:
+                yield Delta("perms", path, None, perms)
+
+    def apply_diff(self, changes, transaction_size=None):
+        """Applies changes, as yielded by :meth:`diff`, using pipelined
+        writes, removals and permission updates.
+
+        Unless `transaction_size` is given, the changes are applied in
+        a single transaction, which is retried on conflict, so that
+        watchers never see a partially reconciled tree.
+
+        :param changes: an iterable of ``Delta`` tuples.
+        :param int transaction_size: see :meth:`copy_tree`.
+
+        .. versionadded:: 0.4.2
+        """
+        changes = list(changes)  # Replayed on conflict.
 
-        for child in children:
-            for x in self.walk(posixpath.join(top, child)):
-                yield x
+        def commands():
+            for kind, path, value, perms in changes:
+                check_path(path)
+                if kind == "removed":
+                    yield Op.RM, path + NUL
+                    continue
+                elif kind in ["added", "changed"]:
+                    yield Op.WRITE, path + NUL, value
+                elif kind != "perms":
+                    raise ValueError(kind)
+
+                if perms is not None:
+                    check_perms(perms)
+                    yield (Op.SET_PERMS, path + NUL) + tuple(
+                        perm + NUL for perm in perms)
+
+        if transaction_size:
+            self.ack_many(commands(), transaction_size)
+        else:
+            self._transactional(lambda: self.ack_many(commands()))
+
+    def write_blob(self, path, data, compress=True, chunk_size=1024):
+        """Writes arbitrary `data` of any size to `path`.
+
+        The data is optionally compressed with :mod:`zlib`, encoded
+        with Base64 and split into chunks, stored as children of `path`
+        named ``0``, ``1`` etc. The value of `path` is a header with
+        the number of chunks and a SHA-256 digest of the data. All of
+        the writes are pipelined in a single transaction, which is
+        retried on conflict, unless the client is already in one.
+        Chunks left from a larger blob are removed, while the other
+        children of `path` are left intact.
+
+        :param bytes path: path to write to.
+        :param bytes data: data to write.
+        :param bool compress: if ``False`` the data isn't compressed.
+        :param int chunk_size: maximum size of a chunk. Note that
+                               ``xenstored`` limits the size of a node
+                               for unprivileged domains.
+
+        .. versionadded:: 0.4.2
+        """
+        check_path(path)
+        encoded = base64.b64encode(zlib.compress(data) if compress
+                                   else data)
+        chunks = [encoded[offset:offset + chunk_size]
+                  for offset in range(0, len(encoded), chunk_size)]
+        header = " ".join([
+            "blob", "zlib" if compress else "raw", str(len(data)),
+            str(len(chunks)), hashlib.sha256(data).hexdigest()
+        ]).encode()
+
+        def write():
+            try:
+                children = self.list(path)
+            except PyXSError as e:
+                if e.args[0] != errno.ENOENT:
+                    raise
+
+                children = []
+
+            commands = [(Op.WRITE, path + NUL, header)]
+            commands.extend((Op.WRITE, posixpath.join(path, str(i).encode())
+                             + NUL, chunk) for i, chunk in enumerate(chunks))
+            # Chunks left from a larger blob.
+            commands.extend((Op.RM, posixpath.join(path, child) + NUL)
+                            for child in children
+                            if child.isdigit() and
+                            int(child) >= len(chunks))
+            self.ack_many(commands)
+
+        self._transactional(write)
+
+    def read_blob(self, path):
+        """Reads data written by :meth:`write_blob`. The chunks are read
+        in a single :meth:`pipeline`.
+
+        :param bytes path: path to read from.
+        :raises pyxs.exceptions.PyXSError:
+            with :data:`errno.EINVAL` if `path` doesn't contain a blob
+            and with :data:`errno.EIO` if the data doesn't match the
+            digest.
 
-        if not topdown:
-            yield top, value, children
+        .. versionadded:: 0.4.2
+        """
+        check_path(path)
+        for _attempt in range(3):
+            try:
+                (kind, encoding, size, count, digest) = \
+                    self.read(path).decode().split()
+                if kind != "blob" or encoding not in ["zlib", "raw"]:
+                    raise ValueError(kind, encoding)
+
+                size, count = int(size), int(count)
+            except (UnicodeDecodeError, ValueError):
+                raise error(errno.EINVAL)
+
+            replies = self.pipeline(
+                (Op.READ, posixpath.join(path, str(i).encode()) + NUL)
+                for i in range(count))
+            try:
+                data = base64.b64decode(b"".join(reply.get()
+                                                 for reply in replies))
+                if encoding == "zlib":
+                    data = zlib.decompress(data)
+            except (PyXSError, TypeError, ValueError, zlib.error):
+                # A chunk is missing or broken. This could happen if
+                # the blob is being rewritten, so try again.
+                continue
+
+            if (len(data) == size and
+                    hashlib.sha256(data).hexdigest() == digest):
+                return data
+
+        raise error(errno.EIO)
+
+    def wait_for(self, path, predicate, timeout=None):
+        """Blocks until the value of `path` satisfies `predicate` and
+        returns it. See :meth:`wait_for_all` for details.
+
+        >>> c.wait_for(backend + b"/state", b"4", timeout=10)
+        b'4'
+
+        .. versionadded:: 0.4.2
+        """
+        return self.wait_for_all({path: predicate}, timeout)[path]
+
+    def wait_for_all(self, conditions, timeout=None):
+        """Blocks until the value of each path satisfies its predicate.
+
+        The paths are watched by a single :class:`Monitor` and a path
+        is only re-read when an event for it arrives. Paths, which
+        changed at the same time, are re-read in a single
+        :meth:`pipeline`. Once a path satisfies its predicate, it is
+        no longer watched.
+
+        :param dict conditions: a mapping of paths to predicates. A
+                                predicate is either a function, which
+                                gets a value, or ``None`` if the path
+                                doesn't exist, and returns ``True`` to
+                                stop waiting, or a value to wait for.
+        :param float timeout: maximum number of seconds to wait for.
+        :returns dict: a mapping of paths to values, which satisfied
+                       the predicates.
+        :raises pyxs.exceptions.PyXSError:
+            with :data:`errno.ETIMEDOUT` if some of the predicates were
+            not satisfied in time.
+
+        .. versionadded:: 0.4.2
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        pending = {}
+        for path, predicate in conditions.items():
+            check_path(path)
+            if not callable(predicate):
+                predicate = partial(operator.eq, predicate)
+            pending[path] = predicate
+
+        values = {}
+        with self.monitor() as m:
+            # ``xenstored`` fires an event for each new watch, so the
+            # paths are read for the first time below.
+            m.watch_many((path, path) for path in pending)
+            while pending:
+                remaining = None
+                if deadline is not None:
+                    remaining = max(deadline - time.time(), 0)
+
+                event = m.next_event(timeout=remaining)
+                if event is None:
+                    raise error(errno.ETIMEDOUT)
+
+                tokens = set()
+                while event is not None:
+                    tokens.add(event.token)
+                    event = m.next_event(block=False)
+
+                if m.OVERFLOW.token in tokens:
+                    paths = list(pending)
+                else:
+                    paths = [path for path in tokens if path in pending]
+
+                replies = self.pipeline((Op.READ, path + NUL)
+                                        for path in paths)
+                done = []
+                for path, reply in zip(paths, replies):
+                    try:
+                        value = reply.get()
+                    except PyXSError as e:
+                        if e.args[0] != errno.ENOENT:
+                            raise
+
+                        value = None
+
+                    if pending[path](value):
+                        values[path] = value
+                        done.append(path)
+                        del pending[path]
+
+                if done and pending:
+                    m.unwatch_many((path, path) for path in done)
+        return values
 
     def get_domain_path(self, domid):
         """Returns the domain's base path, as used for relative
@@ -537,6 +2028,25 @@ class Client(object):
         self.ack(Op.SET_TARGET, str(domid).encode() + NUL,
                  str(target).encode() + NUL)
 
+    def reset_watches(self):
+        """Removes all watches and pending watch events for the
+        connection. ``xenstored`` also aborts all transactions running
+        on the connection.
+
+        :raises pyxs.exceptions.PyXSError:
+            with :data:`errno.EINVAL` if ``xenstored`` doesn't support
+            ``RESET_WATCHES``.
+
+        .. versionadded:: 0.4.2
+        """
+        try:
+            self.ack(Op.RESET_WATCHES, NUL)
+        except PyXSError as e:
+            if e.args[0] == errno.EINVAL:
+                self.router.unsupported.add(Op.RESET_WATCHES)
+
+            raise
+
     def transaction(self):
         """Starts a new transaction.
 
@@ -555,6 +2065,7 @@ class Client(object):
 
         payload = self.execute_command(Op.TRANSACTION_START, NUL)
         self.tx_id = int(payload)
+        self.router.transactions.add(self.tx_id)
         return self.tx_id
 
     def rollback(self):
@@ -567,7 +2078,10 @@ class Client(object):
            longer the case. The method will send the corresponding command
            to XenStore.
         """
-        self.ack(Op.TRANSACTION_END, b"F" + NUL)
+        try:
+            self.ack(Op.TRANSACTION_END, b"F" + NUL)
+        finally:
+            self.router.transactions.discard(self.tx_id)
         self.tx_id = 0
 
     def commit(self):
@@ -594,11 +2108,15 @@ class Client(object):
 
             raise
         else:
+            if self.negative_cache is not None:
+                # The paths were only created now.
+                self.negative_cache.clear()
             return True
         finally:
+            self.router.transactions.discard(self.tx_id)
             self.tx_id = 0
 
-    def monitor(self):
+    def monitor(self, dedicated=False, **kwargs):
         """Returns a new :class:`Monitor` instance, which is currently
         the only way of doing PUBSUB.
 
@@ -606,6 +2124,13 @@ class Client(object):
         the client invalidates the monitor. Closing the monitor, on the
         other hand, had no effect on the router state.
 
+        :param bool dedicated: if ``True`` the caller promises that no
+                               one else uses the connection, so the
+                               monitor can drop all of its watches with
+                               a single :meth:`reset_watches` on close.
+
+        Other keyword arguments are forwarded to :class:`Monitor`.
+
         .. note::
 
            Using :meth:`monitor` over
@@ -620,7 +2145,7 @@ class Client(object):
             raise PyXSError("using ``Monitor`` over XenBus is not supported",
                             UserWarning)
 
-        return Monitor(copy.copy(self))
+        return Monitor(copy.copy(self), dedicated, **kwargs)
 
 
 class Monitor(object):
@@ -633,17 +2158,55 @@ class Monitor(object):
     Event(...)
 
     :param Client client: a reference to the parent client.
+    :param bool dedicated: see :meth:`Client.monitor`.
+    :param int maxsize: maximum number of queued events, unbounded by
+                        default.
+    :param str overflow: what to do with an event, which doesn't fit
+                         into the queue:
+
+                         * :data:`BLOCK` -- block the router until the
+                           consumer catches up. Note that this blocks
+                           *all* replies delivered by the router;
+                         * :data:`DROP_OLDEST` -- drop the oldest queued
+                           event;
+                         * :data:`RESYNC` -- drop all queued events and
+                           queue a single :data:`OVERFLOW` event instead.
+                           The consumer is then expected to re-read the
+                           watched paths.
 
     .. note::
 
        When used as a context manager the monitor will try to unwatch
        all watched paths.
+
+    .. versionchanged:: 0.4.2
+
+       Added ``maxsize`` and ``overflow`` arguments.
     """
-    def __init__(self, client):
+    #: Overflow policies, see :class:`Monitor` for details.
+    BLOCK, DROP_OLDEST, RESYNC = "block", "drop_oldest", "resync"
+
+    #: An event yielded by :meth:`wait` in place of the events dropped
+    #: by :data:`RESYNC` policy.
+    OVERFLOW = Event(b"@overflow", b"")
+
+    def __init__(self, client, dedicated=False, maxsize=0, overflow=BLOCK):
+        if overflow not in [self.BLOCK, self.DROP_OLDEST, self.RESYNC]:
+            raise ValueError(overflow)
+
         self.client = client
-        self.events = queue.Queue()
+        self.dedicated = dedicated
+        self.overflow = overflow
+        self.events = queue.Queue(maxsize)
         self.unwatch_queue = set()
 
+        #: Number of events dropped due to queue overflow.
+        self.dropped = 0
+
+        # A pipe, which is written to on each event, see ``fileno``.
+        self.signal = None
+        self.signal_lock = threading.Lock()
+
     def __enter__(self):
         return self
 
@@ -655,10 +2218,129 @@ class Monitor(object):
         """A set of paths currently watched by the monitor."""
         return set(wpath for wpath, token in self.unwatch_queue)
 
+    def fileno(self):
+        """Returns a file descriptor, which becomes readable when
+        events arrive, so that the monitor could be used with
+        :mod:`select` and the like. Use :meth:`poll_events` to fetch
+        the events once it is readable::
+
+            m.watch(b"/foo/bar", b"token")
+            while True:
+                rlist, _wlist, _xlist = select.select([m, sock], [], [])
+                if m in rlist:
+                    for event in m.poll_events():
+                        handle(event)
+                ...
+
+        The descriptor is closed by :meth:`close`.
+
+        .. versionadded:: 0.4.2
+        """
+        with self.signal_lock:
+            if self.signal is None:
+                self.signal = _nonblocking_pipe()
+
+        if self.events.qsize():
+            self.notify()
+        return self.signal[0]
+
+    def after_fork(self):
+        """Detaches the monitor from the state shared with the parent
+        process, see :meth:`Router.after_fork`.
+
+        .. versionadded:: 0.4.2
+        """
+        self.unwatch_queue.clear()
+        self.events = queue.Queue(self.events.maxsize)
+
+        # Another thread of the parent may have held the lock.
+        self.signal_lock = threading.Lock()
+        if self.signal is not None:
+            # The pipe is shared with the parent. Replace it, keeping
+            # the descriptor the caller may be selecting on.
+            for fd, new_fd in zip(self.signal, _nonblocking_pipe()):
+                os.dup2(new_fd, fd)
+                os.close(new_fd)
+
+    def poll_events(self, unwatched=False):
+        """Returns a list of queued events without blocking.
+
+        :param bool unwatched: see :meth:`wait`.
+
+        .. versionadded:: 0.4.2
+        """
+        if self.signal is not None:
+            # Events arriving after this are signalled again.
+            try:
+                while os.read(self.signal[0], 4096):
+                    pass
+            except OSError as e:
+                if e.args[0] not in [errno.EAGAIN, errno.EWOULDBLOCK]:
+                    raise
+
+        events = []
+        while True:
+            event = self.next_event(unwatched, block=False)
+            if event is None:
+                return events
+
+            events.append(event)
+
+    def notify(self):
+        with self.signal_lock:
+            if self.signal is None:
+                return
+
+            try:
+                os.write(self.signal[1], NUL)
+            except OSError as e:
+                # A full pipe is readable anyway.
+                if e.args[0] not in [errno.EAGAIN, errno.EWOULDBLOCK]:
+                    raise
+
     def close(self):
-        """Finalizes the monitor by unwatching all watched paths."""
-        for wpath, token in list(self.unwatch_queue):
-            self.unwatch(wpath, token)
+        """Finalizes the monitor by unwatching all watched paths.
+
+        .. versionchanged:: 0.4.2
+
+           Paths are unwatched with :meth:`unwatch_many`, or with a
+           single :meth:`~Client.reset_watches` if the monitor is
+           dedicated and ``xenstored`` supports it. Since the reset
+           affects the whole connection, it is only used if no other
+           monitor watches through the router and no transactions are
+           running.
+        """
+        with self.signal_lock:
+            if self.signal is not None:
+                for fd in self.signal:
+                    os.close(fd)
+                self.signal = None
+
+        router = self.client.router
+        if self.dedicated and Op.RESET_WATCHES not in router.unsupported:
+            with router.watch_lock:
+                owned = not router.transactions and all(
+                    monitor is self
+                    for subscribers in router.monitors.values()
+                    for monitor, _token in subscribers)
+                if owned and self._reset_watches():
+                    return
+
+        self.unwatch_many(list(self.unwatch_queue))
+
+    def _reset_watches(self):
+        router = self.client.router
+        try:
+            self.client.reset_watches()
+        except PyXSError as e:
+            if e.args[0] != errno.EINVAL:
+                raise
+            return False
+
+        for wpath, token in self.unwatch_queue:
+            router.unsubscribe(wpath, token, self)
+        self.unwatch_queue.clear()
+        return True
 
     def watch(self, wpath, token):
         """Adds a watch.
@@ -672,11 +2354,13 @@ class Monitor(object):
 
         :param bytes wpath: path to watch.
         :param bytes token: watch token, returned in watch notification.
+
+        .. versionchanged:: 0.4.2
+
+           If another monitor on the same router already watches
+           `wpath`, the watch is shared, see :meth:`watch_many`.
         """
-        check_watch_path(wpath)
-        self.client.router.subscribe(token, self)
-        self.client.ack(Op.WATCH, wpath + NUL, token + NUL)
-        self.unwatch_queue.add((wpath, token))
+        self.watch_many([(wpath, token)])
 
     def unwatch(self, wpath, token):
         """Removes a previously added watch.
@@ -684,10 +2368,152 @@ class Monitor(object):
         :param bytes wpath: path to unwatch.
         :param bytes token: watch token, passed to :meth:`watch`.
         """
-        check_watch_path(wpath)
-        self.client.ack(Op.UNWATCH, wpath + NUL, token + NUL)
-        self.client.router.unsubscribe(token, self)
-        self.unwatch_queue.discard((wpath, token))
+        self.unwatch_many([(wpath, token)])
+
+    def watch_many(self, pairs):
+        """Adds watches for multiple ``(wpath, token)`` pairs, sending
+        all of the requests in a single :meth:`~Client.pipeline`.
+
+        Monitors sharing a router share the watches as well: a path is
+        watched by ``xenstored`` once, and the router delivers its
+        events to every monitor watching it. A monitor watching an
+        already watched path gets the initial event from the router.
+
+        :raises pyxs.exceptions.PyXSError: the first error, if any of
+            the watches failed. The rest of the watches are added
+            nevertheless.
+        """
+        pairs = list(pairs)
+        for wpath, token in pairs:
+            check_watch_path(wpath)
+
+        router = self.client.router
+        if router.is_forked:
+            router.after_fork()
+
+        # Tokens subscribed to a watch registered by this call, which
+        # succeed or fail along with the watch.
+        pending = {}
+
+        def added(wpath, token):
+            for token in [token] + pending.get(wpath, []):
+                self.unwatch_queue.add((wpath, token))
+
+        def failed(wpath, token):
+            for token in [token] + pending.get(wpath, []):
+                router.unsubscribe(wpath, token, self)
+
+        with router.watch_lock:
+            first_error = None
+            watches = []
+            for wpath, token in pairs:
+                try:
+                    shared = router.subscribe(wpath, token, self)
+                except PyXSError as e:
+                    first_error = first_error or e
+                    continue
+
+                if shared is not None:
+                    pending[wpath] = []
+                    watches.append((wpath, token, shared))
+                elif wpath in pending:
+                    pending[wpath].append(token)
+                else:
+                    added(wpath, token)
+
+            self._pipeline(Op.WATCH, watches, added, failed, first_error)
+
+    def unwatch_many(self, pairs):
+        """Removes multiple previously added watches, sending all of
+        the requests in a single :meth:`~Client.pipeline`.
+
+        A shared watch is only removed from ``xenstored`` once the
+        last monitor unwatches it.
+
+        :raises pyxs.exceptions.PyXSError: the first error, if any of
+            the watches couldn't be removed.
+        """
+        pairs = list(pairs)
+        for wpath, token in pairs:
+            check_watch_path(wpath)
+
+        router = self.client.router
+        with router.watch_lock:
+            first_error = None
+            watches = []
+            for wpath, token in pairs:
+                if (wpath, token) not in self.unwatch_queue:
+                    first_error = first_error or error(errno.ENOENT)
+                    continue
+
+                self.unwatch_queue.discard((wpath, token))
+                shared = router.unsubscribe(wpath, token, self)
+                if shared is not None:
+                    watches.append((wpath, token, shared))
+
+            self._pipeline(Op.UNWATCH, watches, lambda *pair: None,
+                           lambda *pair: None, first_error)
+
+    def _pipeline(self, op, watches, on_success, on_failure,
+                  first_error=None):
+        replies = self.client.pipeline((op, wpath + NUL, shared + NUL)
+                                       for wpath, _token, shared in watches)
+        for (wpath, token, _shared), reply in zip(watches, replies):
+            try:
+                payload = reply.get()
+                if payload != b"OK":
+                    raise PyXSError(payload)
+            except PyXSError as e:
+                first_error = first_error or e
+                on_failure(wpath, token)
+            else:
+                on_success(wpath, token)
+
+        if first_error is not None:
+            raise first_error
+
+    def deliver(self, event):
+        """Queues an event received by the router, following the
+        overflow policy if the queue is full.
+        """
+        self.enqueue(event)
+        if self.signal is not None:
+            self.notify()
+
+    def enqueue(self, event):
+        if self.overflow == self.BLOCK:
+            self.events.put(event)
+            return
+
+        try:
+            self.events.put_nowait(event)
+            return
+        except queue.Full:
+            pass
+
+        # The router is the only producer, so there is always room
+        # for an event after taking one out.
+        if self.overflow == self.DROP_OLDEST:
+            try:
+                self.events.get_nowait()
+            except queue.Empty:
+                pass
+            else:
+                self.dropped += 1
+        else:
+            while True:
+                try:
+                    dropped = self.events.get_nowait()
+                except queue.Empty:
+                    break
+
+                if dropped is not self.OVERFLOW:
+                    self.dropped += 1
+
+            self.dropped += 1  # The incoming event.
+            event = self.OVERFLOW
+
+        self.events.put_nowait(event)
 
     def wait(self, unwatched=False):
         """Yields events for all of the watched paths.
@@ -699,17 +2525,49 @@ class Monitor(object):
         :param bool unwatched: if ``True`` :meth:`wait` might yield
                                spurious unwatched packets, otherwise
                                these are dropped. Defaults to ``False``.
+
+        If the events were dropped by :data:`RESYNC` overflow policy,
+        :data:`OVERFLOW` is yielded in their place.
         """
         while True:
-            with self.events.not_empty:
-                while not self.events._qsize():
-                    _condition_wait(self.events.not_empty)
+            yield self.next_event(unwatched)
+
+    def next_event(self, unwatched=False, block=True, timeout=None):
+        """Blocks until the next event is available and returns it.
+        Unlike :meth:`wait` it is safe to call from multiple threads.
+
+        :param bool unwatched: see :meth:`wait`.
+        :param bool block: if ``False`` and there are no events queued,
+                           ``None`` is returned immediately.
+        :param float timeout: if given, ``None`` is returned if no event
+                              arrived within `timeout` seconds.
+
+        .. versionadded:: 0.4.2
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            if block:
+                remaining = None
+                if deadline is not None:
+                    remaining = max(deadline - time.time(), 0)
+                if not self.client.router.wait_events(self, remaining):
+                    return None
+
+            try:
+                event = wpath, token = self.events.get_nowait()
+            except queue.Empty:
+                if not block:
+                    return None
+
+                continue  # Another consumer got here first.
 
-            event = wpath, token = self.events.get_nowait()
+            if event is self.OVERFLOW:
+                return event
 
             # Check that event path or its parent is watched.
             while wpath and (wpath, token) not in self.unwatch_queue:
-                wpath = posixpath.dirname(wpath)
+                parent = posixpath.dirname(wpath)
+                wpath = parent if parent != wpath else None
 
             if wpath or unwatched:
-                yield event
+                return event
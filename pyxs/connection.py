@@ -69,6 +69,21 @@ class PacketConnection(object):
         finally:
             self.transport = None
 
+    def release(self):
+        """Closes the file descriptor without shutting down the
+        connection, which might still be in use by another process,
+        e.g. the parent of a forked process.
+        """
+        if not self.is_connected:
+            return
+
+        try:
+            self.transport.release()
+        except OSError:
+            pass
+        finally:
+            self.transport = None
+
     def send(self, packet):
         """Sends a given packet to XenStore.
 
@@ -163,6 +178,9 @@ class _UnixSocketTransport(object):
         self.sock.shutdown(socket.SHUT_RDWR)
         self.sock.close()
 
+    def release(self):
+        self.sock.close()
+
 
 class UnixSocketConnection(PacketConnection):
     """XenStore connection through Unix domain socket.
@@ -230,6 +248,8 @@ class _XenBusTransport(object):
     def close(self):
         return os.close(self.fd)
 
+    release = close
+
 
 class XenBusConnection(PacketConnection):
     """XenStore connection through XenBus.
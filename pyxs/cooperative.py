@@ -0,0 +1,377 @@
+# -*- coding: utf-8 -*-
+"""
+    pyxs.cooperative
+    ~~~~~~~~~~~~~~~~
+
+    This module implements a threadless router, which is suitable for
+    cooperative multitasking libraries like `gevent`_ or `eventlet`_.
+
+    .. _gevent: http://www.gevent.org
+    .. _eventlet: http://eventlet.net
+
+    :copyright: (c) 2016 by pyxs authors and contributors, see AUTHORS
+                for more details.
+    :license: LGPL, see LICENSE for more details.
+"""
+
+from __future__ import absolute_import
+
+__all__ = ["Primitives", "CooperativeRouter"]
+
+import errno
+import fcntl
+import os
+import select
+import socket
+import threading
+import time
+from collections import defaultdict, deque
+
+from ._internal import NUL, Op, Packet
+from .client import Router
+from .exceptions import ConnectionError
+
+
+def _select_read(fd, timeout=None):
+    select.select([fd], [], [], timeout)
+
+
+def _select_write(fd):
+    select.select([], [fd], [])
+
+
+class Primitives(object):
+    """Blocking primitives used by :class:`CooperativeRouter`.
+
+    :param wait_read: a function, which blocks until a given file
+                      descriptor is readable. It is passed a timeout
+                      in seconds as the second argument when a caller
+                      waits with a timeout, and should return once the
+                      timeout expires.
+    :param wait_write: a function, which blocks until a given file
+                       descriptor is writable.
+    :param lock: a lock factory. Locks must support non-blocking
+                 ``acquire(False)`` and the context manager protocol.
+    :param event: an event factory. Events must support ``set`` and
+                  ``wait`` with an optional timeout.
+
+    The defaults use :func:`select.select` and :mod:`threading`, which
+    makes the router usable from ordinary threads as well.
+    """
+    def __init__(self, wait_read=_select_read, wait_write=_select_write,
+                 lock=threading.Lock, event=threading.Event):
+        self.wait_read = wait_read
+        self.wait_write = wait_write
+        self.lock = lock
+        self.event = event
+
+    @classmethod
+    def gevent(cls):
+        """Returns primitives for use with `gevent`_."""
+        from gevent.event import Event
+        from gevent.lock import Semaphore
+        from gevent.socket import wait_read, wait_write
+
+        def wait_read_timeout(fd, timeout=None):
+            try:
+                wait_read(fd, timeout)
+            except socket.timeout:
+                pass
+
+        return cls(wait_read_timeout, wait_write, Semaphore, Event)
+
+    @classmethod
+    def eventlet(cls):
+        """Returns primitives for use with `eventlet`_."""
+        from eventlet.green import threading as green
+        from eventlet.hubs import trampoline
+        from eventlet.timeout import Timeout
+
+        def wait_read(fd, timeout=None):
+            try:
+                trampoline(fd, read=True, timeout=timeout)
+            except Timeout:
+                pass
+
+        return cls(wait_read, lambda fd: trampoline(fd, write=True),
+                   green.Lock, green.Event)
+
+
+class _Waiter(object):
+    __slots__ = ["event"]
+
+    def __init__(self):
+        self.event = None
+
+    def wake(self):
+        if self.event is not None:
+            self.event.set()
+
+
+class CooperativeRVar(_Waiter):
+    """A reference to the XenStore response, which is filled by
+    whoever is waiting on the router at the moment.
+    """
+    __slots__ = ["router", "target"]
+
+    def __init__(self, router):
+        super(CooperativeRVar, self).__init__()
+        self.router = router
+        self.target = None
+
+    def __repr__(self):
+        return "CooperativeRVar({0})".format(self.target)
+
+    def ready(self):
+        return self.target is not None
+
+    def get(self):
+        self.router.wait(self)
+        return self.target
+
+    def set(self, target):
+        self.target = target
+        self.wake()
+
+
+class _EventsWaiter(_Waiter):
+    __slots__ = ["monitor"]
+
+    def __init__(self, monitor):
+        super(_EventsWaiter, self).__init__()
+        self.monitor = monitor
+
+    def ready(self):
+        return self.monitor.events.qsize() > 0
+
+
+class CooperativeRouter(Router):
+    """A router, which doesn't start a thread.
+
+    The connection is switched to non-blocking mode. Instead of a
+    dedicated router thread, one of the callers waiting for a reply
+    reads packets from XenStore and dispatches them to the rest of the
+    waiters. Once its own reply arrives, it wakes up one of the
+    remaining waiters to take over. Blocking is delegated to
+    :class:`Primitives`, so that, for instance, thousands of greenlets
+    could share a single connection::
+
+        from pyxs import Client
+        from pyxs.connection import UnixSocketConnection
+        from pyxs.cooperative import CooperativeRouter, Primitives
+
+        router = CooperativeRouter(UnixSocketConnection(),
+                                   Primitives.gevent())
+        with Client(router=router) as c:
+            gevent.joinall([gevent.spawn(c.read, path) for path in paths])
+
+    Unlike :class:`~pyxs.client.Router`, the cooperative router
+    doesn't guarantee prompt termination if there are callers blocked
+    in it. Requests are sent in order, regardless of their priority.
+
+    .. versionadded:: 0.4.2
+
+    :param connection FileDescriptorConnection: see
+        :class:`~pyxs.client.Router`.
+    :param Primitives primitives: blocking primitives to use.
+    """
+    def __init__(self, connection, primitives=None):
+        self.primitives = primitives or Primitives()
+        super(CooperativeRouter, self).__init__(connection)
+
+    def __repr__(self):
+        return "CooperativeRouter({0})".format(self.connection)
+
+    def __call__(self):
+        raise TypeError("CooperativeRouter doesn't run in a thread")
+
+    def setup(self):
+        self.pid = os.getpid()
+        self.send_lock = self.primitives.lock()
+        self.watch_lock = self.primitives.lock()
+        self.pump_lock = self.primitives.lock()
+        self.rvars = {}
+        self.transactions = set()
+        self.fresh = set()
+        self.scheduler = None
+        self.waiters = set()
+        self.sleepers = deque()
+        self.events_waiters = defaultdict(set)
+        self.buffer = bytearray()
+
+    def teardown(self):
+        pass
+
+    def dispatch(self, packet):
+        super(CooperativeRouter, self).dispatch(packet)
+
+        if packet.op == Op.WATCH_EVENT and self.events_waiters:
+            _path, shared = packet.payload.split(NUL)[:-1]
+            for monitor, _token in self.monitors.get(shared, ()):
+                for waiter in self.events_waiters.get(monitor, ()):
+                    waiter.wake()
+
+    def post(self, monitor, event):
+        monitor.deliver(event)
+        for waiter in self.events_waiters.get(monitor, ()):
+            waiter.wake()
+
+    def wait(self, waiter, timeout=None):
+        """Blocks until ``waiter`` is ready, reading and dispatching
+        packets if no one else does.
+
+        :param float timeout: if given, the maximum number of seconds
+                              to wait for.
+        :returns bool: ``False`` if the wait timed out.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        self.waiters.add(waiter)
+        try:
+            while not waiter.ready():
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return False
+
+                # The waiter must be queued *before* trying to become
+                # the leader. Otherwise the current leader could miss
+                # it when stepping down.
+                waiter.event = self.primitives.event()
+                self.sleepers.append(waiter)
+                if self.pump_lock.acquire(False):
+                    try:
+                        while not waiter.ready():
+                            packet = self.recv(deadline)
+                            if packet is None:
+                                return False
+
+                            self.dispatch(packet)
+                    finally:
+                        self.pump_lock.release()
+                        self.promote(waiter)
+                elif not waiter.ready():
+                    waiter.event.wait(remaining)
+            return True
+        finally:
+            self.waiters.discard(waiter)
+
+    def promote(self, leader):
+        """Wakes up one of the waiters to take over reading."""
+        while True:
+            try:
+                waiter = self.sleepers.popleft()
+            except IndexError:
+                break
+
+            # Waiters, which timed out, are no longer waiting.
+            if (waiter is not leader and waiter in self.waiters and
+                    not waiter.ready()):
+                waiter.wake()
+                break
+
+    def wait_events(self, monitor, timeout=None):
+        waiter = _EventsWaiter(monitor)
+        self.events_waiters[monitor].add(waiter)
+        try:
+            return self.wait(waiter, timeout)
+        finally:
+            self.events_waiters[monitor].discard(waiter)
+            if not self.events_waiters[monitor]:
+                del self.events_waiters[monitor]
+
+    def recv(self, deadline=None):
+        """Reads a single packet, blocking if necessary.
+
+        :param float deadline: if given, ``None`` is returned if no
+                               packet arrived by then.
+        """
+        header_size = Packet._struct.size
+        while True:
+            if len(self.buffer) >= header_size:
+                op, rq_id, tx_id, size = Packet._struct.unpack(
+                    bytes(self.buffer[:header_size]))
+                if len(self.buffer) >= header_size + size:
+                    payload = bytes(self.buffer[header_size:
+                                                header_size + size])
+                    del self.buffer[:header_size + size]
+                    return Packet(op, payload, rq_id, tx_id)
+
+            data = self._io(os.read, self.primitives.wait_read, 65536,
+                            deadline)
+            if data is None:
+                return None
+
+            self.buffer.extend(data)
+
+    def send(self, packet, priority=Router.INTERACTIVE):
+        if self.is_forked:
+            self.after_fork()
+
+        data = memoryview(Packet._struct.pack(
+            packet.op, packet.rq_id, packet.tx_id, packet.size) +
+            packet.payload)
+        with self.send_lock:
+            # The order here matters. XenStore might reply to the packet
+            # *before* the ``rvar`` is registered.
+            self.rvars[packet.rq_id] = rvar = CooperativeRVar(self)
+            while data:
+                data = data[self._io(os.write, self.primitives.wait_write,
+                                     data):]
+            return rvar
+
+    def _io(self, f, wait, arg, deadline=None):
+        if not self.is_connected:
+            raise ConnectionError("not connected")
+
+        fd = self.connection.fileno()
+        while True:
+            try:
+                result = f(fd, arg)
+            except OSError as e:
+                if e.args[0] in [errno.EAGAIN, errno.EWOULDBLOCK]:
+                    if deadline is None:
+                        wait(fd)
+                        continue
+
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return None
+
+                    wait(fd, remaining)
+                    continue
+                elif e.args[0] == errno.EINTR:
+                    continue
+
+                self.connection.close()
+                raise ConnectionError("error while communicating with "
+                                      "{0!r}: {1}".format(
+                                          self.connection.path, e.args))
+
+            if f is os.read and not result:
+                self.connection.close()
+                raise ConnectionError("connection to {0!r} closed"
+                                      .format(self.connection.path))
+
+            return result
+
+    def start(self):
+        if self.is_forked:
+            self.after_fork(restart=False)
+
+        self.connection.connect()
+        fd = self.connection.fileno()
+        flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+        fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+    def terminate(self):
+        if self.is_forked:
+            self.after_fork(restart=False)
+            return
+
+        self.connection.close()
+        self.buffer = bytearray()
+
+        # Let the waiters notice that the connection is gone.
+        for waiter in list(self.waiters):
+            waiter.wake()
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+    pyxs.domains
+    ~~~~~~~~~~~~
+
+    This module implements a registry of running domains, which is
+    kept up to date by watching ``@introduceDomain`` and
+    ``@releaseDomain``.
+
+    :copyright: (c) 2016 by pyxs authors and contributors, see AUTHORS
+                for more details.
+    :license: LGPL, see LICENSE for more details.
+"""
+
+from __future__ import absolute_import
+
+__all__ = ["DomainEvent", "DomainRegistry"]
+
+import errno
+import threading
+from collections import namedtuple
+
+from ._internal import NUL, Op
+from .client import Monitor
+from .exceptions import PyXSError
+
+#: A domain was introduced or released. ``kind`` is either
+#: ``"introduced"`` or ``"released"``.
+DomainEvent = namedtuple("DomainEvent", "kind domid path")
+
+
+class DomainRegistry(object):
+    """A live mapping of domids to domain paths.
+
+    Neither ``@introduceDomain`` nor ``@releaseDomain`` tell which
+    domain the event is about, so the registry re-lists `root` when
+    they fire and reports the difference as :data:`DomainEvent`
+    tuples. The toolstack may remove the entry of a released domain
+    only some time after ``@releaseDomain``, so a listed domain only
+    counts as running if it is introduced as well, see
+    :meth:`~pyxs.client.Client.is_domain_introduced`. The checks and
+    the paths of new domains are done in a single
+    :meth:`~pyxs.client.Client.pipeline`. Lookups never talk to
+    XenStore unless the domain is unknown::
+
+        with Client() as c:
+            with DomainRegistry(c) as domains:
+                for kind, domid, path in domains.wait():
+                    print(kind, domid, path)
+
+    Lookups are safe to do from other threads, while one thread is
+    iterating over :meth:`wait`.
+
+    .. versionadded:: 0.4.2
+
+    :param pyxs.client.Client client: client to use.
+    :param bytes root: directory with an entry for each domain.
+    """
+    WATCHES = [(b"@introduceDomain", b"introduce"),
+               (b"@releaseDomain", b"release")]
+
+    def __init__(self, client, root=b"/local/domain"):
+        self.client = client
+        self.root = root
+        self.paths = {}
+        self.lock = threading.Lock()
+        self.monitor = None
+
+    def __repr__(self):
+        return "DomainRegistry({0!r})".format(self.client)
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __contains__(self, domid):
+        return domid in self.paths
+
+    def __iter__(self):
+        return iter(sorted(self.paths))
+
+    def __len__(self):
+        return len(self.paths)
+
+    def open(self):
+        """Starts watching for domain changes and lists the running
+        domains.
+        """
+        # A single queued event is enough to trigger a refresh.
+        self.monitor = self.client.monitor(overflow=Monitor.DROP_OLDEST,
+                                           maxsize=1)
+        self.monitor.watch_many(self.WATCHES)
+        self.refresh()
+
+    def close(self):
+        if self.monitor is not None:
+            self.monitor.close()
+            self.monitor = None
+
+    def get_domain_path(self, domid):
+        """Returns the base path of a given `domid`, see
+        :meth:`~pyxs.client.Client.get_domain_path`.
+        """
+        try:
+            return self.paths[domid]
+        except KeyError:
+            return self.client.get_domain_path(domid)
+
+    def refresh(self):
+        """Re-lists `root` and updates the registry.
+
+        :returns list: of :data:`DomainEvent` tuples for the domains,
+                       which were introduced or released since the
+                       last refresh.
+        """
+        try:
+            children = self.client.list(self.root)
+        except PyXSError as e:
+            if e.args[0] != errno.ENOENT:
+                raise
+
+            children = []
+
+        listed = sorted(int(child) for child in children if child.isdigit())
+        with self.lock:
+            unknown = [domid for domid in listed if domid not in self.paths]
+            commands = [(Op.IS_DOMAIN_INTRODUCED, str(domid).encode() + NUL)
+                        for domid in listed]
+            commands.extend((Op.GET_DOMAIN_PATH, str(domid).encode() + NUL)
+                            for domid in unknown)
+            replies = list(self.client.pipeline(commands))
+
+            domids = set(domid for domid, reply in zip(listed, replies)
+                         if _is_introduced(reply))
+            released = sorted(set(self.paths) - domids)
+            introduced = sorted(domids - set(self.paths))
+
+            events = [DomainEvent("released", domid, self.paths[domid])
+                      for domid in released]
+            new_paths = dict(zip(unknown, replies[len(listed):]))
+            for domid in introduced:
+                events.append(DomainEvent("introduced", domid,
+                                          new_paths[domid].get()))
+
+            paths = self.paths.copy()
+            for kind, domid, path in events:
+                if kind == "released":
+                    del paths[domid]
+                else:
+                    paths[domid] = path
+
+            # Swapped at once, so that lookups don't need the lock.
+            self.paths = paths
+        return events
+
+    def wait(self):
+        """Yields :data:`DomainEvent` tuples as domains come and go.
+
+        Events which arrive while the registry is refreshing are
+        coalesced into a single refresh.
+        """
+        while True:
+            self.monitor.next_event()
+            for event in self.refresh():
+                yield event
+
+
+def _is_introduced(reply):
+    try:
+        return reply.get() == b"T"
+    except PyXSError:
+        # ``xenstored`` won't tell an unprivileged client, so the
+        # listing has to do.
+        return True
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+    pyxs.feed
+    ~~~~~~~~~
+
+    This module implements a persistent log of XenStore changes, which
+    allows consumers to catch up after a restart instead of re-reading
+    the whole tree.
+
+    :copyright: (c) 2016 by pyxs authors and contributors, see AUTHORS
+                for more details.
+    :license: LGPL, see LICENSE for more details.
+"""
+
+from __future__ import absolute_import
+
+__all__ = ["Change", "ChangeLog", "ChangeFeed"]
+
+import errno
+import os
+import struct
+import time
+from collections import namedtuple
+
+from ._internal import NUL, Op
+from .exceptions import PyXSError
+
+#: A single recorded change. ``value`` is ``None`` if the path didn't
+#: exist or couldn't be read when the event was received.
+Change = namedtuple("Change", "seq timestamp path token value")
+
+
+class ChangeLog(object):
+    """An append-only file of :class:`Change` records.
+
+    Each record is a fixed-size header followed by path, token and
+    value bytes. A partially written record at the end of the file,
+    e.g. left by a crash, is discarded on open.
+
+    :param str filename: path to the log file, created if missing.
+    :param bool sync: if ``True`` the file is :func:`os.fsync`-ed after
+                      each :meth:`append`.
+    """
+    #: ``seq``, ``timestamp`` and lengths of path, token and value;
+    #: value length is ``-1`` for missing values.
+    _struct = struct.Struct(b"<QdHHi")
+
+    def __init__(self, filename, sync=False):
+        self.filename = filename
+        self.sync = sync
+        self.last_seq = 0
+
+        end = 0
+        for end, change in self._scan(0):
+            self.last_seq = change.seq
+
+        self.file = open(filename, "ab")
+        self.file.truncate(end)
+
+    def __repr__(self):
+        return "ChangeLog({0!r})".format(self.filename)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.file.close()
+
+    def append(self, changes):
+        """Appends ``(timestamp, path, token, value)`` tuples to the
+        log, assigning them consecutive sequence numbers.
+
+        :returns list: appended :class:`Change` records.
+        """
+        records = []
+        chunks = []
+        for timestamp, path, token, value in changes:
+            self.last_seq += 1
+            records.append(Change(self.last_seq, timestamp, path, token,
+                                  value))
+            chunks.append(self._struct.pack(
+                self.last_seq, timestamp, len(path), len(token),
+                -1 if value is None else len(value)))
+            chunks.extend([path, token, value or b""])
+
+        self.file.write(b"".join(chunks))
+        self.file.flush()
+        if self.sync:
+            os.fsync(self.file.fileno())
+        return records
+
+    def replay(self, since=0):
+        """Yields records with sequence numbers greater than `since`.
+
+        Records appended while iterating are yielded as well.
+        """
+        for _offset, change in self._scan(since):
+            yield change
+
+    def _scan(self, since):
+        try:
+            f = open(self.filename, "rb")
+        except IOError as e:
+            if e.errno == errno.ENOENT:
+                return
+
+            raise
+
+        with f:
+            while True:
+                header = f.read(self._struct.size)
+                if len(header) < self._struct.size:
+                    break
+
+                seq, timestamp, path_len, token_len, value_len = \
+                    self._struct.unpack(header)
+                size = path_len + token_len + max(value_len, 0)
+                if seq <= since:
+                    f.seek(size, os.SEEK_CUR)
+                    continue
+
+                data = f.read(size)
+                if len(data) < size:
+                    break
+
+                path = data[:path_len]
+                token = data[path_len:path_len + token_len]
+                value = (None if value_len < 0
+                         else data[path_len + token_len:])
+                yield f.tell(), Change(seq, timestamp, path, token, value)
+
+
+class ChangeFeed(object):
+    """Records events received by a monitor into a :class:`ChangeLog`
+    along with the value of the event path, re-read when the event
+    arrives.
+
+    >>> with Client() as c:
+    ...     m = c.monitor()
+    ...     m.watch(b"/local/domain", b"domains")
+    ...     with ChangeLog("/var/lib/agent/changes") as log:
+    ...         ChangeFeed(m, log).run()
+
+    A consumer which has processed changes up to some ``seq`` can
+    catch up after a restart with ``log.replay(seq)``.
+
+    Events queued at the same time are re-read in a single
+    :meth:`~pyxs.client.Client.pipeline`. If the monitor reports an
+    :data:`~pyxs.client.Monitor.OVERFLOW`, it is recorded as is, so
+    that consumers know to resynchronize.
+
+    :param pyxs.client.Monitor monitor: monitor to record events from.
+    :param ChangeLog log: log to record events to.
+    :param int batch_size: maximum number of events re-read at once.
+    """
+    def __init__(self, monitor, log, batch_size=256):
+        self.monitor = monitor
+        self.log = log
+        self.batch_size = batch_size
+
+    def __repr__(self):
+        return "ChangeFeed({0!r}, {1!r})".format(self.monitor, self.log)
+
+    def run(self, count=None):
+        """Records events until `count` events are recorded, or
+        forever.
+        """
+        recorded = 0
+        while count is None or recorded < count:
+            limit = self.batch_size
+            if count is not None:
+                limit = min(limit, count - recorded)
+
+            recorded += len(self.record(limit))
+
+    def record(self, limit=None):
+        """Waits for at least one event and records it, along with any
+        other queued events, up to `limit` events.
+
+        :returns list: recorded :class:`Change` records.
+        """
+        events = [self.monitor.next_event()]
+        while len(events) < (limit or self.batch_size):
+            event = self.monitor.next_event(block=False)
+            if event is None:
+                break
+
+            events.append(event)
+
+        timestamp = time.time()
+        values = dict.fromkeys(event.path for event in events)
+        paths = [path for path in values if not path.startswith(b"@")]
+        replies = self.monitor.client.pipeline(
+            (Op.READ, path + NUL) for path in paths)
+        for path, reply in zip(paths, replies):
+            try:
+                values[path] = reply.get()
+            except PyXSError:
+                pass  # Removed or not readable.
+
+        return self.log.append((timestamp, event.path, event.token,
+                                values[event.path])
+                               for event in events)
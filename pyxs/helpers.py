@@ -11,9 +11,11 @@
 
 from __future__ import absolute_import
 
-__all__ = ["check_path", "check_watch_path", "check_perms", "error"]
+__all__ = ["check_path", "check_watch_path", "check_pattern",
+           "check_perms", "error", "percentile"]
 
 import errno
+import math
 import re
 import os
 import posixpath
@@ -83,6 +85,27 @@ def check_watch_path(wpath):
     return wpath
 
 
+_re_magic = re.compile(br"[*?[\]!]")
+
+
+def check_pattern(pattern):
+    """Checks if a given glob pattern is valid -- it should be a valid
+    path once the :mod:`fnmatch` wildcards are replaced with ordinary
+    characters.
+
+    :param bytes pattern: pattern to check.
+    :raises pyxs.exceptions.InvalidPath: when pattern fails to validate.
+
+    .. versionadded:: 0.4.2
+    """
+    try:
+        check_path(_re_magic.sub(b"x", pattern))
+    except InvalidPath:
+        raise InvalidPath(pattern)
+
+    return pattern
+
+
 _re_perms = re.compile(br"^[wrbn]\d+$")
 
 
@@ -99,3 +122,14 @@ def check_perms(perms):
             raise InvalidPermission(perm)
 
     return perms
+
+
+def percentile(samples, fraction):
+    """Returns a percentile of sorted `samples` using the nearest-rank
+    method, or ``0.0`` if there are no samples.
+    """
+    if not samples:
+        return 0.0
+
+    rank = int(math.ceil(fraction * len(samples))) - 1
+    return samples[min(max(rank, 0), len(samples) - 1)]
@@ -0,0 +1,377 @@
+# -*- coding: utf-8 -*-
+"""
+    pyxs.loadgen
+    ~~~~~~~~~~~~
+
+    A load generator, which drives a mixed workload through pyxs
+    against ``xenstored`` and reports throughput, latency percentiles,
+    transaction conflicts and watch event lag::
+
+        $ python -m pyxs.loadgen --threads 32 --connections 4 \
+              --mix read=70,write=20,list=5,transaction=4,watch=1
+
+    The workload operates on a synthetic tree of ``--domains``
+    directories with ``--keys`` keys each, created under ``--root``
+    before the run and removed afterwards.
+
+    :copyright: (c) 2016 by pyxs authors and contributors, see AUTHORS
+                for more details.
+    :license: LGPL, see LICENSE for more details.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+__all__ = ["Stats", "Workload", "main"]
+
+import argparse
+import errno
+import json
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+
+from ._internal import NUL, Op
+from .client import Client
+from .exceptions import PyXSError
+from .helpers import error, percentile
+
+#: Operations supported by :class:`Workload`.
+OPERATIONS = ["read", "write", "list", "transaction", "watch"]
+
+
+def parse_mix(mix):
+    """Parses a ``name=weight,...`` workload mix.
+
+    >>> parse_mix("read=3,write=1")
+    {'read': 3.0, 'write': 1.0}
+    """
+    weights = {}
+    for item in mix.split(","):
+        name, _sep, weight = item.partition("=")
+        if name not in OPERATIONS or not weight:
+            raise ValueError("invalid mix item: {0!r}".format(item))
+
+        weights[name] = float(weight)
+
+    if not sum(weights.values()) > 0:
+        raise ValueError("mix is empty")
+    return weights
+
+
+class Stats(object):
+    """Thread-safe latency samples of a single reporting interval."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.started = time.time()
+        self.latency = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.conflicts = 0
+        self.lag = []
+
+    def add(self, name, elapsed):
+        with self.lock:
+            self.latency[name].append(elapsed)
+
+    def add_error(self, name):
+        with self.lock:
+            self.errors[name] += 1
+
+    def add_conflict(self):
+        with self.lock:
+            self.conflicts += 1
+
+    def add_lag(self, elapsed):
+        with self.lock:
+            self.lag.append(elapsed)
+
+    def snapshot(self):
+        """Returns a summary of the interval and starts a new one."""
+        with self.lock:
+            elapsed = time.time() - self.started
+            latency, errors = self.latency, self.errors
+            conflicts, lag = self.conflicts, self.lag
+            self.reset()
+
+        total = sum(len(samples) for samples in latency.values())
+        # ``latency`` is a ``defaultdict``, so indexing would add an
+        # empty entry.
+        transactions = len(latency.get("transaction", ()))
+        report = {
+            "elapsed": elapsed,
+            "throughput": total / elapsed if elapsed else 0.0,
+            "errors": sum(errors.values()),
+            "conflict_rate": (conflicts / (transactions + conflicts)
+                              if conflicts else 0.0),
+            "operations": {}
+        }
+        for name, samples in sorted(latency.items()):
+            if not samples:
+                continue
+
+            samples.sort()
+            report["operations"][name] = {
+                "count": len(samples),
+                "p50": percentile(samples, .5),
+                "p90": percentile(samples, .9),
+                "p99": percentile(samples, .99),
+                "max": samples[-1],
+            }
+
+        lag.sort()
+        report["lag"] = {"count": len(lag), "p50": percentile(lag, .5),
+                         "p99": percentile(lag, .99)}
+        return report
+
+
+class Workload(object):
+    """A mixed workload over a synthetic tree.
+
+    :param list clients: connected clients, the threads are spread
+                         over them evenly.
+    :param bytes root: root of the synthetic tree.
+    :param dict mix: a mapping of operation names to their weights.
+    :param int domains: number of directories in the tree.
+    :param int keys: number of keys in each directory.
+    :param int value_size: size of the written values.
+    """
+    def __init__(self, clients, root, mix, domains=16, keys=32,
+                 value_size=64):
+        self.clients = clients
+        self.root = root
+        self.names, weights = zip(*sorted(mix.items()))
+        total = sum(weights)
+        self.cumulative = []
+        acc = 0
+        for weight in weights:
+            acc += weight / total
+            self.cumulative.append(acc)
+
+        self.domains = domains
+        self.keys = keys
+        self.value = b"x" * value_size
+        self.stats = Stats()
+        self.stopped = threading.Event()
+
+        # Exceptions, which stopped the workers, see ``run``.
+        self.failures = []
+
+        # End of the run, which bounds the waits for watch events.
+        self.deadline = None
+
+    def path(self, domain, key=None):
+        path = self.root + "/d{0}".format(domain).encode()
+        if key is not None:
+            path += "/k{0}".format(key).encode()
+        return path
+
+    def populate(self):
+        """Creates the synthetic tree."""
+        self.clients[0].ack_many(
+            (Op.WRITE, self.path(domain, key) + NUL, self.value)
+            for domain in range(self.domains) for key in range(self.keys))
+
+    def cleanup(self):
+        self.clients[0].delete(self.root)
+
+    def choose(self, rng):
+        point = rng.random()
+        for name, bound in zip(self.names, self.cumulative):
+            if point < bound:
+                return name
+        return self.names[-1]
+
+    def worker(self, index):
+        try:
+            self.work(index)
+        except Exception as e:
+            # A dead worker would only show as a drop in throughput,
+            # so the whole run is stopped and fails instead.
+            self.failures.append(e)
+            self.stopped.set()
+
+    def work(self, index):
+        # Each thread has its own client, so that transactions don't
+        # interfere, sharing the router of one of the connections.
+        client = Client(router=self.clients[index % len(self.clients)].router)
+        rng = random.Random(index)
+        probe = self.root + "/probe/{0}".format(index).encode()
+        monitor = None
+        if "watch" in self.names:
+            monitor = client.monitor()
+            client.write(probe, b"")
+            monitor.watch(probe, probe)
+            monitor.next_event(timeout=self.timeout())  # The initial event.
+
+        try:
+            while not self.stopped.is_set():
+                name = self.choose(rng)
+                started = time.time()
+                try:
+                    getattr(self, "do_" + name)(client, rng, monitor, probe)
+                except PyXSError:
+                    self.stats.add_error(name)
+                else:
+                    self.stats.add(name, time.time() - started)
+        finally:
+            if monitor is not None:
+                monitor.close()
+
+    def random_key(self, rng):
+        return self.path(rng.randrange(self.domains),
+                         rng.randrange(self.keys))
+
+    def do_read(self, client, rng, monitor, probe):
+        client.read(self.random_key(rng))
+
+    def do_write(self, client, rng, monitor, probe):
+        client.write(self.random_key(rng), self.value)
+
+    def do_list(self, client, rng, monitor, probe):
+        client.list(self.path(rng.randrange(self.domains)))
+
+    def do_transaction(self, client, rng, monitor, probe):
+        path = self.random_key(rng)
+        while True:
+            client.transaction()
+            try:
+                client.write(path, client.read(path))
+            except PyXSError:
+                client.rollback()
+                raise
+
+            if client.commit():
+                break
+
+            self.stats.add_conflict()
+
+    def do_watch(self, client, rng, monitor, probe):
+        started = time.time()
+        client.write(probe, self.value)
+        if monitor.next_event(timeout=self.timeout()) is None:
+            if time.time() >= self.deadline:
+                return  # The run is over anyway.
+
+            raise error(errno.ETIMEDOUT)
+        self.stats.add_lag(time.time() - started)
+
+    def timeout(self):
+        """Returns the number of seconds to wait for a watch event:
+        at most 10, and no longer than the rest of the run.
+        """
+        return max(min(self.deadline - time.time(), 10), 0)
+
+    def run(self, n_threads, duration, interval, report):
+        """Runs `n_threads` workers for `duration` seconds, calling
+        `report` with a summary every `interval` seconds.
+
+        If a worker fails with anything but a
+        :exc:`~pyxs.exceptions.PyXSError`, which is counted as an
+        error, the run is stopped and the exception is re-raised.
+        """
+        self.deadline = deadline = time.time() + duration
+        threads = [threading.Thread(target=self.worker, args=(i, ))
+                   for i in range(n_threads)]
+        for t in threads:
+            t.daemon = True
+            t.start()
+
+        self.stats.reset()
+        try:
+            while time.time() < deadline and not self.stopped.is_set():
+                self.stopped.wait(max(min(interval, deadline - time.time()),
+                                      0))
+                report(self.stats.snapshot())
+        finally:
+            self.stopped.set()
+            for t in threads:
+                t.join()
+
+        if self.failures:
+            raise self.failures[0]
+
+
+def format_report(report):
+    chunks = ["{0:8.0f} ops/s".format(report["throughput"])]
+    for name, summary in sorted(report["operations"].items()):
+        chunks.append("{0} p50={1:.2f}ms p99={2:.2f}ms".format(
+            name, summary["p50"] * 1000, summary["p99"] * 1000))
+    if report["conflict_rate"]:
+        chunks.append("conflicts={0:.1%}".format(report["conflict_rate"]))
+    if report["lag"]["count"]:
+        chunks.append("lag p50={0:.2f}ms p99={1:.2f}ms".format(
+            report["lag"]["p50"] * 1000, report["lag"]["p99"] * 1000))
+    if report["errors"]:
+        chunks.append("errors={0}".format(report["errors"]))
+    return " | ".join(chunks)
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m pyxs.loadgen",
+        description="Drive a mixed workload against XenStore.")
+    parser.add_argument("--socket", metavar="PATH",
+                        help="path to XenStore Unix domain socket")
+    parser.add_argument("--root", default="/tool/pyxs-loadgen",
+                        help="root of the synthetic tree")
+    parser.add_argument("--threads", type=int, default=8,
+                        help="number of worker threads")
+    parser.add_argument("--connections", type=int, default=1,
+                        help="number of connections shared by the threads")
+    parser.add_argument("--mix", type=parse_mix,
+                        default="read=70,write=20,list=5,transaction=4,"
+                                "watch=1",
+                        help="operation weights, e.g. read=3,write=1")
+    parser.add_argument("--domains", type=int, default=16,
+                        help="number of directories in the tree")
+    parser.add_argument("--keys", type=int, default=32,
+                        help="number of keys in each directory")
+    parser.add_argument("--value-size", type=int, default=64,
+                        help="size of the written values")
+    parser.add_argument("--duration", type=float, default=10,
+                        help="duration of the run in seconds")
+    parser.add_argument("--interval", type=float, default=1,
+                        help="reporting interval in seconds")
+    parser.add_argument("--json", action="store_true",
+                        help="report one JSON object per interval")
+    return parser
+
+
+def main(argv=None, stdout=None):
+    args = make_parser().parse_args(argv)
+    stdout = stdout or sys.stdout
+
+    def report(summary):
+        if args.json:
+            print(json.dumps(summary, sort_keys=True), file=stdout)
+        else:
+            print(format_report(summary), file=stdout)
+        stdout.flush()
+
+    clients = [Client(unix_socket_path=args.socket)
+               for _ in range(args.connections)]
+    try:
+        for client in clients:
+            client.connect()
+
+        workload = Workload(clients, args.root.encode(), args.mix,
+                            args.domains, args.keys, args.value_size)
+        workload.populate()
+        try:
+            workload.run(args.threads, args.duration, args.interval, report)
+        finally:
+            workload.cleanup()
+    except PyXSError as e:
+        raise SystemExit("error: {0}".format(e))
+    finally:
+        for client in clients:
+            client.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+    pyxs.probe
+    ~~~~~~~~~~
+
+    This module implements a probe, which measures how long it takes
+    for a watch event to reach a :class:`~pyxs.client.Monitor`
+    consumer.
+
+    :copyright: (c) 2016 by pyxs authors and contributors, see AUTHORS
+                for more details.
+    :license: LGPL, see LICENSE for more details.
+"""
+
+from __future__ import absolute_import
+
+__all__ = ["ProbeSample", "WatchProbe"]
+
+import copy
+import errno
+import os
+import threading
+import time
+from collections import deque, namedtuple
+
+from .client import Monitor
+from .exceptions import PyXSError
+from .helpers import check_path, percentile
+
+#: A single measurement in seconds. ``total`` is the sum of:
+#:
+#: * ``xenstored`` -- from the write to the router receiving the event,
+#:   which includes the time spent on the wire;
+#: * ``dispatch`` -- from the router receiving the event to queueing
+#:   it for the monitor;
+#: * ``queue`` -- time the event spent in the monitor queue.
+ProbeSample = namedtuple("ProbeSample",
+                         "timestamp total xenstored dispatch queue")
+
+
+class _ProbeMonitor(Monitor):
+    def __init__(self, client):
+        super(_ProbeMonitor, self).__init__(client)
+
+        # Every write to the probe path causes exactly one event, so
+        # the n-th event delivered is for the n-th write.
+        self.count = 0
+        self.delivered = {}
+
+    def deliver(self, event):
+        router = self.client.router
+        now = time.time()
+        # ``CooperativeRouter`` dispatches as it receives.
+        self.delivered[self.count + 1] = (
+            getattr(router, "received", None) or now, now)
+        self.count += 1
+        super(_ProbeMonitor, self).deliver(event)
+
+
+class WatchProbe(object):
+    """Periodically writes the current time to a scratch `path`, which
+    it watches, and records how long the event takes to arrive::
+
+        with WatchProbe(c) as probe:
+            ...
+            print(probe.summary()["total"]["p99"])
+
+    The probe shares the router with `client`, so its measurements
+    include the time the event waits behind the replies and events
+    for the rest of the application.
+
+    .. versionadded:: 0.4.2
+
+    :param pyxs.client.Client client: client to use.
+    :param bytes path: path to write to, removed on close. Defaults
+                       to ``/tool/pyxs/probe/<pid>``.
+    :param float interval: seconds between the measurements.
+    :param int samples: number of the most recent samples kept.
+    :param float timeout: seconds to wait for an event before counting
+                          it as lost.
+    """
+    def __init__(self, client, path=None, interval=1.0, samples=1024,
+                 timeout=5.0):
+        if path is None:
+            path = "/tool/pyxs/probe/{0}".format(os.getpid()).encode()
+        check_path(path)
+
+        self.client = copy.copy(client)
+        self.path = path
+        self.interval = interval
+        self.timeout = timeout
+
+        #: Recent :data:`ProbeSample` tuples, oldest first.
+        self.samples = deque(maxlen=samples)
+
+        #: Number of events, which didn't arrive in time.
+        self.lost = 0
+
+        self.monitor = None
+        self.lock = threading.Lock()
+
+        # Number of the events expected and consumed so far, the first
+        # one being the initial event.
+        self.expected = self.consumed = 0
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def __repr__(self):
+        return "WatchProbe({0!r}, {1!r})".format(self.client, self.path)
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def open(self, start=True):
+        """Starts watching `path`.
+
+        :param bool start: if ``True`` a thread calling :meth:`probe`
+                           every `interval` seconds is started.
+        """
+        self.client.write(self.path, b"")
+        self.monitor = _ProbeMonitor(copy.copy(self.client))
+        self.expected, self.consumed = 1, 0
+        self.monitor.watch(self.path, b"probe")
+        if self._wait(1, time.time() + self.timeout) is None:
+            self.lost += 1  # The initial event.
+
+        if start:
+            self.stopped.clear()
+            self.thread = threading.Thread(target=self.run)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def close(self):
+        if self.thread is not None:
+            self.stopped.set()
+            self.thread.join()
+            self.thread = None
+
+        if self.monitor is not None:
+            self.monitor.close()
+            self.monitor = None
+
+        try:
+            self.client.delete(self.path)
+        except PyXSError as e:
+            if e.args[0] != errno.ENOENT:
+                raise
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                self.probe()
+            except PyXSError:
+                self.lost += 1
+
+            self.stopped.wait(self.interval)
+
+    def probe(self):
+        """Makes a single measurement.
+
+        :returns ProbeSample: or ``None`` if the event didn't arrive
+                              in time.
+        """
+        with self.lock:
+            self.expected += 1
+            started = time.time()
+            self.client.write(self.path, "{0:.6f}".format(started).encode())
+            times = self._wait(self.expected, started + self.timeout)
+            if times is None:
+                self.lost += 1
+                return None
+
+            consumed = time.time()
+            received, delivered = times
+
+        sample = ProbeSample(started, consumed - started,
+                             received - started, delivered - received,
+                             consumed - delivered)
+        self.samples.append(sample)
+        return sample
+
+    def _wait(self, n, deadline):
+        """Consumes the events up to the `n`-th one, skipping those
+        which arrived too late for the earlier measurements.
+
+        :returns tuple: the times the `n`-th event was received and
+                        delivered, or ``None`` if it didn't arrive by
+                        the `deadline`.
+        """
+        times = None
+        while self.consumed < n:
+            remaining = deadline - time.time()
+            if (remaining <= 0 or
+                    self.monitor.next_event(timeout=remaining) is None):
+                return None
+
+            self.consumed += 1
+            times = self.monitor.delivered.pop(self.consumed, None)
+        return times
+
+    def summary(self):
+        """Returns the distribution of the recent samples: a mapping of
+        ``"total"``, ``"xenstored"``, ``"dispatch"`` and ``"queue"``
+        to the ``"p50"``, ``"p90"``, ``"p99"`` and ``"max"`` values,
+        along with ``"count"`` of samples and ``"lost"`` events.
+        """
+        samples = list(self.samples)
+        summary = {"count": len(samples), "lost": self.lost}
+        for field in ProbeSample._fields[1:]:
+            values = sorted(getattr(sample, field) for sample in samples)
+            summary[field] = {
+                "p50": percentile(values, .5),
+                "p90": percentile(values, .9),
+                "p99": percentile(values, .99),
+                "max": values[-1] if values else 0.0,
+            }
+        return summary
@@ -0,0 +1,342 @@
+# -*- coding: utf-8 -*-
+"""
+    pyxs.recording
+    ~~~~~~~~~~~~~~
+
+    This module implements recording of XenStore traffic and its
+    replay against another ``xenstored``, e.g. a local one::
+
+        router = Router(RecordingConnection(UnixSocketConnection(),
+                                            "session.xsrec"))
+        with Client(router=router) as c:
+            run_agent(c)
+
+    and later::
+
+        $ python -m pyxs.recording session.xsrec --speed 10 \
+              --socket /tmp/xenstored/socket
+
+    :copyright: (c) 2016 by pyxs authors and contributors, see AUTHORS
+                for more details.
+    :license: LGPL, see LICENSE for more details.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+__all__ = ["Record", "RecordingConnection", "Replayer", "read_recording"]
+
+import argparse
+import select
+import struct
+import sys
+import threading
+import time
+from collections import defaultdict, namedtuple
+
+from ._internal import NUL, Op, Packet, next_rq_id
+from .client import Latency
+from .connection import PacketConnection, UnixSocketConnection
+from .exceptions import PyXSError
+
+#: Directions of recorded packets.
+SENT, RECEIVED = 0, 1
+
+#: A recorded packet.
+Record = namedtuple("Record", "timestamp direction packet")
+
+_magic = b"pyxsrec1"
+
+#: Timestamp and direction followed by the packet header.
+_struct = struct.Struct(b"<dBIIII")
+
+
+class RecordingConnection(PacketConnection):
+    """A connection, which records every packet sent and received
+    through another `connection` to a file.
+
+    Each packet is stored as a timestamp, a direction byte and the
+    packet header followed by the payload, see :func:`read_recording`.
+
+    .. note:: Only :class:`~pyxs.client.Router` talks to XenStore
+              through :meth:`send` and :meth:`recv`, so
+              :class:`~pyxs.cooperative.CooperativeRouter` traffic is
+              not recorded.
+
+    .. versionadded:: 0.4.2
+
+    :param pyxs.connection.PacketConnection connection: connection to
+                                                        record.
+    :param str filename: path to the recording, overwritten if exists.
+    """
+    def __init__(self, connection, filename):
+        self.connection = connection
+        self.filename = filename
+        self.file = None
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return "RecordingConnection({0!r}, {1!r})".format(self.connection,
+                                                          self.filename)
+
+    @property
+    def path(self):
+        return self.connection.path
+
+    @property
+    def is_connected(self):
+        return self.connection.is_connected
+
+    def fileno(self):
+        return self.connection.fileno()
+
+    def connect(self):
+        if self.is_connected:
+            return
+
+        self.connection.connect()
+        with self.lock:
+            if self.file is None:
+                self.file = open(self.filename, "wb")
+                self.file.write(_magic)
+
+    def close(self, silent=True):
+        try:
+            self.connection.close(silent)
+        finally:
+            with self.lock:
+                if self.file is not None:
+                    self.file.close()
+                    self.file = None
+
+    def release(self):
+        self.connection.release()
+        with self.lock:
+            if self.file is not None:
+                # The file belongs to the parent process.
+                self.file = None
+
+    def send(self, packet):
+        # The reply may be received before ``send`` returns.
+        self.record(SENT, packet)
+        self.connection.send(packet)
+
+    def recv(self):
+        packet = self.connection.recv()
+        self.record(RECEIVED, packet)
+        return packet
+
+    def record(self, direction, packet):
+        with self.lock:
+            if self.file is None:
+                return
+
+            self.file.write(_struct.pack(time.time(), direction, packet.op,
+                                         packet.rq_id, packet.tx_id,
+                                         packet.size))
+            self.file.write(packet.payload)
+
+
+def read_recording(filename):
+    """Yields :data:`Record` tuples from a recording made by
+    :class:`RecordingConnection`. A partially written record at the
+    end of the file is ignored.
+
+    .. versionadded:: 0.4.2
+    """
+    with open(filename, "rb") as f:
+        if f.read(len(_magic)) != _magic:
+            raise ValueError("not a pyxs recording: {0!r}".format(filename))
+
+        while True:
+            header = f.read(_struct.size)
+            if len(header) < _struct.size:
+                break
+
+            timestamp, direction, op, rq_id, tx_id, size = \
+                _struct.unpack(header)
+            payload = f.read(size)
+            if len(payload) < size:
+                break
+
+            yield Record(timestamp, direction,
+                         Packet(op, payload, rq_id, tx_id))
+
+
+class Replayer(object):
+    """Re-issues requests from a recording over a given `connection`,
+    preserving the time between them.
+
+    Requests are sent without waiting for the replies to the previous
+    ones, just like they were in the recorded session. Transaction ids
+    of the recorded session are mapped to the ones allocated by the
+    ``xenstored`` the recording is replayed against, so a request in
+    a transaction waits for the transaction to start. Requests in
+    transactions started before the recording are skipped.
+
+    .. versionadded:: 0.4.2
+
+    :param pyxs.connection.PacketConnection connection: connection to
+                                                        replay over.
+    :param list records: :data:`Record` tuples to replay.
+    :param float speed: how many times faster than the original to
+                        replay, ``0`` sends the requests as fast as
+                        possible.
+    """
+    def __init__(self, connection, records, speed=1.0):
+        self.connection = connection
+        self.records = list(records)
+        self.speed = speed
+        self.condition = threading.Condition()
+        self.done = False
+
+        #: A mapping of request ids to ``(op, recorded tx_id, started)``.
+        self.pending = {}
+        self.tx_ids = {}
+
+        #: Reply latency statistics by operation.
+        self.latency = defaultdict(Latency)
+
+        #: Number of replies with errors, skipped requests and received
+        #: watch events.
+        self.errors = self.skipped = self.events = 0
+
+    def __repr__(self):
+        return "Replayer({0!r})".format(self.connection)
+
+    def run(self, timeout=10):
+        """Replays the recording and waits up to `timeout` seconds
+        for the outstanding replies.
+        """
+        # Request ids of the transactions started in the session.
+        started = set(record.packet.rq_id for record in self.records
+                      if record.direction == SENT and
+                      record.packet.op == Op.TRANSACTION_START)
+        recorded_tx_ids = {}
+        for _timestamp, direction, packet in self.records:
+            if (direction == RECEIVED and
+                    packet.op == Op.TRANSACTION_START and
+                    packet.rq_id in started):
+                recorded_tx_ids[packet.rq_id] = int(packet.payload.rstrip(NUL))
+
+        self.connection.connect()
+        self.done = False
+        receiver = threading.Thread(target=self.receive)
+        receiver.daemon = True
+        receiver.start()
+        try:
+            self.send_all(recorded_tx_ids)
+
+            deadline = time.time() + timeout
+            with self.condition:
+                while self.pending and time.time() < deadline:
+                    self.condition.wait(deadline - time.time())
+        finally:
+            self.done = True
+            receiver.join()
+            self.connection.close()
+
+    def send_all(self, recorded_tx_ids):
+        sent = [record for record in self.records if record.direction == SENT]
+        if not sent:
+            return
+
+        origin, started = sent[0].timestamp, time.time()
+        for timestamp, _direction, packet in sent:
+            if self.speed:
+                delay = (started + (timestamp - origin) / self.speed -
+                         time.time())
+                if delay > 0:
+                    time.sleep(delay)
+
+            tx_id = 0
+            if packet.tx_id:
+                tx_id = self.wait_tx_id(packet.tx_id)
+                if tx_id is None:
+                    self.skipped += 1
+                    continue
+
+            rq_id = next_rq_id()
+            with self.condition:
+                self.pending[rq_id] = (packet.op,
+                                       recorded_tx_ids.get(packet.rq_id),
+                                       time.time())
+            self.connection.send(Packet(packet.op, packet.payload,
+                                        rq_id, tx_id))
+
+    def wait_tx_id(self, recorded, timeout=10):
+        deadline = time.time() + timeout
+        with self.condition:
+            while recorded not in self.tx_ids:
+                # The transaction is unknown unless it's being started.
+                if (recorded not in (tx_id for _op, tx_id, _started
+                                     in self.pending.values()) or
+                        time.time() >= deadline):
+                    return None
+
+                self.condition.wait(deadline - time.time())
+            return self.tx_ids[recorded]
+
+    def receive(self):
+        while not self.done:
+            rlist, _wlist, _xlist = select.select([self.connection], [], [],
+                                                  0.1)
+            if not rlist:
+                continue
+
+            try:
+                packet = self.connection.recv()
+            except PyXSError:
+                return  # Disconnected by ``xenstored``.
+
+            if packet.op == Op.WATCH_EVENT:
+                self.events += 1
+                continue
+
+            with self.condition:
+                op, recorded, started = self.pending.pop(
+                    packet.rq_id, (None, None, None))
+                if op is None:
+                    continue
+
+                self.latency[Op._fields[Op.index(op)]].add(
+                    time.time() - started)
+                if packet.op == Op.ERROR:
+                    self.errors += 1
+                elif op == Op.TRANSACTION_START and recorded is not None:
+                    self.tx_ids[recorded] = int(packet.payload.rstrip(NUL))
+                self.condition.notify_all()
+
+
+def main(argv=None, stdout=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m pyxs.recording",
+        description="Replay a recorded XenStore session.")
+    parser.add_argument("filename", help="recording to replay")
+    parser.add_argument("--socket", metavar="PATH",
+                        help="path to XenStore Unix domain socket")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="speedup factor, 0 replays as fast as "
+                             "possible")
+    args = parser.parse_args(argv)
+    stdout = stdout or sys.stdout
+
+    replayer = Replayer(UnixSocketConnection(args.socket),
+                        read_recording(args.filename), args.speed)
+    started = time.time()
+    try:
+        replayer.run()
+    except PyXSError as e:
+        raise SystemExit("error: {0}".format(e))
+
+    print("replayed in {0:.3f}s: {1} errors, {2} skipped, {3} events"
+          .format(time.time() - started, replayer.errors, replayer.skipped,
+                  replayer.events), file=stdout)
+    for name, latency in sorted(replayer.latency.items()):
+        print("{0:<24}{1:>8} mean={2:.3f}ms max={3:.3f}ms".format(
+            name, latency.count, latency.mean * 1000, latency.max * 1000),
+            file=stdout)
+    return 1 if replayer.pending else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
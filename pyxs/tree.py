@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+    pyxs.tree
+    ~~~~~~~~~
+
+    This module implements a lazily loaded view of a XenStore subtree,
+    see :meth:`pyxs.client.Client.tree`.
+
+    :copyright: (c) 2016 by pyxs authors and contributors, see AUTHORS
+                for more details.
+    :license: LGPL, see LICENSE for more details.
+"""
+
+from __future__ import absolute_import
+
+__all__ = ["Node"]
+
+import posixpath
+
+
+class Node(object):
+    """A XenStore node, which reads its value and lists its children on
+    first access and caches them::
+
+        >>> vif = c.tree(b"/local/domain/1")[b"device"][b"vif"]
+        >>> vif.prefetch()
+        >>> [vif[devid][b"mac"].value for devid in vif]
+        [b'00:16:3e:00:00:01']
+
+    The view is never updated, use :meth:`refresh` to forget the cached
+    state.
+
+    .. versionadded:: 0.4.2
+
+    :param pyxs.client.Client client: client to load the node with.
+    :param bytes path: path of the node.
+    """
+    __slots__ = ["client", "path", "_value", "_children", "_nodes"]
+
+    def __init__(self, client, path):
+        self.client = client
+        self.path = path
+        self._value = self._children = None
+        self._nodes = {}
+
+    def __repr__(self):
+        return "Node({0!r})".format(self.path)
+
+    @property
+    def name(self):
+        return posixpath.basename(self.path)
+
+    @property
+    def value(self):
+        """The value of the node, read on first access."""
+        if self._value is None:
+            self._value = self.client.read(self.path)
+        return self._value
+
+    @property
+    def children(self):
+        """A list of names of the children, listed on first access."""
+        if self._children is None:
+            self._children = self.client.list(self.path)
+        return self._children
+
+    def __getitem__(self, name):
+        node = self._nodes.get(name)
+        if node is None:
+            if name not in self.children:
+                raise KeyError(name)
+
+            node = self._nodes[name] = self.__class__(
+                self.client, posixpath.join(self.path, name))
+        return node
+
+    def __contains__(self, name):
+        return name in self.children
+
+    def __iter__(self):
+        return iter(self.children)
+
+    def __len__(self):
+        return len(self.children)
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return list(self.children)
+
+    def items(self):
+        return [(name, self[name]) for name in self.children]
+
+    def prefetch(self, depth=1):
+        """Loads the node and `depth` levels of its descendants with a
+        single :meth:`~pyxs.client.Client.fetch` per level.
+
+        The nodes, which were removed in the meantime, are left to be
+        loaded on access.
+        """
+        level = [self]
+        for remaining in range(depth, -1, -1):
+            paths = [node.path for node in level
+                     if node._value is None or node._children is None]
+            fetched = {}
+            if paths:
+                fetched = dict((path, (value, children))
+                               for path, value, children
+                               in self.client.fetch(paths))
+            for node in level:
+                if node.path in fetched:
+                    node._value, node._children = fetched[node.path]
+
+            if not remaining:
+                break
+
+            level = [node[name] for node in level
+                     if node._children is not None
+                     for name in node._children]
+
+    def refresh(self):
+        """Forgets the cached value and children."""
+        self._value = self._children = None
+        self._nodes.clear()
@@ -10,3 +10,24 @@ from pyxs import Client
 _virtualized = not os.path.exists('/dev/xen') or not Client.SU
 
 virtualized = pytest.mark.skipif(_virtualized, reason="not virtualized")
+
+
+class FakeReply(object):
+    def __init__(self, payload):
+        self.payload = payload
+
+    def get(self):
+        if isinstance(self.payload, Exception):
+            raise self.payload
+        return self.payload
+
+
+class FakeClient(object):
+    """Replies to pipelined commands with :meth:`reply`, which returns
+    a payload or an exception to raise from ``get``.
+    """
+    def pipeline(self, commands):
+        return [FakeReply(self.reply(*command)) for command in commands]
+
+    def reply(self, op, *args):
+        raise NotImplementedError
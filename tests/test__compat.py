@@ -2,6 +2,8 @@
 
 from __future__ import absolute_import
 
+from threading import Thread
+
 import pytest
 
 from pyxs._compat import xs, Error
@@ -80,3 +82,52 @@ def test_watch_unwatch(handle):
     handle.watch(b"/foo/bar", token)
     assert handle.read_watch() == (b"/foo/bar", token)
     handle.unwatch(b"/foo/bar", token)
+
+
+@virtualized
+def test_transaction_end_conflict(handle):
+    tx_id = handle.transaction_start()
+    handle.write(tx_id, b"/foo/bar", b"boo")
+    handle.write(0, b"/foo/bar", b"unexpected write")
+    assert not handle.transaction_end(tx_id)
+
+
+@virtualized
+def test_concurrent_transactions(handle):
+    tx_id1 = handle.transaction_start()
+    tx_id2 = handle.transaction_start()
+    assert tx_id1 != tx_id2
+
+    handle.write(tx_id1, b"/foo/bar", b"boo")
+    handle.write(tx_id2, b"/foo/baz", b"boo")
+    assert handle.ls(tx_id1, b"/foo") == [b"bar"]
+    assert handle.ls(tx_id2, b"/foo") == [b"baz"]
+    handle.transaction_end(tx_id1, abort=1)
+    handle.transaction_end(tx_id2, abort=1)
+
+
+@virtualized
+def test_threads(handle):
+    errors = []
+
+    def worker(i):
+        path = b"/foo/" + str(i).encode()
+        try:
+            for j in range(32):
+                committed = False
+                while not committed:
+                    tx_id = handle.transaction_start()
+                    handle.write(tx_id, path, str(j).encode())
+                    committed = handle.transaction_end(tx_id)
+
+                assert handle.read(0, path) == str(j).encode()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [Thread(target=worker, args=(i, )) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert not errors
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import io
+import json
+
+from pyxs import Client
+from pyxs.__main__ import escape, main
+from pyxs.exceptions import PyXSError
+
+from . import virtualized
+
+
+def setup_function(f):
+    try:
+        with Client() as c:
+            c.delete(b"/foo")
+    except PyXSError:
+        pass
+
+
+def test_escape():
+    assert escape(b"foo") == b"foo"
+    assert escape(b"foo\\bar") == b"foo\\\\bar"
+    assert escape(b"foo\nbar\x00") == b"foo\\012bar\\000"
+
+
+def run(*argv):
+    stdout = io.BytesIO()
+    status = main(list(argv), stdout=stdout)
+    return status, stdout.getvalue()
+
+
+@virtualized
+def test_write_read():
+    assert run("write", "/foo/bar", "baz", "/foo/boo", "") == (0, b"")
+    assert run("read", "/foo/bar", "/foo/boo") == (0, b"baz\n\n")
+
+    # a) missing paths are reported, but don't stop the command.
+    status, output = run("-f", "nul", "read", "/foo/bar", "/foo/missing")
+    assert status == 1
+    assert output == b"/foo/bar\x00baz\x00"
+
+
+@virtualized
+def test_stat():
+    run("write", "/foo/bar", "baz")
+    status, output = run("-f", "json", "stat", "/foo/bar", "/foo/missing")
+    assert status == 1
+    assert json.loads(output) == {"path": "/foo/bar", "perms": ["n0"],
+                                  "children": 0, "size": 3}
+
+
+@virtualized
+def test_ls_dump():
+    run("write", "/foo/bar", "baz", "/foo/boo/1", "2")
+    assert run("ls", "/foo") == (0, b"/foo/bar\n/foo/boo\n")
+
+    status, output = run("-f", "json", "dump", "/foo")
+    assert status == 0
+    assert [json.loads(line) for line in output.splitlines()] == [
+        {"path": "/foo", "value": ""},
+        {"path": "/foo/bar", "value": "baz"},
+        {"path": "/foo/boo", "value": ""},
+        {"path": "/foo/boo/1", "value": "2"}
+    ]
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import errno
+import time
+from threading import Thread
+
+import pytest
+
+from pyxs._internal import Op
+from pyxs.buffer import WriteBuffer
+from pyxs.client import Client
+from pyxs.exceptions import PyXSError
+
+from . import FakeClient as BaseFakeClient, virtualized
+
+
+def setup_function(f):
+    try:
+        with Client() as c:
+            c.delete(b"/foo")
+    except PyXSError:
+        pass
+
+
+class FakeClient(BaseFakeClient):
+    def __init__(self, conflicts=0):
+        self.tx_id = 0
+        self.conflicts = conflicts
+        self.sent = []
+
+    def transaction(self):
+        self.tx_id = 1
+
+    def pipeline(self, commands):
+        commands = list(commands)
+        self.sent.append(commands)
+        return super(FakeClient, self).pipeline(commands)
+
+    def reply(self, op, path, *args):
+        if path == b"/denied\x00":
+            return PyXSError(errno.EACCES, "")
+        return b"OK"
+
+    def commit(self):
+        self.tx_id = 0
+        if self.conflicts:
+            self.conflicts -= 1
+            return False
+        return True
+
+
+def test_write_buffer():
+    buf = WriteBuffer(FakeClient(conflicts=2))
+    first = buf.write(b"/foo/bar", b"1")
+    buf.delete(b"/foo")
+    last = buf.write(b"/foo/bar", b"2")
+    denied = buf.write(b"/denied", b"")
+    assert len(buf) == 3 and not first.done()
+
+    buf.flush()
+    assert not len(buf)
+    assert buf.commits == 1 and buf.conflicts == 2
+
+    # a) superseded writes are dropped, the order of the last updates
+    #    is preserved, and the conflicting transaction is retried.
+    sent = buf.client.sent
+    assert len(sent) == 3
+    assert sent[-1] == [(Op.RM, b"/foo\x00"),
+                        (Op.WRITE, b"/foo/bar\x00", b"2"),
+                        (Op.WRITE, b"/denied\x00", b"")]
+
+    # b) superseded writes are resolved along with the last one.
+    first.get(timeout=0)
+    last.get(timeout=0)
+
+    # c) errors are reported to the writer only.
+    with pytest.raises(PyXSError) as exc:
+        denied.get(timeout=0)
+    assert exc.value.args[0] == errno.EACCES
+
+
+def test_write_buffer_size():
+    with WriteBuffer(FakeClient(), delay=60, max_size=2) as buf:
+        pending = buf.write(b"/foo/bar", b"1")
+        with pytest.raises(PyXSError) as exc:
+            pending.get(timeout=.1)
+        assert exc.value.args[0] == errno.ETIMEDOUT
+
+        buf.write(b"/foo/baz", b"2").get(timeout=5)
+        pending.get(timeout=0)
+
+    # a) no writes are accepted after close.
+    with pytest.raises(PyXSError):
+        buf.write(b"/foo/bar", b"1")
+
+
+def test_write_buffer_flush():
+    with WriteBuffer(FakeClient(), delay=.05) as buf:
+        # a) the buffer is flushed while the thread waits for the delay.
+        pending = buf.write(b"/foo/bar", b"0")
+        time.sleep(.01)
+        buf.flush()
+        pending.get(timeout=0)
+        time.sleep(.1)
+
+        # b) the thread keeps flushing after that.
+        buf.write(b"/foo/bar", b"1").get(timeout=5)
+        assert buf.thread.is_alive()
+
+
+@virtualized
+def test_write_buffer_threads():
+    with Client() as c:
+        with WriteBuffer(c, delay=.05) as buf:
+            def writer(i):
+                for j in range(10):
+                    buf.write("/foo/{0}".format(i).encode(),
+                              str(j).encode()).get()
+
+            threads = [Thread(target=writer, args=(i, )) for i in range(8)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+        assert sorted(c.list(b"/foo")) == [str(i).encode() for i in range(8)]
+        assert all(c.read("/foo/{0}".format(i).encode()) == b"9"
+                   for i in range(8))
+        assert buf.commits < 80
@@ -2,14 +2,19 @@
 
 from __future__ import absolute_import
 
+import copy
 import errno
+import os
+import select
 import sys
+import time
 from itertools import islice
 from threading import Timer, Thread, current_thread
 
 import pytest
 
-from pyxs.client import RVar, Router, Client
+from pyxs.client import RVar, Router, Scheduler, Client, Monitor, \
+    _Ticket
 from pyxs.connection import UnixSocketConnection, XenBusConnection
 from pyxs.exceptions import InvalidPath, InvalidPermission, \
     UnexpectedPacket, PyXSError
@@ -76,7 +81,7 @@ def test_execute_command_error():
 
 def monkeypatch_router(client, response_packet):
     class FakeRouter:
-        def send(self, packet):
+        def send(self, packet, priority=None):
             rvar = RVar()
             rvar.set(response_packet)
             return rvar
@@ -200,6 +205,58 @@ def test_list(client):
     # c) No list perms (should be ran in DomU)?
 
 
+@virtualized
+def test_list_large(client):
+    # The listing doesn't fit into a single 4096 bytes reply.
+    names = [str(i).encode().rjust(32, b"x") for i in range(256)]
+    client.ack_many((Op.MKDIR, b"/foo/" + name + NUL) for name in names)
+
+    assert sorted(client.list(b"/foo")) == sorted(names)
+    assert sorted(client.iter_list(b"/foo")) == sorted(names)
+    assert len(list(client.walk(b"/foo"))) == len(names) + 1
+
+
+def monkeypatch_router_script(client, payloads):
+    class FakeRouter:
+        unsupported = set()
+
+        def send(self, packet, priority=None):
+            op, payload = payloads.pop(0)
+            rvar = RVar()
+            rvar.set(Packet(op, payload, rq_id=packet.rq_id))
+            return rvar
+
+    client.router = FakeRouter()
+
+
+def test_iter_list():
+    c = Client()
+
+    # a) the directory changes after the first chunk, so listing
+    #    restarts and already yielded names are skipped.
+    monkeypatch_router_script(c, [
+        (Op.DIRECTORY_PART, b"1\x00foo\x00bar\x00"),
+        (Op.DIRECTORY_PART, b"2\x00boo\x00"),
+        (Op.DIRECTORY_PART, b"2\x00foo\x00baz\x00"),
+        (Op.DIRECTORY_PART, b"2\x00boo\x00\x00"),
+    ])
+    assert list(c.iter_list(b"/foo")) == [b"foo", b"bar", b"baz", b"boo"]
+
+    # b) an empty directory.
+    monkeypatch_router_script(c, [(Op.DIRECTORY_PART, b"1\x00\x00")])
+    assert list(c.iter_list(b"/foo")) == []
+
+    # c) ``DIRECTORY_PART`` is not supported.
+    monkeypatch_router_script(c, [
+        (Op.ERROR, b"EINVAL\x00"),
+        (Op.DIRECTORY, b"foo\x00bar\x00"),
+        (Op.DIRECTORY, b"baz\x00"),
+    ])
+    assert list(c.iter_list(b"/foo")) == [b"foo", b"bar"]
+    assert Op.DIRECTORY_PART in c.router.unsupported
+    assert list(c.iter_list(b"/foo")) == [b"baz"]
+
+
 @virtualized
 def test_exists(client):
     # a) Path exists.
@@ -212,6 +269,58 @@ def test_exists(client):
 
     # c) No list perms (should be ran in DomU)?
 
+    # d) multiple paths at once.
+    client.write(b"/foo/baz", b"")
+    assert client.exists_many([b"/foo/bar", b"/foo/baz", b"/foo"]) == [
+        False, True, True]
+
+
+@virtualized
+def test_stat(client):
+    client.write(b"/foo/bar", b"baz")
+    client.write(b"/foo/boo", b"")
+    assert client.stat(b"/foo/bar") == ([b"n0"], 0, 3)
+    assert client.stat_many([b"/foo", b"/foo/missing"]) == [
+        ([b"n0"], 2, 0), None]
+
+    assert client.child_count(b"/foo") == 2
+    assert client.child_count(b"/foo/bar") == 0
+    assert not client.is_leaf(b"/foo")
+    assert client.is_leaf(b"/foo/bar")
+
+    # a) multiple paths at once.
+    paths = [b"/foo", b"/foo/bar", b"/foo/missing"]
+    assert client.child_count_many(paths) == [2, 0, None]
+    assert client.is_leaf_many(paths) == [False, True, None]
+
+    for method in [client.stat, client.child_count, client.is_leaf]:
+        with pytest.raises(PyXSError) as exc:
+            method(b"/foo/missing")
+        assert exc.value.args[0] == errno.ENOENT
+
+
+@virtualized
+def test_negative_cache():
+    with Client() as c:
+        cached = c.with_negative_cache(ttl=60)
+        assert not cached.exists(b"/foo/bar")
+        assert not cached.exists(b"/foo/bar")
+        assert cached.negative_cache.hits == 1
+
+        # a) writes by other clients are not noticed ...
+        c.write(b"/foo/bar/baz", b"")
+        assert not cached.exists(b"/foo/bar")
+
+        # b) ... unlike writes through the copies.
+        copy.copy(cached).write(b"/foo/bar/baz", b"")
+        assert cached.exists(b"/foo/bar")
+
+        # c) the cache is bypassed in transactions.
+        cached.negative_cache.add(b"/foo/bar")
+        cached.transaction()
+        assert cached.exists(b"/foo/bar")
+        cached.rollback()
+
 
 @virtualized
 def test_perms(client):
@@ -242,6 +351,403 @@ def test_set_perms_invalid():
         Client().set_perms(b"/foo/bar", [b"z"])
 
 
+@virtualized
+def test_pipeline(client):
+    client.mkdir(b"/foo")
+    commands = [(Op.WRITE, b"/foo/" + str(i).encode() + NUL, b"x")
+                for i in range(100)]
+    commands.append((Op.READ, b"/foo/missing" + NUL))
+    replies = list(client.pipeline(commands, window=8))
+    assert len(replies) == len(commands)
+    assert all(reply.get() == b"OK" for reply in replies[:-1])
+
+    with pytest.raises(PyXSError):
+        replies[-1].get()
+
+    assert len(client.list(b"/foo")) == 100
+
+
+def test_pipeline_window():
+    class FakeRVar(RVar):
+        def get(self):
+            answered.add(self)
+            return super(FakeRVar, self).get()
+
+    def send(packet, priority=None):
+        rvar = FakeRVar()
+        rvar.set(Packet(Op.WRITE, b"OK\x00", rq_id=packet.rq_id))
+        sent.append(rvar)
+        in_flight.append(len(sent) - len(answered))
+        return rvar
+
+    c = Client()
+    c.router.send = send
+    sent, answered, in_flight = [], set(), []
+
+    # a) the replies aren't waited for by the caller, but the window
+    #    is kept nevertheless.
+    commands = [(Op.WRITE, b"/foo/" + str(i).encode() + NUL, b"x")
+                for i in range(32)]
+    replies = list(c.pipeline(commands, window=4))
+    assert len(replies) == len(commands)
+    assert max(in_flight) == 4
+
+
+@virtualized
+def test_walk(client):
+    client.write(b"/foo/bar", b"baz")
+    client.write(b"/foo/boo/1", b"2")
+
+    assert list(client.walk(b"/foo")) == [
+        (b"/foo", b"", [b"bar", b"boo"]),
+        (b"/foo/bar", b"baz", []),
+        (b"/foo/boo", b"", [b"1"]),
+        (b"/foo/boo/1", b"2", []),
+    ]
+
+    assert [path for path, _value, _children
+            in client.walk(b"/foo", topdown=False)] == \
+        [b"/foo/bar", b"/foo/boo/1", b"/foo/boo", b"/foo"]
+
+    with pytest.raises(PyXSError):
+        list(client.walk(b"/foo/missing"))
+
+
+@virtualized
+def test_walk_options(client):
+    client.write(b"/foo/bar", b"baz")
+    client.write(b"/foo/boo/1/2", b"3")
+
+    assert list(client.walk(b"/foo", max_depth=1, values=False)) == [
+        (b"/foo", None, [b"bar", b"boo"]),
+        (b"/foo/bar", None, []),
+        (b"/foo/boo", None, [b"1"]),
+    ]
+
+    assert [path for path, _value, _children in client.walk(
+        b"/foo", prune=lambda path: path.endswith(b"/1"))] == \
+        [b"/foo", b"/foo/bar", b"/foo/boo"]
+
+    nodes = list(client.walk(b"/foo/boo", perms=True))
+    assert [node[3] for node in nodes] == \
+        [client.get_perms(path) for path, _value, _children, _perms in nodes]
+
+    paths = []
+    for path, _value, children in client.walk(b"/foo"):
+        paths.append(path)
+        if b"boo" in children:
+            children.remove(b"boo")
+    assert paths == [b"/foo", b"/foo/bar"]
+
+
+@virtualized
+def test_glob(client):
+    client.write(b"/foo/1/device/vif/0/state", b"4")
+    client.write(b"/foo/1/device/vif/1/state", b"1")
+    client.write(b"/foo/1/device/vbd/0/state", b"4")
+    client.write(b"/foo/2/device/vif/0/mac", b"00:16:3e")
+    client.write(b"/foo/3/name", b"")
+
+    assert sorted(client.glob(b"/foo/*/device/vif/*/state")) == [
+        (b"/foo/1/device/vif/0/state", b"4"),
+        (b"/foo/1/device/vif/1/state", b"1"),
+    ]
+    assert sorted(client.glob(b"/foo/[12]/device/v?[fd]/0")) == [
+        (b"/foo/1/device/vbd/0", b""),
+        (b"/foo/1/device/vif/0", b""),
+        (b"/foo/2/device/vif/0", b""),
+    ]
+    assert client.glob(b"/foo/3/name") == [(b"/foo/3/name", b"")]
+    assert client.glob(b"/foo/*/missing/*") == []
+
+    with pytest.raises(InvalidPath):
+        client.glob(b"/foo/*%")
+
+
+@virtualized
+@pytest.mark.parametrize("transaction_size", [None, 2])
+def test_copy_tree(client, transaction_size):
+    client.write(b"/foo/bar/baz", b"1")
+    client.write(b"/foo/bar/boo/1", b"2")
+    client.set_perms(b"/foo/bar/baz", [b"b0", b"r1"])
+
+    client.copy_tree(b"/foo/bar", b"/foo/copy", transaction_size)
+    assert client.tx_id == 0
+    assert [(path, value) for path, value, _children
+            in client.walk(b"/foo/copy")] == [
+        (b"/foo/copy", b""),
+        (b"/foo/copy/baz", b"1"),
+        (b"/foo/copy/boo", b""),
+        (b"/foo/copy/boo/1", b"2"),
+    ]
+
+    # a) permissions are copied along with the values.
+    assert client.get_perms(b"/foo/copy/baz") == [b"b0", b"r1"]
+
+    # b) neither tree may be inside the other.
+    with pytest.raises(ValueError):
+        client.copy_tree(b"/foo", b"/foo/bar/inside")
+    with pytest.raises(ValueError):
+        client.copy_tree(b"/foo/bar", b"/foo")
+
+
+@virtualized
+@pytest.mark.parametrize("transaction_size", [None, 2])
+def test_move_tree(client, transaction_size):
+    client.write(b"/foo/bar/baz", b"1")
+    client.move_tree(b"/foo/bar", b"/foo/moved", transaction_size)
+    assert client.tx_id == 0
+    assert not client.exists(b"/foo/bar")
+    assert client[b"/foo/moved/baz"] == b"1"
+
+    with pytest.raises(ValueError):
+        client.move_tree(b"/foo/moved", b"/foo")
+    assert client.exists(b"/foo/moved")
+
+
+@virtualized
+def test_set_perms_recursive(client):
+    client.write(b"/foo/bar/baz", b"1")
+    client.set_perms_recursive(b"/foo", [b"b0", b"r1"], transaction_size=2)
+    for path in [b"/foo", b"/foo/bar", b"/foo/bar/baz"]:
+        assert client.get_perms(path) == [b"b0", b"r1"]
+
+    with pytest.raises(InvalidPermission):
+        client.set_perms_recursive(b"/foo", [b"x0"])
+
+
+@virtualized
+def test_diff(client):
+    client.write(b"/foo/bar/baz", b"1")
+    client.write(b"/foo/bar/boo/1", b"2")
+    client.write(b"/foo/same", b"3")
+    snapshot = client.snapshot(b"/foo")
+    assert snapshot[b"/foo/same"] == (b"3", client.get_perms(b"/foo/same"))
+    assert not list(client.diff(b"/foo", snapshot))
+
+    client.delete(b"/foo/bar/baz")
+    client.write(b"/foo/bar/boo/1", b"changed")
+    client.write(b"/foo/new/1", b"4")
+    client.set_perms(b"/foo/same", [b"b0", b"r1"])
+    changes = list(client.diff(b"/foo", snapshot))
+    assert [(kind, path) for kind, path, _value, _perms in changes] == [
+        ("added", b"/foo/bar/baz"),
+        ("changed", b"/foo/bar/boo/1"),
+        ("removed", b"/foo/new"),
+        ("perms", b"/foo/same"),
+    ]
+
+    client.apply_diff(changes, transaction_size=2)
+    assert client.snapshot(b"/foo") == snapshot
+
+
+@virtualized
+def test_diff_implied(client):
+    client.write(b"/foo/bar/baz", b"1")
+    client.write(b"/foo/boo", b"2")
+    desired = {b"/foo/bar/baz": (b"1", None), b"/foo/new/1": (b"3", None)}
+    changes = list(client.diff(b"/foo", desired))
+    assert changes == [
+        ("removed", b"/foo/boo", b"2", None),
+        ("added", b"/foo/new/1", b"3", None),
+    ]
+
+    client.apply_diff(changes)
+    assert not list(client.diff(b"/foo", desired))
+
+
+def test_apply_diff_conflict():
+    c = Client()
+    conflicts = [False, True]
+    attempts = []
+
+    def transaction():
+        c.tx_id = 42
+
+    def commit():
+        c.tx_id = 0
+        return conflicts.pop(0)
+
+    c.transaction, c.commit = transaction, commit
+    c.ack_many = lambda commands, transaction_size=None: attempts.append(
+        (c.tx_id, list(commands)))
+
+    # a) the changes are applied in a transaction, which is retried
+    #    on conflict.
+    c.apply_diff(iter([("added", b"/foo/bar", b"1", None),
+                       ("removed", b"/foo/baz", b"2", None)]))
+    assert not conflicts
+    assert attempts == [(42, [(Op.WRITE, b"/foo/bar\x00", b"1"),
+                              (Op.RM, b"/foo/baz\x00")])] * 2
+
+
+def test_scheduler():
+    scheduler = Scheduler({Router.INTERACTIVE: 2, Router.BULK: 1},
+                          max_in_flight=1)
+    for rq_id in range(3):
+        scheduler.queues[Router.BULK].append(_Ticket(rq_id, Router.BULK))
+        scheduler.queues[Router.INTERACTIVE].append(
+            _Ticket(rq_id + 3, Router.INTERACTIVE))
+
+    order = []
+    with scheduler.lock:
+        scheduler.grant()
+    while scheduler.in_flight:
+        rq_id, = scheduler.in_flight
+        order.append(rq_id)
+        scheduler.release(rq_id)
+
+    assert order == [3, 4, 0, 5, 1, 2]
+    assert scheduler.latency[Router.INTERACTIVE].count == 3
+    assert scheduler.latency[Router.BULK].count == 3
+
+
+def test_scheduler_threads():
+    scheduler = Scheduler({Router.INTERACTIVE: 1}, max_in_flight=2)
+    admitted = []
+
+    def admit(rq_id):
+        scheduler.admit(rq_id, Router.INTERACTIVE)
+        admitted.append(rq_id)
+
+    threads = [Thread(target=admit, args=(rq_id, )) for rq_id in range(8)]
+    for t in threads:
+        t.daemon = True
+        t.start()
+
+    # a) each freed slot admits a single waiter.
+    while len(admitted) < len(threads):
+        time.sleep(.01)
+        assert len(scheduler.in_flight) <= 2
+        if len(scheduler.in_flight) == 2:
+            with scheduler.lock:
+                rq_id = min(scheduler.in_flight)
+            scheduler.release(rq_id)
+
+    for t in threads:
+        t.join()
+    assert sorted(admitted) == list(range(8))
+
+
+def test_scheduler_reserved():
+    scheduler = Scheduler({Router.INTERACTIVE: 1, Router.BULK: 1},
+                          max_in_flight=2, reserved=1)
+    scheduler.queues[Router.BULK].extend(
+        _Ticket(rq_id, Router.BULK) for rq_id in range(2))
+    with scheduler.lock:
+        scheduler.grant()
+    assert list(scheduler.in_flight) == [0]
+
+    scheduler.queues[Router.INTERACTIVE].append(
+        _Ticket(2, Router.INTERACTIVE))
+    with scheduler.lock:
+        scheduler.grant()
+    assert sorted(scheduler.in_flight) == [0, 2]
+
+
+def test_scheduler_adapt():
+    # The router doesn't adapt unless asked to.
+    scheduler = Client().router.scheduler
+    assert scheduler.window == scheduler.max_in_flight
+
+    scheduler = Scheduler({Router.INTERACTIVE: 1}, max_in_flight=16,
+                          adaptive=True)
+    assert scheduler.window == 1
+
+    def epoch(rtt):
+        for _ in range(scheduler.window):
+            scheduler.adapt(rtt)
+        return scheduler.window
+
+    # Slow start doubles the window ...
+    assert [epoch(0.001) for _ in range(5)] == [2, 4, 8, 16, 16]
+    # ... until the round-trip time rises.
+    assert epoch(0.003) == 8
+    assert epoch(0.001) == 9
+    assert epoch(0.001) == 10
+    assert epoch(0.01) == 5
+
+
+@virtualized
+def test_with_priority(client):
+    bulk = client.with_priority(Router.BULK)
+    assert bulk.router is client.router
+    assert copy.copy(bulk).priority == Router.BULK
+
+    bulk.write(b"/foo/bar", b"baz")
+    client[b"/foo/bar"]
+    latency = client.router.latency
+    assert latency[Router.BULK].count == 1
+    assert latency[Router.INTERACTIVE].count >= 1
+
+    with pytest.raises(ValueError):
+        client.with_priority("unknown")
+
+
+@virtualized
+def test_wait_for(client):
+    client.write(b"/foo/state", b"1")
+    assert client.wait_for(b"/foo/state", b"1") == b"1"
+
+    Timer(0.1, client.write, args=(b"/foo/state", b"4")).start()
+    assert client.wait_for(b"/foo/state", lambda value: value == b"4",
+                           timeout=5) == b"4"
+
+    with pytest.raises(PyXSError) as exc_info:
+        client.wait_for(b"/foo/state", b"6", timeout=0.1)
+    assert exc_info.value.args[0] == errno.ETIMEDOUT
+
+
+@virtualized
+def test_wait_for_all(client):
+    paths = [b"/foo/" + str(i).encode() for i in range(64)]
+
+    def write():
+        for path in paths:
+            client.write(path, b"4")
+
+    Timer(0.1, write).start()
+    values = client.wait_for_all(dict((path, b"4") for path in paths),
+                                 timeout=5)
+    assert values == dict((path, b"4") for path in paths)
+
+    assert client.wait_for_all({
+        b"/foo/missing": lambda value: value is None,
+        b"/foo/0": b"4"
+    }) == {b"/foo/missing": None, b"/foo/0": b"4"}
+
+
+@virtualized
+@pytest.mark.parametrize("compress", [True, False])
+def test_blob(client, compress):
+    data = os.urandom(8192) + b"\x00" * 8192
+    client.write_blob(b"/foo/blob", data, compress, chunk_size=512)
+    assert client.read_blob(b"/foo/blob") == data
+
+    # a) stale chunks of a larger blob are removed, but the rest of
+    #    the children are kept.
+    client.write(b"/foo/blob/meta", b"1")
+    client.write_blob(b"/foo/blob", b"small", compress)
+    assert sorted(client.list(b"/foo/blob")) == [b"0", b"meta"]
+    assert client.read_blob(b"/foo/blob") == b"small"
+
+    # b) an empty blob has no chunks.
+    client.write_blob(b"/foo/blob", b"", compress)
+    assert client.read_blob(b"/foo/blob") == b""
+
+    # c) broken data.
+    client.write_blob(b"/foo/blob", b"data", compress)
+    client.write(b"/foo/blob/0", b"AAAA")
+    with pytest.raises(PyXSError) as exc_info:
+        client.read_blob(b"/foo/blob")
+    assert exc_info.value.args[0] == errno.EIO
+
+    # d) not a blob.
+    with pytest.raises(PyXSError) as exc_info:
+        client.read_blob(b"/foo/blob/0")
+    assert exc_info.value.args[0] == errno.EINVAL
+
+
 @virtualized
 def test_get_domain_path(client):
     # Note, that XenStore doesn't care if a domain exists, but
@@ -407,6 +913,174 @@ def test_monitor_different_tokens(client):
         assert set(token for wpath, token in events) == set([b"boo", b"baz"])
 
 
+@virtualized
+def test_monitor_watch_many(client):
+    xfail_if_xenbus(client)
+
+    pairs = [(b"/foo/" + str(i).encode(), b"token" + str(i).encode())
+             for i in range(64)]
+    with client.monitor() as m:
+        m.watch_many(pairs)
+        assert m.watched == set(wpath for wpath, _token in pairs)
+        assert set(islice(m.wait(), len(pairs))) == set(pairs)
+
+        m.unwatch_many(pairs[::2])
+        assert m.watched == set(wpath for wpath, _token in pairs[1::2])
+
+        # a) unwatching an unknown watch fails, but the rest are
+        #    still unwatched.
+        with pytest.raises(PyXSError):
+            m.unwatch_many([(b"/foo/missing", b"token")] + pairs[1::2])
+        assert not m.watched
+
+    assert not client.router.monitors
+
+
+@virtualized
+def test_monitor_shared_watch(client):
+    xfail_if_xenbus(client)
+
+    m1, m2 = client.monitor(), client.monitor()
+    m1.watch(b"/foo/bar", b"m1")
+    m2.watch(b"/foo/bar", b"m2")
+    assert len(client.router.monitors) == 1
+    assert next(m1.wait()) == (b"/foo/bar", b"m1")
+    assert next(m2.wait()) == (b"/foo/bar", b"m2")
+
+    with pytest.raises(PyXSError):
+        m1.watch(b"/foo/bar", b"m1")
+
+    client.write(b"/foo/bar/baz", b"1")
+    assert next(m1.wait()) == (b"/foo/bar/baz", b"m1")
+    assert next(m2.wait()) == (b"/foo/bar/baz", b"m2")
+
+    # a) the watch is still registered for the remaining monitor.
+    m1.close()
+    client.write(b"/foo/bar", b"2")
+    assert next(m2.wait()) == (b"/foo/bar", b"m2")
+    assert m1.events.empty()
+
+    m2.close()
+    assert not client.router.monitors
+
+
+def test_monitor_watch_many_failed():
+    c = Client()
+
+    def send(packet, priority=None):
+        rvar = RVar()
+        rvar.set(Packet(Op.ERROR, b"EACCES\x00", rq_id=packet.rq_id))
+        return rvar
+
+    c.router.send = send
+
+    # a) the tokens piggybacking on a failed watch are unsubscribed
+    #    along with it.
+    m = c.monitor()
+    with pytest.raises(PyXSError):
+        m.watch_many([(b"/foo", b"boo"), (b"/foo", b"baz")])
+    assert not m.watched
+    assert not c.router.monitors
+
+
+@virtualized
+@pytest.mark.parametrize("dedicated", [True, False])
+def test_monitor_close(client, dedicated):
+    xfail_if_xenbus(client)
+
+    m = client.monitor(dedicated=dedicated)
+    m.watch_many([(b"/foo/bar", b"boo"), (b"/foo/baz", b"boo")])
+    m.close()
+    assert not m.watched
+    assert not client.router.monitors
+
+    # The watches are gone, so they can be added again.
+    with client.monitor() as m:
+        m.watch(b"/foo/bar", b"boo")
+
+
+@virtualized
+def test_monitor_close_dedicated_shared(client):
+    xfail_if_xenbus(client)
+
+    other = client.monitor()
+    other.watch(b"/foo/bar", b"other")
+    assert next(other.wait()) == (b"/foo/bar", b"other")
+
+    # a) the watch shared with another monitor survives.
+    m = client.monitor(dedicated=True)
+    m.watch(b"/foo/bar", b"boo")
+    m.close()
+    client.write(b"/foo/bar", b"1")
+    assert next(other.wait()) == (b"/foo/bar", b"other")
+    other.close()
+
+    # b) so does a running transaction.
+    m = client.monitor(dedicated=True)
+    m.watch(b"/foo/bar", b"boo")
+    tx = copy.copy(client)
+    tx.transaction()
+    m.close()
+    tx.write(b"/foo/bar", b"2")
+    assert tx.commit()
+    assert not client.router.transactions
+
+
+def test_monitor_overflow():
+    events = [Event(b"/foo/" + str(i).encode(), b"token") for i in range(4)]
+
+    # a) drop oldest.
+    m = Monitor(Client(), maxsize=2, overflow=Monitor.DROP_OLDEST)
+    for event in events:
+        m.deliver(event)
+    assert m.dropped == 2
+    assert [m.events.get_nowait() for _ in range(2)] == events[2:]
+
+    # b) resync.
+    m = Monitor(Client(), maxsize=2, overflow=Monitor.RESYNC)
+    m.unwatch_queue.add((b"/foo", b"token"))
+    for event in events:
+        m.deliver(event)
+    assert m.dropped == 3
+    assert list(islice(m.wait(), 2)) == [Monitor.OVERFLOW, events[3]]
+
+    # c) invalid policy.
+    with pytest.raises(ValueError):
+        Monitor(Client(), overflow="ignore")
+
+
+def test_monitor_unwatched():
+    m = Monitor(Client())
+    m.unwatch_queue.add((b"/foo", b"token"))
+    m.deliver(Event(b"/bar/baz", b"token"))
+    m.deliver(Event(b"/foo/bar", b"token"))
+    assert next(m.wait()) == (b"/foo/bar", b"token")
+
+
+def test_monitor_fileno():
+    m = Monitor(Client())
+    m.unwatch_queue.add((b"/foo", b"token"))
+    m.deliver(Event(b"/foo", b"token"))
+
+    # a) events queued before the first call are signalled too.
+    fd = m.fileno()
+    assert select.select([m], [], [], 0)[0] == [m]
+    assert m.poll_events() == [(b"/foo", b"token")]
+    assert select.select([fd], [], [], 0)[0] == []
+    assert m.poll_events() == []
+
+    # b) many events make a single wakeup.
+    for i in range(70000):
+        m.deliver(Event(b"/foo", b"token"))
+    assert select.select([fd], [], [], 0)[0] == [fd]
+    assert len(m.poll_events()) == 70000
+    assert select.select([fd], [], [], 0)[0] == []
+
+    m.unwatch_queue.clear()  # Not connected.
+    m.close()
+    assert m.signal is None
+
+
 class Latch(object):
     def __init__(self, initial):
         self.value = initial
@@ -452,6 +1126,92 @@ def test_multiple_monitors(client):
     assert set(events2) == set([Event(b"/foo/bar", b"baz")])
 
 
+def fork_and_wait(target):
+    pid = os.fork()
+    if not pid:
+        try:
+            target()
+        except BaseException:
+            os._exit(1)
+        else:
+            os._exit(0)
+
+    _pid, status = os.waitpid(pid, 0)
+    return os.WEXITSTATUS(status)
+
+
+@virtualized
+def test_fork(client):
+    xfail_if_xenbus(client)
+
+    client[b"/foo/bar"] = b"baz"
+    m = client.monitor()
+    m.watch(b"/foo/bar", b"boo")
+    assert next(m.wait()) == (b"/foo/bar", b"boo")
+
+    def child():
+        assert client.router.is_forked
+        assert client[b"/foo/bar"] == b"baz"
+        assert not client.router.is_forked
+        assert client.router.thread.is_alive()
+
+        # Watches are not inherited.
+        assert not m.watched
+        m.watch(b"/foo/bar", b"child")
+        assert next(m.wait()) == (b"/foo/bar", b"child")
+
+        client[b"/foo/bar"] = b"child"
+        client.close()
+
+    assert fork_and_wait(child) == 0
+
+    # The parent is not affected by the child.
+    assert next(m.wait()) == (b"/foo/bar", b"boo")
+    assert client[b"/foo/bar"] == b"child"
+    assert m.watched == set([b"/foo/bar"])
+
+
+@virtualized
+def test_fork_monitor_fileno(client):
+    xfail_if_xenbus(client)
+
+    m = client.monitor()
+    fd = m.fileno()
+    m.watch(b"/foo/bar", b"boo")
+    assert m.next_event(timeout=5) == (b"/foo/bar", b"boo")
+    m.poll_events()
+
+    def child():
+        client.write(b"/foo/baz", b"")
+        assert m.fileno() == fd
+
+        m.watch(b"/foo/baz", b"child")
+        assert select.select([fd], [], [], 5)[0]
+        assert m.next_event(timeout=5) == (b"/foo/baz", b"child")
+        client.close()
+
+    assert fork_and_wait(child) == 0
+
+    # The child was notified through a pipe of its own.
+    assert not select.select([fd], [], [], .1)[0]
+    m.close()
+
+
+@virtualized
+def test_for_worker():
+    c = Client.for_worker()
+    assert c is Client.for_worker()
+    assert c.router.thread.is_alive()
+
+    def child():
+        other = Client.for_worker()
+        assert other is not c
+        assert other.router.thread.is_alive()
+        assert other.read(b"/local") == b""
+
+    assert fork_and_wait(child) == 0
+
+
 @virtualized
 def test_header_decode_error(client):
     # The following packet's header cannot be decoded to UTF-8, but
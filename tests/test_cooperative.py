@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import time
+from threading import Thread
+
+import pytest
+
+from pyxs.client import Client
+from pyxs.connection import UnixSocketConnection
+from pyxs.cooperative import CooperativeRouter, Primitives
+from pyxs.exceptions import ConnectionError, PyXSError
+
+from . import virtualized
+
+
+def setup_function(f):
+    try:
+        with Client() as c:
+            c.delete(b"/foo")
+    except PyXSError:
+        pass
+
+
+@pytest.yield_fixture
+def client():
+    with Client(router=CooperativeRouter(UnixSocketConnection())) as c:
+        yield c
+
+
+def test_no_thread():
+    router = CooperativeRouter(UnixSocketConnection())
+    assert not hasattr(router, "thread")
+
+    with pytest.raises(ConnectionError):
+        Client(router=router).read(b"/foo")
+
+
+@virtualized
+def test_read_write(client):
+    client[b"/foo/bar"] = b"baz"
+    assert client[b"/foo/bar"] == b"baz"
+    assert list(client.walk(b"/foo")) == [
+        (b"/foo", b"", [b"bar"]), (b"/foo/bar", b"baz", [])]
+
+
+@virtualized
+def test_concurrent_callers(client):
+    errors = []
+
+    def worker(i):
+        path = b"/foo/" + str(i).encode()
+        try:
+            for j in range(32):
+                client[path] = str(j).encode()
+                assert client[path] == str(j).encode()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [Thread(target=worker, args=(i, )) for i in range(16)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert not errors
+    assert len(client.list(b"/foo")) == 16
+
+
+@virtualized
+def test_monitor(client):
+    with client.monitor() as m:
+        m.watch(b"/foo/bar", b"boo")
+        waiter = m.wait()
+        assert next(waiter) == (b"/foo/bar", b"boo")
+
+        Thread(target=lambda: client.write(b"/foo/bar", b"baz")).start()
+        assert next(waiter) == (b"/foo/bar", b"boo")
+
+
+@virtualized
+def test_monitor_timeout(client):
+    with client.monitor() as m:
+        m.watch(b"/foo/bar", b"boo")
+        assert m.next_event(timeout=5) == (b"/foo/bar", b"boo")
+
+        # a) the wait times out, and the router keeps working after.
+        started = time.time()
+        assert m.next_event(timeout=.1) is None
+        assert time.time() - started < 1
+        assert client.router.latency == {}
+
+        client.write(b"/foo/bar", b"baz")
+        assert m.next_event(timeout=5) == (b"/foo/bar", b"boo")
+
+
+@virtualized
+def test_gevent():
+    gevent = pytest.importorskip("gevent")
+
+    router = CooperativeRouter(UnixSocketConnection(), Primitives.gevent())
+    with Client(router=router) as c:
+        paths = [b"/foo/" + str(i).encode() for i in range(256)]
+        gevent.joinall([gevent.spawn(c.write, path, path)
+                        for path in paths])
+        greenlets = [gevent.spawn(c.read, path) for path in paths]
+        gevent.joinall(greenlets)
+        assert [g.value for g in greenlets] == paths
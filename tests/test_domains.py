@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import errno
+
+from pyxs._internal import Op
+from pyxs.client import Client
+from pyxs.domains import DomainRegistry
+from pyxs.exceptions import PyXSError
+
+from . import FakeClient as BaseFakeClient, virtualized
+
+
+def setup_function(f):
+    try:
+        with Client() as c:
+            c.delete(b"/foo")
+    except PyXSError:
+        pass
+
+
+class FakeClient(BaseFakeClient):
+    def __init__(self):
+        self.introduced = {}
+        self.denied = False
+
+    def list(self, path):
+        return [str(domid).encode() for domid in self.introduced]
+
+    def reply(self, op, domid):
+        domid = int(domid[:-1])
+        if op == Op.GET_DOMAIN_PATH:
+            return b"/local/domain/" + str(domid).encode()
+        elif self.denied:
+            return PyXSError(errno.EACCES, "")
+        return b"T" if self.introduced[domid] else b"F"
+
+
+def test_domain_registry_released():
+    client = FakeClient()
+    client.introduced = {0: True, 1: True, 2: False}
+    domains = DomainRegistry(client, root=b"/foo")
+    assert [domid for _kind, domid, _path in domains.refresh()] == [0, 1]
+
+    # a) the domain is released before its entry is removed.
+    client.introduced[1] = False
+    assert domains.refresh() == [("released", 1, b"/local/domain/1")]
+    del client.introduced[1]
+    assert not domains.refresh()
+
+    # b) the listing is trusted if the checks are denied.
+    client.denied = True
+    assert domains.refresh() == [("introduced", 2, b"/local/domain/2")]
+
+
+@virtualized
+def test_domain_registry():
+    with Client() as c:
+        c.write(b"/foo/0", b"")
+        with DomainRegistry(c, root=b"/foo") as domains:
+            assert list(domains) == [0]
+            assert domains.get_domain_path(0) == c.get_domain_path(0)
+            assert domains.get_domain_path(5) == c.get_domain_path(5)
+            assert not domains.refresh()
+
+            # a) domains, which aren't introduced, are skipped.
+            c.write(b"/foo/1", b"")
+            c.write(b"/foo/not-a-domain", b"")
+            assert not domains.refresh()
+
+            c.delete(b"/foo/0")
+            assert domains.refresh() == [
+                ("released", 0, c.get_domain_path(0)),
+            ]
+            assert 0 not in domains and 1 not in domains
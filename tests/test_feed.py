@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import pytest
+
+from pyxs.client import Client
+from pyxs.exceptions import PyXSError
+from pyxs.feed import ChangeLog, ChangeFeed
+
+from . import virtualized
+
+
+def setup_function(f):
+    try:
+        with Client() as c:
+            c.delete(b"/foo")
+    except PyXSError:
+        pass
+
+
+@pytest.fixture
+def filename(tmpdir):
+    return str(tmpdir.join("changes"))
+
+
+def test_change_log(filename):
+    with ChangeLog(filename) as log:
+        changes = log.append([(1.0, b"/foo", b"token", b"bar"),
+                              (2.0, b"/foo/bar", b"token", None)])
+        assert [change.seq for change in changes] == [1, 2]
+        assert list(log.replay()) == changes
+        assert list(log.replay(1)) == changes[1:]
+        assert list(log.replay(2)) == []
+
+    # a) sequence numbers continue after re-opening.
+    with ChangeLog(filename) as log:
+        assert log.last_seq == 2
+        [change] = log.append([(3.0, b"/foo", b"token", b"")])
+        assert change.seq == 3
+        assert list(log.replay(2)) == [change]
+
+
+def test_change_log_partial_record(filename):
+    with ChangeLog(filename) as log:
+        log.append([(1.0, b"/foo", b"token", b"bar")] * 2)
+
+    with open(filename, "r+b") as f:
+        f.seek(-2, 2)
+        f.truncate()
+
+    # The partial record is discarded and its ``seq`` reused.
+    with ChangeLog(filename) as log:
+        assert log.last_seq == 1
+        [change] = log.append([(2.0, b"/foo", b"token", b"boo")])
+        assert change.seq == 2
+        assert [c.value for c in log.replay()] == [b"bar", b"boo"]
+
+
+@virtualized
+def test_change_feed(filename):
+    with Client() as c:
+        c[b"/foo/bar"] = b"baz"
+        m = c.monitor()
+        m.watch(b"/foo", b"token")
+
+        with ChangeLog(filename) as log:
+            feed = ChangeFeed(m, log)
+            feed.run(1)  # The initial event.
+
+            c[b"/foo/bar"] = b"boo"
+            c.delete(b"/foo/bar")
+            feed.run(2)
+
+            changes = list(log.replay(1))
+            assert [(change.seq, change.path, change.token)
+                    for change in changes] == [
+                (2, b"/foo/bar", b"token"), (3, b"/foo/bar", b"token")
+            ]
+
+            # The last event is re-read after the removal.
+            assert changes[-1].value is None
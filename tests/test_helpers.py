@@ -3,7 +3,8 @@ import string
 import pytest
 
 from pyxs.exceptions import InvalidPath, InvalidPermission
-from pyxs.helpers import check_path, check_watch_path, check_perms
+from pyxs.helpers import check_path, check_watch_path, check_pattern, \
+    check_perms, percentile
 
 
 def test_check_path():
@@ -35,6 +36,16 @@ def test_check_path():
     check_path(b"/")
 
 
+def test_check_pattern():
+    check_pattern(b"/local/domain/*/device/vif/[0-9]/stat?")
+
+    with pytest.raises(InvalidPath):
+        check_pattern(b"/foo/*/")
+
+    with pytest.raises(InvalidPath):
+        check_pattern(b"/foo/*%")
+
+
 def test_check_watch_path():
     # a) ordinary path should be checked with `check_path()`
     with pytest.raises(InvalidPath):
@@ -70,3 +81,12 @@ def test_check_perms():
     # OK-case
     check_perms(b"w0 r0 b0 n0".split())
     check_perms([b"w999999"])  # valid, even though it overflows int32.
+
+
+def test_percentile():
+    assert percentile([], .5) == 0.0
+    samples = list(range(1, 101))
+    assert percentile(samples, .5) == 50
+    assert percentile(samples, .99) == 99
+    assert percentile(samples, 1) == 100
+    assert percentile([7], .99) == 7
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import json
+import time
+
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+import pytest
+
+from pyxs import Client
+from pyxs.client import Monitor
+from pyxs.exceptions import PyXSError
+from pyxs.loadgen import Stats, Workload, main, parse_mix
+
+from . import virtualized
+
+
+def setup_function(f):
+    try:
+        with Client() as c:
+            c.delete(b"/foo")
+    except PyXSError:
+        pass
+
+
+def test_parse_mix():
+    assert parse_mix("read=3,write=1") == {"read": 3.0, "write": 1.0}
+
+    for mix in ["read", "read=", "foo=1", "read=0"]:
+        with pytest.raises(ValueError):
+            parse_mix(mix)
+
+
+def test_stats():
+    stats = Stats()
+    for elapsed in [.001, .002, .003]:
+        stats.add("read", elapsed)
+    stats.add("transaction", .004)
+    stats.add_conflict()
+    stats.add_lag(.005)
+    stats.add_error("write")
+
+    report = stats.snapshot()
+    assert report["operations"]["read"]["count"] == 3
+    assert report["operations"]["read"]["p50"] == .002
+    assert report["operations"]["read"]["max"] == .003
+    assert report["conflict_rate"] == .5
+    assert report["lag"]["count"] == 1
+    assert report["errors"] == 1
+
+    # a) the stats are reset after a snapshot.
+    assert stats.snapshot()["operations"] == {}
+
+    # b) a conflict without a completed transaction.
+    stats.add("read", .001)
+    stats.add_conflict()
+    report = stats.snapshot()
+    assert report["conflict_rate"] == 1.0
+    assert list(report["operations"]) == ["read"]
+
+
+def test_watch_deadline():
+    class FakeClient(object):
+        def write(self, path, value):
+            pass
+
+    workload = Workload([Client()], b"/foo/loadgen", {"watch": 1})
+    workload.deadline = time.time() + .1
+
+    # a) a lost event doesn't hold the worker past the end of the run.
+    started = time.time()
+    workload.do_watch(FakeClient(), None, Monitor(Client()), b"/foo/probe")
+    assert time.time() - started < 1
+    assert not workload.stats.snapshot()["lag"]["count"]
+
+
+def test_worker_failure():
+    c = Client()
+
+    def send(packet, priority=None):
+        raise RuntimeError("broken")
+
+    c.router.send = send
+
+    # a) the run stops and fails instead of losing the workers.
+    workload = Workload([c], b"/foo/loadgen", {"read": 1})
+    started = time.time()
+    with pytest.raises(RuntimeError):
+        workload.run(2, 5, 1, lambda report: None)
+    assert time.time() - started < 1
+
+
+@virtualized
+def test_main():
+    stdout = StringIO()
+    assert main(["--root", "/foo/loadgen", "--threads", "4",
+                 "--connections", "2", "--domains", "2", "--keys", "2",
+                 "--duration", "0.5", "--interval", "0.25", "--json"],
+                stdout=stdout) == 0
+
+    reports = [json.loads(line) for line in stdout.getvalue().splitlines()]
+    assert len(reports) == 2
+    assert sum(report["operations"]["read"]["count"]
+               for report in reports) > 0
+
+    # a) the synthetic tree is removed afterwards.
+    with Client() as c:
+        assert not c.exists(b"/foo/loadgen")
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import time
+
+from pyxs._internal import Event
+from pyxs.client import Client
+from pyxs.exceptions import PyXSError
+from pyxs.probe import ProbeSample, WatchProbe, _ProbeMonitor
+
+from . import virtualized
+
+
+def setup_function(f):
+    try:
+        with Client() as c:
+            c.delete(b"/foo")
+    except PyXSError:
+        pass
+
+
+def test_summary():
+    probe = WatchProbe(Client(), path=b"/foo/probe", samples=2)
+    assert probe.summary()["total"]["p99"] == 0.0
+
+    for i in range(3):
+        probe.samples.append(ProbeSample(0, i + .3, i, .2, .1))
+
+    summary = probe.summary()
+    assert summary["count"] == 2
+    assert summary["xenstored"] == {"p50": 1, "p90": 2, "p99": 2, "max": 2}
+    assert summary["queue"]["max"] == .1
+
+
+def test_wait():
+    probe = WatchProbe(Client(), path=b"/foo/probe")
+    probe.monitor = m = _ProbeMonitor(probe.client)
+    m.unwatch_queue.add((b"/foo/probe", b"probe"))
+    assert probe._wait(1, time.time() + .05) is None
+
+    # a) the event for an earlier measurement arrives late, and is
+    #    skipped.
+    for _ in range(2):
+        m.deliver(Event(b"/foo/probe", b"probe"))
+    times = m.delivered[2]
+    assert probe._wait(2, time.time() + 1) == times
+    assert probe.consumed == 2 and not m.delivered
+
+
+@virtualized
+def test_probe():
+    with Client() as c:
+        probe = WatchProbe(c, path=b"/foo/probe")
+        probe.open(start=False)
+        sample = probe.probe()
+        assert sample.total > 0
+        assert abs(sample.total - (sample.xenstored + sample.dispatch +
+                                   sample.queue)) < 1e-6
+        assert c.read(b"/foo/probe") == \
+            "{0:.6f}".format(sample.timestamp).encode()
+        probe.close()
+
+        with WatchProbe(c, path=b"/foo/probe", interval=.05) as probe:
+            time.sleep(.2)
+
+        assert probe.summary()["count"] > 1
+        assert not probe.lost
+        assert not c.exists(b"/foo/probe")
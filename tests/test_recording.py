@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import pytest
+
+from pyxs._internal import Op, Packet
+from pyxs.client import Client, Router
+from pyxs.connection import PacketConnection, UnixSocketConnection
+from pyxs.exceptions import PyXSError
+from pyxs.recording import (RECEIVED, SENT, RecordingConnection, Replayer,
+                            read_recording)
+
+from . import virtualized
+
+
+def setup_function(f):
+    try:
+        with Client() as c:
+            c.delete(b"/foo")
+    except PyXSError:
+        pass
+
+
+@pytest.fixture
+def filename(tmpdir):
+    return str(tmpdir.join("session.xsrec"))
+
+
+class EchoConnection(PacketConnection):
+    path = "echo"
+
+    def __init__(self):
+        self.packets = []
+
+    def create_transport(self):
+        return self
+
+    def send(self, packet):
+        self.packets.append(packet)
+
+    def recv(self):
+        return self.packets.pop(0)
+
+    def close(self, silent=True):
+        self.transport = None
+
+
+def test_record(filename):
+    connection = RecordingConnection(EchoConnection(), filename)
+    connection.connect()
+    assert connection.is_connected
+    packet = Packet(Op.WRITE, b"/foo\x00bar", 42, 7)
+    connection.send(packet)
+    assert connection.recv() == packet
+    connection.close()
+
+    records = list(read_recording(filename))
+    assert [(r.direction, r.packet) for r in records] == [
+        (SENT, packet), (RECEIVED, packet)]
+    assert records[0].timestamp <= records[1].timestamp
+
+    # a) a partially written record is ignored.
+    with open(filename, "ab") as f:
+        f.write(b"\x00" * 5)
+    assert len(list(read_recording(filename))) == 2
+
+
+def test_record_order(filename):
+    class ReplyingConnection(EchoConnection):
+        def send(self, packet):
+            # The router thread receives the reply right away.
+            super(ReplyingConnection, self).send(packet)
+            connection.recv()
+
+    connection = RecordingConnection(ReplyingConnection(), filename)
+    connection.connect()
+    connection.send(Packet(Op.READ, b"/foo\x00", 42, 0))
+    connection.close()
+
+    assert [r.direction for r in read_recording(filename)] == [
+        SENT, RECEIVED]
+
+
+def test_read_recording_invalid(filename):
+    with open(filename, "wb") as f:
+        f.write(b"garbage")
+
+    with pytest.raises(ValueError):
+        list(read_recording(filename))
+
+
+@virtualized
+def test_replay(filename):
+    router = Router(RecordingConnection(UnixSocketConnection(), filename))
+    with Client(router=router) as c:
+        c.write(b"/foo/bar", b"baz")
+        c.transaction()
+        c.write(b"/foo/boo", b"")
+        assert c.commit()
+        c.delete(b"/foo")
+
+    replayer = Replayer(UnixSocketConnection(), read_recording(filename),
+                        speed=0)
+    replayer.run()
+    assert not replayer.pending
+    assert not replayer.errors and not replayer.skipped
+    assert replayer.latency["WRITE"].count == 2
+    assert replayer.latency["TRANSACTION_END"].count == 1
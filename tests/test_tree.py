@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import copy
+
+import pytest
+
+from pyxs.client import Client
+from pyxs.exceptions import PyXSError
+from pyxs.tree import Node
+
+from . import virtualized
+
+
+def setup_function(f):
+    try:
+        with Client() as c:
+            c.delete(b"/foo")
+    except PyXSError:
+        pass
+
+
+class FakeClient(object):
+    tree = {
+        b"/foo": (b"", [b"bar", b"baz"]),
+        b"/foo/bar": (b"1", [b"boo"]),
+        b"/foo/bar/boo": (b"2", []),
+        b"/foo/baz": (b"3", []),
+    }
+
+    def __init__(self):
+        self.requests = []
+
+    def read(self, path):
+        self.requests.append(("read", path))
+        return self.tree[path][0]
+
+    def list(self, path):
+        self.requests.append(("list", path))
+        return self.tree[path][1]
+
+    def fetch(self, paths):
+        self.requests.append(("fetch", list(paths)))
+        return [(path, ) + self.tree[path] for path in paths
+                if path in self.tree]
+
+
+def test_node():
+    client = FakeClient()
+    root = Node(client, b"/foo")
+    assert not client.requests
+
+    assert root[b"bar"][b"boo"].value == b"2"
+    assert root[b"bar"][b"boo"].name == b"boo"
+    assert list(root) == [b"bar", b"baz"] and len(root) == 2
+    assert b"baz" in root and root.get(b"missing") is None
+    with pytest.raises(KeyError):
+        root[b"missing"]
+
+    # a) nodes are loaded once.
+    assert root[b"bar"][b"boo"].value == b"2"
+    assert client.requests == [("list", b"/foo"), ("list", b"/foo/bar"),
+                               ("read", b"/foo/bar/boo")]
+
+    # b) ... until refreshed.
+    root.refresh()
+    assert root.keys() == [b"bar", b"baz"]
+    assert client.requests[-1] == ("list", b"/foo")
+
+
+def test_node_prefetch():
+    client = FakeClient()
+    root = Node(client, b"/foo")
+    root.prefetch(depth=1)
+    assert client.requests == [("fetch", [b"/foo"]),
+                               ("fetch", [b"/foo/bar", b"/foo/baz"])]
+
+    assert [(name, node.value) for name, node in root.items()] == [
+        (b"bar", b"1"), (b"baz", b"3")]
+    assert len(client.requests) == 2
+
+    # a) loaded nodes are not fetched again.
+    root.prefetch(depth=2)
+    assert client.requests[2:] == [("fetch", [b"/foo/bar/boo"])]
+
+
+@virtualized
+def test_tree():
+    with Client() as c:
+        c.write(b"/foo/bar/boo", b"2")
+        c.write(b"/foo/baz", b"3")
+        root = c.tree(b"/foo", prefetch=2)
+        c.delete(b"/foo")
+        assert root[b"bar"][b"boo"].value == b"2"
+
+        # a) a tree of a client in a transaction is pinned to it.
+        c.write(b"/foo/bar", b"1")
+        c.transaction()
+        root = c.tree(b"/foo")
+        copy.copy(c).write(b"/foo/bar", b"2")
+        assert root[b"bar"].value == b"1"
+        c.rollback()
+
+        root.refresh()
+        with pytest.raises(PyXSError):
+            root[b"bar"].value